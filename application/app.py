@@ -1,12 +1,42 @@
+import os
 import streamlit as st
 import pandas as pd
 import json
 import time
-from pipeline_1 import chain, intermediate_results
-from pipeline_2 import chain2, intermediate_results2
-from pipeline_3 import chain3, intermediate_results3  # New import for delete database
-from tools.database_tools import serialize
-from httpx import HTTPStatusError
+import io
+import csv
+import tempfile
+from pipeline_1 import chain, stream_answer
+from pipeline_2 import stream_answer2
+from pipeline_3 import stream_answer3  # New import for delete database
+from tools.database_tools import serialize, write_select_query_csv
+from tools.resources import resources, WARMUP_RESOURCES
+from tools.trace import Trace, use_trace
+from tools.instrumentation import metrics, start_metrics_server
+from tools.retry_policy import retry_policy, classify_error, TRANSIENT_ERRORS
+from tools.llm_scheduler import llm_scheduler
+from tools.schema_introspection import start_schema_refresher
+
+@st.cache_resource
+def warm_up_resources():
+    """Builds the configured heavy resources once per process, before the first request."""
+    return resources.warm_up(WARMUP_RESOURCES) if WARMUP_RESOURCES else {}
+
+warm_up_resources()
+
+@st.cache_resource
+def metrics_server():
+    """Starts the metrics endpoint once per process if METRICS_PORT is set."""
+    return start_metrics_server()
+
+@st.cache_resource
+def schema_refresher():
+    """Keeps the structured schema in step with the database from a background thread."""
+    return start_schema_refresher()
+
+schema_refresher()
+
+metrics_server()
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
@@ -29,94 +59,158 @@ column_names = []
 insights = "N/A"
 response = ""
 
-def invoke_chain_with_retry(question, max_retries=3, delay=5):
-    """Retries invoking the chain if rate limited."""
-    attempts = 0
-    while attempts < max_retries:
+PREVIEW_ROWS = 5
+STREAM_INSIGHTS = os.getenv("STREAM_INSIGHTS", "true").lower() == "true"
+def csv_bytes(rows):
+    """Encodes result rows, header row first, as CSV for the download button."""
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue().encode("utf-8")
+
+def discard_csv_export():
+    """Deletes the prepared CSV export file, if any, and forgets it."""
+    export = st.session_state.pop("csv_export", None)
+    if export and "path" in export:
         try:
-            return chain.invoke({"question": question})
-        except HTTPStatusError as e:
-            if e.response.status_code == 429:  
-                st.warning("Rate limit exceeded. Retrying in 5 seconds...")
-                time.sleep(delay)
-                attempts += 1
-            else:
-                raise e  
-    st.error("Failed after multiple attempts due to rate limits.")
-    return None
-
-def invoke_chain2_with_retry(query, csv_data, max_retries=3, delay=5):
-    """Retries invoking chain2 if rate limited and processes the query with CSV data."""
-    attempts = 0
-    while attempts < max_retries:
+            os.remove(export["path"])
+        except FileNotFoundError:
+            pass
+
+def prepare_full_csv(sql_query):
+    """
+    Streams the full result of the executed query, batch by batch, into a temporary CSV file
+    and keeps its path for the download button. Runs as the callback of the "Prepare full CSV"
+    button, so the query is only re-executed when the user asks for it.
+    """
+    discard_csv_export()
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".csv", delete=False) as file:
         try:
-            if csv_data:
-                csv_content = pd.read_csv(csv_data)
-            else:
-                csv_content = pd.DataFrame()  
-            st.success(csv_content)
-            result = chain2.invoke({"question": query, "data": csv_content.to_dict(orient="records")})
-            return result
-        
-        except HTTPStatusError as e:
-            if e.response.status_code == 429:
-                st.warning("Rate limit exceeded. Retrying in 5 seconds...")
-                time.sleep(delay)
-                attempts += 1
-            else:
-                raise e  
-    st.error("Failed after multiple attempts due to rate limits.")
-    return None
-
-def invoke_chain3_with_retry(query, csv_data, max_retries=3, delay=5):
+            export = write_select_query_csv(sql_query, file)
+        except Exception as e:
+            export = {"error": str(e)}
+    if "error" in export:
+        os.remove(file.name)
+        st.session_state.csv_export = export
+    else:
+        st.session_state.csv_export = {"path": file.name, **export}
+
+def start_stream(answer_stream):
+    """
+    Runs a streaming pipeline up to its insights stage, so that the SQL query and the result
+    preview can be rendered, and returns the stream of remaining insight chunks.
+    """
+    next(answer_stream)
+    return answer_stream
+
+def warn_retry(attempt, delay, error):
+    """Shows that a request is retried after a rate limit or a lost connection."""
+    st.warning(f"Request failed ({classify_error(error).replace('_', ' ')}). Retrying in {delay:.1f} seconds...")
+
+def invoke_with_retry(func, *args):
+    """
+    Calls a pipeline under the retry policy. Returns None once the policy gives up.
+
+    For a streaming pipeline, `func` is `stream_traced`, so the retries cover everything up to
+    the first insights chunk: retrieval, SQL generation and execution. The insights stream
+    itself is not retried, since that would run the query, and any insert or delete, again;
+    see `finish_insights`.
+    """
+    try:
+        return retry_policy.call(func, *args, on_retry=warn_retry)
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class == "queue_timeout":
+            st.error(f"Too many requests are waiting for the LLM, please try again later: {e}")
+            return None
+        if error_class not in TRANSIENT_ERRORS:
+            raise
+        st.error(f"Failed after multiple attempts: {e}")
+        return None
+
+def finish_insights(answer_stream):
+    """
+    Yields the remaining insight chunks. If the connection drops or a rate limit hits midway,
+    the stream ends with a notice instead of failing the page, keeping the text received so far.
+    """
+    try:
+        yield from answer_stream
+    except Exception as e:
+        if classify_error(e) not in TRANSIENT_ERRORS | {"queue_timeout"}:
+            raise
+        yield f"\n\n*The insights were cut short: {e}*"
+
+def history_response(response):
+    """The text kept in the chat history; a stream is replaced by its text once rendered."""
+    return response if isinstance(response, str) else ""
+
+def read_csv_records(csv_data):
+    """Reads the uploaded CSV file, shows it and returns its rows as records."""
+    csv_content = pd.read_csv(csv_data) if csv_data else pd.DataFrame()
+    st.success(csv_content)
+    return csv_content.to_dict(orient="records")
+
+def invoke_traced(trace, runnable, x):
+    """Invokes a pipeline with its steps recorded in `trace`, dropping those of earlier attempts."""
+    trace.clear()
+    with use_trace(trace):
+        return runnable.invoke(x)
+
+def stream_traced(trace, stream_func, *args):
+    """Starts a streaming pipeline with its steps recorded in `trace`, dropping those of earlier attempts."""
+    trace.clear()
+    return start_stream(stream_func(*args, trace=trace))
+
+def invoke_modify_with_retry(trace, stream_func, *args):
+    """
+    Runs an insert or delete pipeline with retries covering only the stages up to and including
+    execution. With STREAM_INSIGHTS off, the insights are then collected in full; a rate limit or
+    dropped connection while generating them ends the text with a notice instead of running the
+    write again.
+    """
+    answer_stream = invoke_with_retry(stream_traced, trace, stream_func, *args)
+    if answer_stream is None or STREAM_INSIGHTS:
+        return answer_stream
+    return "".join(str(chunk) for chunk in finish_insights(answer_stream))
+
+def invoke_chain_with_retry(question, trace):
+    """Retries invoking the chain if rate limited."""
+    if STREAM_INSIGHTS:
+        return invoke_with_retry(stream_traced, trace, stream_answer, question)
+    return invoke_with_retry(invoke_traced, trace, chain, {"question": question})
+
+def invoke_chain2_with_retry(query, csv_data, trace):
+    """Retries invoking chain2 if rate limited and processes the query with CSV data."""
+    progress = st.empty()
+    on_progress = lambda done, total: progress.progress(done / total, text=f"Inserted {done} of {total} rows")
+    records = read_csv_records(csv_data)
+    return invoke_modify_with_retry(trace, stream_answer2, query, records, on_progress)
+
+def invoke_chain3_with_retry(query, csv_data, trace):
     """Retries invoking chain3 if rate limited and processes the query with CSV data for delete operations."""
-    attempts = 0
-    while attempts < max_retries:
-        try:
-            if csv_data:
-                csv_content = pd.read_csv(csv_data)
-            else:
-                csv_content = pd.DataFrame()  
-            st.success(csv_content)
-            result = chain3.invoke({"question": query, "data": csv_content.to_dict(orient="records")})
-            return result
-        
-        except HTTPStatusError as e:
-            if e.response.status_code == 429:
-                st.warning("Rate limit exceeded. Retrying in 5 seconds...")
-                time.sleep(delay)
-                attempts += 1
-            else:
-                raise e  
-    st.error("Failed after multiple attempts due to rate limits.")
-    return None
+    progress = st.empty()
+    on_progress = lambda done, total: progress.progress(done / total, text=f"Loaded {done} of {total} keys")
+    records = read_csv_records(csv_data)
+    return invoke_modify_with_retry(trace, stream_answer3, query, records, on_progress)
 
 if action_type == "Read Database":
     if st.button("Generate Query"):
         if question:
             with st.spinner("Processing..."):
-                intermediate_results.clear()
-                response = invoke_chain_with_retry(question)
+                trace = Trace()
+                discard_csv_export()
+                response = invoke_chain_with_retry(question, trace)
 
                 if response:
-                    parsed_sql_query = next(
-                        (res["result"] for res in intermediate_results if res["step"] == "AI parsed_sql_query"), "N/A"
-                    )
-                    raw_db_result = next(
-                        (res for res in intermediate_results if res["step"] == "Raw DB Query Result"), {}
-                    )
-                    column_names = next(
-                        (res["result"] for res in intermediate_results if res["step"] == "columns"), []
-                    )
-                    insights = next(
-                        (res["result"] for res in intermediate_results if res["step"] == "final_result"), "N/A"
-                    )
+                    parsed_sql_query = trace.result("AI parsed_sql_query", "N/A")
+                    raw_db_result = trace.get("Raw DB Query Result", {})
+                    column_names = trace.result("columns", [])
+                    insights = trace.result("final_result", "N/A")
 
                     st.session_state.chat_history.append({
                         "question": question,
                         "parsed_sql_query": parsed_sql_query,
                         "raw_db_result": json.loads(json.dumps(raw_db_result.get("result", "N/A"), default=serialize)),
-                        "response": response
+                        "response": history_response(response)
                     })
 
                     st.markdown(f"**Question:** {question}")
@@ -127,68 +221,58 @@ if action_type == "Insert into Database":
     if st.button("Generate Query"):
         if question:  
             with st.spinner("Processing insertion..."):
-                response = invoke_chain2_with_retry(question, csv_file)
+                trace = Trace()
+                response = invoke_chain2_with_retry(question, csv_file, trace)
 
                 if response:
-                    parsed_sql_query = next(
-                        (res["result"] for res in intermediate_results2 if res["step"] == "AI parsed_sql_query"), "N/A"
-                    )
-                    raw_db_result = next(
-                        (res for res in intermediate_results2 if res["step"] == "Raw DB Query Result"), {}
-                    )
-                    column_names = next(
-                        (res["result"] for res in intermediate_results2 if res["step"] == "columns"), []
-                    )
-                    insights = next(
-                        (res["result"] for res in intermediate_results2 if res["step"] == "final_result"), "N/A"
-                    )
+                    parsed_sql_query = trace.result("AI parsed_sql_query", "N/A")
+                    raw_db_result = trace.get("Raw DB Query Result", {})
+                    column_names = trace.result("columns", [])
+                    insights = trace.result("final_result", "N/A")
 
                     st.session_state.chat_history.append({
                         "question": question,
                         "parsed_sql_query": parsed_sql_query,
                         "raw_db_result": json.loads(json.dumps(raw_db_result.get("result", "N/A"), default=serialize)),
-                        "response": response
+                        "response": history_response(response)
                     })
 
                     st.markdown(f"**Question:** {question}")
                     st.markdown("### Generated SQL Query:")
                     st.code(parsed_sql_query, language="sql")
 
-                    if raw_db_result.get("result") == "Query executed successfully.":
+                    if raw_db_result.get("success"):
                           st.success(raw_db_result["result"])
 
+                    if raw_db_result.get("errors"):
+                        st.markdown("### Rows that failed to insert:")
+                        st.dataframe(pd.DataFrame(raw_db_result["errors"]))
+
 if action_type == "Delete from Database":
     if st.button("Generate Query"):
         if question:  
             with st.spinner("Processing deletion..."):
-                response = invoke_chain3_with_retry(question, csv_file)
+                trace = Trace()
+                response = invoke_chain3_with_retry(question, csv_file, trace)
 
                 if response:
-                    parsed_sql_query = next(
-                        (res["result"] for res in intermediate_results3 if res["step"] == "AI parsed_sql_query"), "N/A"
-                    )
-                    raw_db_result = next(
-                        (res for res in intermediate_results3 if res["step"] == "Raw DB Query Result"), {}
-                    )
-                    column_names = next(
-                        (res["result"] for res in intermediate_results3 if res["step"] == "columns"), []
-                    )
-                    insights = next(
-                        (res["result"] for res in intermediate_results3 if res["step"] == "final_result"), "N/A"
-                    )
+                    parsed_sql_query = trace.result("AI parsed_sql_query", "N/A")
+                    raw_db_result = trace.get("Raw DB Query Result", {})
+                    column_names = trace.result("columns", [])
+                    insights = trace.result("final_result", "N/A")
 
                     st.session_state.chat_history.append({
                         "question": question,
                         "parsed_sql_query": parsed_sql_query,
                         "raw_db_result": json.loads(json.dumps(raw_db_result.get("result", "N/A"), default=serialize)),
-                        "response": response
+                        "response": history_response(response)
                     })
 
                     st.markdown(f"**Question:** {question}")
                     st.markdown("### Generated SQL Query:")
                     st.code(parsed_sql_query, language="sql")
 
-                    if raw_db_result.get("result") == "Query executed successfully.":
+                    if raw_db_result.get("success"):
                           st.success(raw_db_result["result"])
 
 if isinstance(raw_db_result, dict) and "result" in raw_db_result:
@@ -196,33 +280,79 @@ if isinstance(raw_db_result, dict) and "result" in raw_db_result:
 
     if isinstance(raw_db_result_list, list) and len(raw_db_result_list) > 1:
         column_names = list(raw_db_result_list[0])  
-        data_rows = raw_db_result_list[1:]  
+        preview_rows = (raw_db_result.get("preview") or raw_db_result_list[1:])[:PREVIEW_ROWS]
 
-        df = pd.DataFrame(data_rows, columns=column_names)
-        top_5_rows = df.head(5)  
+        st.markdown(f"### Tabulated Raw Database Results (Top {PREVIEW_ROWS} Rows):")
+        st.dataframe(pd.DataFrame(preview_rows, columns=column_names))
 
-        st.markdown("### Tabulated Raw Database Results (Top 5 Rows):")
-        st.dataframe(top_5_rows)
-
-        csv_data = df.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="📥 Download Full Raw DB Results as CSV",
-            data=csv_data,
-            file_name="raw_db_results.csv",
-            mime="text/csv"
-        )
+        if raw_db_result.get("truncated") and parsed_sql_query != "N/A":
+            st.info("The result was capped for display and insights. Prepare the full result to download it as CSV.")
+            st.button("Prepare full CSV", on_click=prepare_full_csv, args=(parsed_sql_query,))
+        else:
+            st.download_button(
+                label="📥 Download Full Raw DB Results as CSV",
+                data=csv_bytes(raw_db_result_list),
+                file_name="raw_db_results.csv",
+                mime="text/csv"
+            )
     else:
-        if raw_db_result.get("result") == "Query executed successfully.":
+        if raw_db_result.get("success"):
             st.success(raw_db_result["result"])
+        elif raw_db_result.get("success") is False:
+            st.error(raw_db_result["result"])
         else:
             st.warning("Raw database results are not structured for table/CSV download.")
             
     st.markdown("### Insights:")
-    st.write(response)
+    if isinstance(response, str):
+        st.write(response)
+    else:
+        # Streaming mode: render insight tokens as they arrive, then keep the full text.
+        response = st.write_stream(finish_insights(response))
+        if not isinstance(response, str):
+            response = "".join(str(chunk) for chunk in response)
+        st.session_state.chat_history[-1]["response"] = response
 else:
     st.warning("Please enter a question.")
 
+csv_export = st.session_state.get("csv_export")
+if csv_export is not None:
+    if "error" in csv_export:
+        st.error(f"CSV export failed: {csv_export['error']}")
+    elif os.path.exists(csv_export["path"]):
+        note = " (capped)" if csv_export["truncated"] else ""
+        # Streamlit reads the file into memory to serve it; the file is deleted once downloaded.
+        with open(csv_export["path"], "rb") as file:
+            st.download_button(
+                label=f"📥 Download Full Raw DB Results as CSV ({csv_export['rows']} rows{note})",
+                data=file,
+                file_name="raw_db_results.csv",
+                mime="text/csv",
+                on_click=discard_csv_export
+            )
+    else:
+        st.session_state.pop("csv_export", None)
+
 with st.sidebar:
+    startup_timings = resources.timings()
+    if startup_timings:
+        with st.expander("Startup timings"):
+            for name, seconds in startup_timings.items():
+                st.markdown(f"- `{name}`: {seconds:.2f}s")
+
+    stage_latencies = metrics.snapshot()["histograms"].get("stage_duration_seconds", [])
+    if stage_latencies:
+        with st.expander("Stage latencies"):
+            for entry in stage_latencies:
+                st.markdown(f"- `{entry['labels']['stage']}`: {entry['mean']:.3f}s average over {entry['count']} calls")
+
+    queue_waits = metrics.snapshot()["histograms"].get("llm_queue_wait_seconds", [])
+    if queue_waits:
+        with st.expander("LLM rate limiter"):
+            st.markdown(f"- Calls waiting: {llm_scheduler.depth()}")
+            for entry in queue_waits:
+                st.markdown(f"- `{entry['labels']['stage']}`: waited {entry['mean']:.3f}s on average over {entry['count']} calls")
+
     st.markdown("## Chat History")
     if st.session_state.chat_history:
         chat_history_json = json.dumps(st.session_state.chat_history, indent=4)
@@ -1,11 +1,27 @@
 import os
+import time
+import asyncio
 import httpx
-from langchain.chat_models import init_chat_model
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from langchain_core.runnables import RunnableLambda, RunnableBranch
 from langchain_core.output_parsers import StrOutputParser
 from tools.database_tools import extract_corrected_sql, execute_select_query
-from tools.retriever_tool import retrieve_schema
+from tools.query_guard import check_query
+from tools.sql_validator import clean_sql, validate_sql
+from tools.resources import LazyRunnable
+from tools.trace import Trace, current_trace, use_trace, traced, traced_stream
+from tools.instrumentation import span, instrumented, metrics, get_logger, Preview
+from tools.retriever_tool import retrieve_schema, retrieve_schema_chunks
 from tools.llm_tools import generate_sql_query, generate_insights, handle_errors
+from tools.result_summary import summarize_result, estimate_tokens
+from tools.retry_policy import retry_policy, classify_error, TRANSIENT_ERRORS
+from tools.semantic_cache import semantic_cache, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_REUSE_ROWS
+from tools.sql_cache import sql_cache, SQL_CACHE_ENABLED
+from tools.schema_introspection import start_schema_refresher
+from tools.llm_scheduler import llm_scheduler, cancel_on
+from tools.question_validator import question_validator, parse_validation_output, VALIDATOR_FAST_PATH
 from utils.prompts import (
     sql_gen_prompt_template,
     error_handling_prompt_template,
@@ -15,12 +31,27 @@ from utils.prompts import (
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "./configs/.env"))
-api_key = os.getenv("MISTRAL_API_KEY")
 
-llm = init_chat_model("mistral-medium", model_provider="mistralai", temperature=0.3, mistral_api_key=api_key)
+PIPELINE_EXECUTION_MODE = os.getenv("PIPELINE_EXECUTION_MODE", "sequential")
+PIPELINE_SPECULATION_WORKERS = int(os.getenv("PIPELINE_SPECULATION_WORKERS", "8"))
+
+logger = get_logger(__name__)
+
+llm = LazyRunnable("llm")
 
 validate_question = RunnableLambda(lambda x: question_validation_prompt_template.format(question=x["question"]))
-retriever = RunnableLambda(lambda x: {"schema_info": retrieve_schema(x["question"]), "question": x["question"]})
+
+def retrieve_with_ids(x):
+    """Retrieves the schema chunks for the question together with their IDs."""
+    chunks = retrieve_schema_chunks(x["question"])
+    return {
+        "schema_info": list(enumerate(doc for _, doc in chunks)),
+        "chunk_ids": [chunk_id for chunk_id, _ in chunks],
+        "question": x["question"]
+    }
+
+retriever = RunnableLambda(retrieve_with_ids)
+
 generate_sql = RunnableLambda(lambda x: generate_sql_query(x["schema_info"], x["question"]))
 generate_insights_step = RunnableLambda(lambda x: generate_insights(x))
 handle_errors_step = RunnableLambda(lambda x: handle_errors(x))
@@ -31,150 +62,687 @@ passfunc = RunnableLambda(lambda res: {
 })
 
 
+def execute_guarded_select(sql_query):
+    """
+    Runs a generated SELECT query through the cost guard and records its decision.
+    The query as rewritten by the guard is recorded as the parsed SQL query, so that
+    caches, exports and corrections use the statement that actually runs. Rejected
+    queries are not executed; they fail with the guard's reasons, so the error
+    correction step can rewrite them.
+    """
+    with span("query_guard"):
+        guard = check_query(sql_query)
+    current_trace().append({"step": "Query Guard", "result": guard["decision"], **guard})
+    current_trace().append({"step": "AI parsed_sql_query", "result": guard["sql"], "generated": sql_query})
+    if guard["decision"] == "reject":
+        return {
+            "failed_query": guard["sql"],
+            "success": False,
+            "error": f"Query rejected before execution: {'; '.join(guard['violations'])}. "
+                     "Add selective filters or join on indexed columns."
+        }
+    return execute_select_query(guard["sql"])
+
+def execute_validated_select(sql_query):
+    """
+    Validates a generated query locally, then executes it through the cost guard.
+
+    Trivial mistakes such as wrongly capitalized or misspelled names are repaired. Queries
+    that still have errors fail with the validation errors without reaching the database,
+    so the error correction step receives a precise message.
+    """
+    with span("sql_validation"):
+        validation = validate_sql(sql_query)
+    current_trace().append({"step": "SQL Validation", "result": validation["valid"], **validation})
+    if not validation["valid"]:
+        return {
+            "failed_query": sql_query,
+            "success": False,
+            "error": f"SQL validation failed: {' '.join(validation['errors'])}"
+        }
+
+    if validation["repairs"]:
+        logger.info("Repaired SQL query (%s):\n%s", ", ".join(validation["repairs"]), validation["sql"])
+    return execute_guarded_select(validation["sql"])
+
 failfunc = (
-    RunnableLambda(lambda x: (
-        print("\nReceived Failed Query:", x.get('failed_query', '')),
-        print("\nReceived Error Message:", x.get('error', '')),
-        print("\nOriginal Input Prompt:", next(
-            (res["result"] for res in intermediate_results if res["step"] == "Human Message"), ""
-        )),
-        x
-    )[-1])  
+    RunnableLambda(lambda x: logger.debug(
+        "Correcting failed query:\n%s\nError: %s", x.get("failed_query", ""), x.get("error", "")
+    ) or x)
     | RunnableLambda(lambda x: {
-        "question": next(
-            (res["result"] for res in intermediate_results if res["step"] == "Human Message"), ""
-        ),  
+        "question": current_trace().result("Human Message", ""),  
         "failed_query": x.get("failed_query", ""),
         "error": x.get("error", ""),
         "message": x.get("message", "")
     })  
     | error_handling_prompt_template
-    | RunnableLambda(lambda x: (print("\nError template Input:", x), x)[-1])
+    | RunnableLambda(lambda x: logger.debug("Error template input:\n%s", Preview(x)) or x)
     | llm
-    | RunnableLambda(lambda x: (print("Model output (Error Handling):", x), x)[-1])
+    | RunnableLambda(lambda x: logger.debug("Model output (error handling): %s", Preview(x)) or x)
     | RunnableLambda(lambda x: {
         "success": False,
         "result": extract_corrected_sql(x)  
     })  
     | RunnableLambda(lambda x: {
         "success": False, 
-        "result": x["result"].replace("\\", "") if x["result"] is not None else "SQL Query not generated."
+        "result": clean_sql(x["result"]) if x["result"] is not None else "SQL Query not generated."
     })  
-    | RunnableLambda(lambda x: (print("\nCorrected SQL Query:\n", x["result"]), x)[-1])   
+    | RunnableLambda(lambda x: logger.info("Corrected SQL query:\n%s", x["result"]) or x)
     | RunnableLambda(lambda x: {
-        "success": False, 
-        "result": execute_select_query(x["result"])  if x["result"] is not None else "SQL query not generated."
+        "success": False,
+        "query": x["result"],
+        "result": execute_validated_select(x["result"])  if x["result"] is not None else "SQL query not generated."
     })
 )
 
-def retry_failfunc(x, retries=3):
-    existing_failed_query = x.get("failed_query", "")
-    existing_error = x.get("error", "")
-    existing_message = x.get("message", "")
-    existing_result = x.get("result", "")
-    
-    for attempt in range(retries):
-        print(f"\nAttempt {attempt + 1} to correct the SQL query...")
-        
-        x = failfunc.invoke(x)
-        new_failed_query = x.get("failed_query", "")
-        if new_failed_query:
-            existing_failed_query += f"\n[Attempt {attempt + 1}] {new_failed_query}"
-
-        new_error = x.get("error", "")
-        if new_error:
-            existing_error += f"\n[Attempt {attempt + 1}] {new_error}"
-
-        new_message = x.get("message", "")
-        if new_message:
-            existing_message += f"\n[Attempt {attempt + 1}] {new_message}"
-
-        new_result = x.get("result", "")
-        if new_result:
-            existing_result += f"\n[Attempt {attempt + 1}] {new_result}"
-
-        intermediate_results.append({
-            "step": f"FailFunc Attempt {attempt + 1}",
-            "failed_query": existing_failed_query,
-            "error": existing_error,
-            "message": existing_message,
-            "result": existing_result,
+def correction_input(state, failure):
+    """
+    Records a failed query and builds the input of the next correction attempt: the failed
+    query and the compacted error history, so the prompt does not grow with each attempt.
+    """
+    error = failure.get("error") or failure.get("message") or str(failure.get("result", ""))
+    state.add_failure(classify_error(error), error, failure.get("failed_query", ""))
+    return {"failed_query": failure.get("failed_query", ""), "error": state.compact_error()}
+
+def correction_tokens(correction):
+    """Estimates the prompt tokens of a correction attempt."""
+    question = current_trace().result("Human Message", "")
+    return estimate_tokens(error_handling_prompt_template.format(question=question, **correction))
+
+def record_failfunc_attempt(state, correction, x):
+    """
+    Records one correction attempt. A successful result is recorded like the output of the
+    main chain, so that the insights use the corrected query. The query itself, as it ran,
+    was already recorded by `execute_guarded_select`.
+
+    Returns:
+        dict: The database result if the corrected query ran, otherwise the failure to correct next.
+    """
+    result, query = x["result"], x.get("query")
+    if isinstance(result, dict) and result.get("success", False):
+        current_trace().append({"step": f"FailFunc Attempt {state.attempts}", "result": "success",
+                                  "failed_query": correction["failed_query"], "corrected_query": query})
+        current_trace().append({
+            "step": "Raw DB Query Result",
+            "result": result.get("result", result),
+            "columns": result.get("columns", []),
+            "truncated": result.get("truncated", False),
+            "preview": result.get("preview", [])
         })
-        
-        x["failed_query"] = existing_failed_query
-        x["error"] = existing_error
-        x["message"] = existing_message
-        x["result"] = existing_result
-        
-        if x.get("success", False):  
-            return x
-    
-    return x  
+        return result
 
+    failure = result if isinstance(result, dict) else {"failed_query": correction["failed_query"], "error": str(result)}
+    current_trace().append({
+        "step": f"FailFunc Attempt {state.attempts}",
+        "result": "failed",
+        "failed_query": failure.get("failed_query", ""),
+        "error": failure.get("error", ""),
+        "error_class": classify_error(failure.get("error", ""))
+    })
+    return failure
+
+def record_retry_outcome(state, failure, reason):
+    """Records why the correction attempts stopped and returns the last failure."""
+    logger.warning("Giving up on correcting the SQL query: %s", reason)
+    current_trace().append({"step": "Retry Policy", "result": reason, **state.summary()})
+    return failure
 
-intermediate_results = []
+def _next_correction(state, failure, correction):
+    """Returns the next correction input and its estimated tokens, or a stop reason."""
+    if correction is None:
+        correction = correction_input(state, failure)
+    tokens = correction_tokens(correction)
+    return correction, tokens, state.stop_reason(tokens)
 
-def generate_insights_from_intermediate(intermediate_results):
+def retry_failfunc(x, policy=retry_policy):
     """
-    Extracts relevant data from intermediate results and generates insights.
+    Asks the LLM to correct a failed query until it runs or the retry policy gives up.
+
+    Query errors (syntax, unknown column, timeout, ...) are corrected right away; rate limits
+    of the LLM are waited out with exponential backoff. Attempts stop at the policy's
+    attempt limit, deadline or token budget.
     """
-    relevant_data = {}
-    for res in intermediate_results:
-        if res['step'] == "Human Message":
-            relevant_data["input"] = res['result']
-        elif res['step'] == "AI parsed_sql_query":
-            relevant_data["sql_query"] = res['result']  
-        elif res['step'] == "Raw DB Query Result":
-            relevant_data["output"] = res.get("result", res)  
-            relevant_data["columns"] = res.get("columns", [])  
-    
-    insights_input = insights_prompt_template.format(**relevant_data)
-    print(insights_input)
+    state, failure, correction = policy.start(), x, None
+    while True:
+        correction, tokens, reason = _next_correction(state, failure, correction)
+        if reason:
+            return record_retry_outcome(state, failure, reason)
+
+        state.begin_attempt(tokens)
+        logger.info("Attempt %d to correct the SQL query", state.attempts)
+        metrics.inc("retries_total", scope="sql_correction", error_class=state.history[-1]["error_class"])
+        try:
+            with span("sql_correction", attempt=state.attempts):
+                outcome = failfunc.invoke(correction)
+        except httpx.HTTPStatusError as e:
+            if classify_error(e) not in TRANSIENT_ERRORS:
+                raise
+            state.add_failure("rate_limit", e)
+            time.sleep(state.delay("rate_limit", e))
+            continue
+
+        failure = record_failfunc_attempt(state, correction, outcome)
+        if failure.get("success", False):
+            return failure
+        correction = None
+
+async def aretry_failfunc(x, policy=retry_policy):
+    """Async version of `retry_failfunc`."""
+    state, failure, correction = policy.start(), x, None
+    while True:
+        correction, tokens, reason = _next_correction(state, failure, correction)
+        if reason:
+            return record_retry_outcome(state, failure, reason)
+
+        state.begin_attempt(tokens)
+        logger.info("Attempt %d to correct the SQL query", state.attempts)
+        metrics.inc("retries_total", scope="sql_correction", error_class=state.history[-1]["error_class"])
+        try:
+            with span("sql_correction", attempt=state.attempts):
+                outcome = await failfunc.ainvoke(correction)
+        except httpx.HTTPStatusError as e:
+            if classify_error(e) not in TRANSIENT_ERRORS:
+                raise
+            state.add_failure("rate_limit", e)
+            await asyncio.sleep(state.delay("rate_limit", e))
+            continue
+
+        failure = record_failfunc_attempt(state, correction, outcome)
+        if failure.get("success", False):
+            return failure
+        correction = None
+
+sql_generation = sql_gen_prompt_template | llm | StrOutputParser()
+
+def lookup_sql_cache(x):
+    """
+    Returns the SQL query cached for this question and set of schema chunks, or None.
+    The outcome is recorded so that `update_sql_cache` can store or evict the query
+    once it has been executed.
+    """
+    if not SQL_CACHE_ENABLED:
+        return None
+
+    # Database schema changes, which empty the cache, are picked up in the background.
+    start_schema_refresher()
+    cached_sql = sql_cache.get(x["question"], x["chunk_ids"])
+    current_trace().append({
+        "step": "SQL Cache",
+        "result": "hit" if cached_sql is not None else "miss",
+        "question": x["question"],
+        "chunk_ids": x["chunk_ids"]
+    })
+    return cached_sql
+
+def generate_sql_cached(x):
+    """Returns the cached SQL query for this question, falling back to the LLM on a miss."""
+    cached_sql = lookup_sql_cache(x)
+    return cached_sql if cached_sql is not None else sql_generation.invoke(x)
+
+async def agenerate_sql_cached(x):
+    """Async version of `generate_sql_cached`."""
+    cached_sql = lookup_sql_cache(x)
+    return cached_sql if cached_sql is not None else await sql_generation.ainvoke(x)
 
-    result = llm.invoke(insights_input)
+def update_sql_cache(result):
+    """Caches generated SQL that executed successfully and evicts cached SQL that failed."""
+    entry = current_trace().get("SQL Cache")
+    if entry is None:
+        return result
+
+    if result.get("success", False):
+        if entry["result"] == "miss":
+            sql_query = current_trace().result("AI parsed_sql_query")
+            if sql_query:
+                sql_cache.put(entry["question"], entry["chunk_ids"], sql_query)
+    elif entry["result"] == "hit":
+        sql_cache.delete(entry["question"], entry["chunk_ids"])
     return result
 
-chain = (
-    validate_question  
-    | RunnableLambda(lambda x: intermediate_results.append({"step": "Human Message", "result": x}) or x)  
-    | RunnableLambda(lambda x: print(f"\nPrompt Input:\n{x}") or x)  
-    | llm  
-    | StrOutputParser()  
+validation_chain = (
+    llm
+    | StrOutputParser()
     | RunnableLambda(lambda x: {
-        "valid": "True" in x,  
-        "message": x  
+        "valid": parse_validation_output(x),
+        "message": x
     })
-    | RunnableBranch(
-        (lambda res: res["valid"],  
-         RunnableLambda(lambda _: {"question": intermediate_results[0].get("result", "")}) 
-         | retriever 
-         | sql_gen_prompt_template  
-        ),  
-        RunnableLambda(lambda x: f"Not a valid question for generating an SQL query. Reason: {x['message']}")  
-    )
-    | llm  
-    | StrOutputParser()  
-    | RunnableLambda(lambda x: intermediate_results.append({"step": "AI llm_output", "result": x}) or x)  
-    | RunnableLambda(lambda x: print(f"\nGenerated SQL Query:\n{x}") or x)  
+)
+
+invalid_question_chain = (
+    RunnableLambda(lambda x: f"Not a valid question for generating an SQL query. Reason: {x['message']}")
+    | llm
+    | StrOutputParser()
+)
+
+speculation_executor = ThreadPoolExecutor(max_workers=PIPELINE_SPECULATION_WORKERS, thread_name_prefix="speculation")
+
+def record_stage_timings(timings, mode):
+    """Records how long each stage before SQL execution took, in seconds."""
+    current_trace().append({"step": "Stage Timings", "mode": mode, "result": dict(timings)})
+
+def prepare_sql(x, timings, speculative, cancelled=None):
+    """
+    Retrieves the schema for the question and, if `speculative`, also generates the SQL query.
+    Once `cancelled` is set, the SQL generation LLM call is not started.
+    """
+    with span("retrieval") as stage:
+        retrieved = retrieve_with_ids(x)
+    timings["retrieval"] = stage.duration
+    if not speculative or (cancelled is not None and cancelled.is_set()):
+        return retrieved, None
+
+    with span("sql_generation", speculative=True) as stage, cancel_on(cancelled):
+        sql_query = generate_sql_cached(retrieved)
+    timings["sql_generation"] = stage.duration
+    return retrieved, sql_query
+
+async def aprepare_sql(x, timings, speculative):
+    """Async version of `prepare_sql`."""
+    with span("retrieval") as stage:
+        retrieved = await asyncio.to_thread(retrieve_with_ids, x)
+    timings["retrieval"] = stage.duration
+    if not speculative:
+        return retrieved, None
+
+    with span("sql_generation", speculative=True) as stage:
+        sql_query = await agenerate_sql_cached(retrieved)
+    timings["sql_generation"] = stage.duration
+    return retrieved, sql_query
+
+def run_with_own_results(func, *args):
+    """
+    Runs `func` with a separate scratch trace, so a speculative stage leaves no steps
+    behind if its output is discarded.
+    """
+    with use_trace() as scratch:
+        return func(*args), scratch
+
+async def arun_with_own_results(func, *args):
+    """Async version of `run_with_own_results`; the caller runs it as its own task."""
+    with use_trace() as scratch:
+        return await func(*args), scratch
+
+def validate_question_locally(question, prompt):
+    """
+    Decides the question with the local rule-based validator when it is certain.
+    A sampled share of local decisions is also sent to the validation LLM in the
+    background to measure agreement. Returns None if the LLM has to decide.
+    """
+    if not VALIDATOR_FAST_PATH:
+        return None
+
+    decision, reason = question_validator.classify(question)
+    if decision is None:
+        return None
+
+    if question_validator.should_shadow_check():
+        speculation_executor.submit(
+            copy_context().run,
+            lambda: question_validator.record_agreement(decision, validation_chain.invoke(prompt)["valid"])
+        )
+    current_trace().append({"step": "Question Validation", "result": decision, "source": "rules", "reason": reason})
+    return {"valid": decision, "message": reason}
+
+def validate_and_generate_sql(x, mode=None):
+    """
+    Validates the question and generates its SQL query.
+
+    The question is first checked by the local rule-based validator, and the validation
+    LLM is only called when the rules cannot decide. In "sequential" mode retrieval and SQL generation start after validation succeeded.
+    In "parallel" mode retrieval runs while the validation LLM call is in flight, and in
+    "speculative" mode SQL generation does too. If the question turns out to be invalid,
+    speculative work is discarded and an SQL generation LLM call that has not started yet is
+    cancelled; one already in flight still completes and is paid for. Stage timings are recorded in the intermediate results.
+
+    Args:
+        x (dict): The chain input with the user's question.
+        mode (str, optional): Overrides PIPELINE_EXECUTION_MODE.
+
+    Returns:
+        str: The generated SQL query, or the LLM's reply for an invalid question.
+    """
+    mode = mode or PIPELINE_EXECUTION_MODE
+    prompt = question_validation_prompt_template.format(question=x["question"])
+    current_trace().append({"step": "Human Message", "result": prompt})
+    logger.debug("Prompt input:\n%s", prompt)
+
+    timings = {}
+    future = None
+    cancelled = threading.Event()
+    if mode in ("parallel", "speculative"):
+        future = speculation_executor.submit(
+            copy_context().run, run_with_own_results, prepare_sql, {"question": prompt}, timings,
+            mode == "speculative", cancelled
+        )
+
+    with span("question_validation") as stage:
+        validation = validate_question_locally(x["question"], prompt)
+        if validation is None:
+            validation = validation_chain.invoke(prompt)
+            current_trace().append({"step": "Question Validation", "result": validation["valid"], "source": "llm"})
+    timings["validation"] = stage.duration
+
+    if not validation["valid"]:
+        if future is not None:
+            llm_scheduler.cancel(cancelled)
+            future.cancel()
+        record_stage_timings(timings, mode)
+        return invalid_question_chain.invoke(validation)
+
+    if future is not None:
+        (retrieved, sql_query), scratch = future.result()
+        current_trace().extend(scratch)
+    else:
+        retrieved, sql_query = prepare_sql({"question": prompt}, timings, False)
+
+    if sql_query is None:
+        with span("sql_generation") as stage:
+            sql_query = generate_sql_cached(retrieved)
+        timings["sql_generation"] = stage.duration
+
+    record_stage_timings(timings, mode)
+    return sql_query
+
+async def avalidate_and_generate_sql(x, mode=None):
+    """Async version of `validate_and_generate_sql`."""
+    mode = mode or PIPELINE_EXECUTION_MODE
+    prompt = question_validation_prompt_template.format(question=x["question"])
+    current_trace().append({"step": "Human Message", "result": prompt})
+    logger.debug("Prompt input:\n%s", prompt)
+
+    timings = {}
+    task = None
+    if mode in ("parallel", "speculative"):
+        task = asyncio.create_task(
+            arun_with_own_results(aprepare_sql, {"question": prompt}, timings, mode == "speculative")
+        )
+
+    with span("question_validation") as stage:
+        validation = validate_question_locally(x["question"], prompt)
+        if validation is None:
+            validation = await validation_chain.ainvoke(prompt)
+            current_trace().append({"step": "Question Validation", "result": validation["valid"], "source": "llm"})
+    timings["validation"] = stage.duration
+
+    if not validation["valid"]:
+        if task is not None:
+            task.cancel()
+        record_stage_timings(timings, mode)
+        return await invalid_question_chain.ainvoke(validation)
+
+    if task is not None:
+        (retrieved, sql_query), scratch = await task
+        current_trace().extend(scratch)
+    else:
+        retrieved, sql_query = await aprepare_sql({"question": prompt}, timings, False)
+
+    if sql_query is None:
+        with span("sql_generation") as stage:
+            sql_query = await agenerate_sql_cached(retrieved)
+        timings["sql_generation"] = stage.duration
+
+    record_stage_timings(timings, mode)
+    return sql_query
+
+def extract_insights_input(trace):
+    """
+    Extracts relevant data from the trace and formats the insights prompt.
+    """
+    relevant_data = {}
+    if "Human Message" in trace:
+        relevant_data["input"] = trace.result("Human Message")
+    if "AI parsed_sql_query" in trace:
+        relevant_data["sql_query"] = trace.result("AI parsed_sql_query")
+    res = trace.get("Raw DB Query Result")
+    if res is not None:
+        relevant_data["output"] = summarize_result(
+            res.get("result", res), res.get("columns", []), res.get("truncated", False)
+        )
+        relevant_data["columns"] = res.get("columns", [])
+
+    insights_input = insights_prompt_template.format(**relevant_data)
+    logger.debug("Insights input:\n%s", Preview(insights_input))
+    return insights_input
+
+def generate_insights_from_intermediate(trace):
+    """
+    Extracts relevant data from the trace and generates insights.
+    """
+    with span("insights"):
+        return llm.invoke(extract_insights_input(trace))
+
+async def agenerate_insights_from_intermediate(trace):
+    """Async version of `generate_insights_from_intermediate`."""
+    with span("insights"):
+        return await llm.ainvoke(extract_insights_input(trace))
+
+def stream_insights_from_intermediate(trace):
+    """
+    Generates insights with the model's streaming API.
+
+    Yields:
+        str: Text chunks of the insights as they arrive.
+    """
+    with span("insights", streamed=True):
+        for chunk in llm.stream(extract_insights_input(trace)):
+            yield chunk.content
+
+sql_chain = (
+    RunnableLambda(validate_and_generate_sql, afunc=avalidate_and_generate_sql)
+    | RunnableLambda(lambda x: current_trace().append({"step": "AI llm_output", "result": x}) or x)  
+    | RunnableLambda(lambda x: logger.info("Generated SQL query:\n%s", x) or x)
     | StrOutputParser()  
-    | RunnableLambda(lambda sql_query: intermediate_results.append({"step": "AI parsed_sql_query", "result": sql_query.replace("\\", "")}) or sql_query)  
-    | RunnableLambda(lambda sql_query: execute_select_query(sql_query.replace("\\", "")))  
-    | RunnableLambda(lambda result: print(f"\nRaw Result obtained from DB:\n{result}") or result)   
+    | RunnableLambda(clean_sql)
+    | RunnableLambda(lambda sql_query: current_trace().append({"step": "AI parsed_sql_query", "result": sql_query}) or sql_query)  
+    | RunnableLambda(execute_validated_select)  
+    | RunnableLambda(lambda result: logger.debug("Raw result obtained from DB:\n%s", Preview(result)) or result)
     | RunnableLambda(lambda result: (
-        intermediate_results.append({
+        current_trace().append({
             "step": "Raw DB Query Result",
             "result": result.get("result", result),  
-            "columns": result.get("columns", [])  
+            "columns": result.get("columns", []),
+            "truncated": result.get("truncated", False),
+            "preview": result.get("preview", [])
         }) or result
     ))
+    | RunnableLambda(update_sql_cache)
     | RunnableBranch(
         (lambda res: res.get("success", True), passfunc),  
-        RunnableLambda(retry_failfunc)  
+        RunnableLambda(retry_failfunc, afunc=aretry_failfunc)  
     )
-    | RunnableLambda(lambda x: generate_insights_from_intermediate(intermediate_results))  
+)
+
+full_chain = (
+    sql_chain
+    | RunnableLambda(
+        lambda x: generate_insights_from_intermediate(current_trace()),
+        afunc=lambda x: agenerate_insights_from_intermediate(current_trace())
+    )  
     | StrOutputParser()  
 )
 
+def record_cache_hit(question, cached):
+    """
+    Records a semantic cache hit. Returns the cached answer if the cached rows can be
+    reused, otherwise None, in which case the cached SQL query must be re-executed.
+    """
+    current_trace().append({"step": "Human Message", "result": question_validation_prompt_template.format(question=question)})
+    current_trace().append({"step": "Semantic Cache", "result": cached["question"], "similarity": cached["similarity"]})
+    current_trace().append({"step": "AI parsed_sql_query", "result": cached["sql"]})
+
+    if cached["rows"] is not None and cached["answer"] is not None:
+        current_trace().append({
+            "step": "Raw DB Query Result",
+            "result": cached["rows"],
+            "columns": list(cached["rows"][0])
+        })
+        return cached["answer"]
+    return None
+
+def record_cached_execution(result):
+    """Records the result of re-executing a cached SQL query. Returns False if it failed."""
+    if not result.get("success", False):
+        return False
+
+    current_trace().append({
+        "step": "Raw DB Query Result",
+        "result": result["result"],
+        "columns": result["columns"],
+        "truncated": result.get("truncated", False),
+        "preview": result.get("preview", [])
+    })
+    return True
+
+def answer_from_cache(question, cached):
+    """
+    Answers a question with the SQL query cached for a similar question.
+    The cached rows and answer are reused when available, otherwise the query is re-executed.
+    Returns None if the cached query no longer executes.
+    """
+    answer = record_cache_hit(question, cached)
+    if answer is not None:
+        return answer
+
+    if not record_cached_execution(execute_guarded_select(cached["sql"])):
+        return None
+    return StrOutputParser().invoke(generate_insights_from_intermediate(current_trace()))
+
+async def aanswer_from_cache(question, cached):
+    """Async version of `answer_from_cache`."""
+    answer = record_cache_hit(question, cached)
+    if answer is not None:
+        return answer
+
+    if not record_cached_execution(await asyncio.to_thread(execute_guarded_select, cached["sql"])):
+        return None
+    return StrOutputParser().invoke(await agenerate_insights_from_intermediate(current_trace()))
+
+def store_in_semantic_cache(question, answer, embedding):
+    """Caches the SQL query of a question that was answered without corrections."""
+    sql_query = current_trace().result("AI parsed_sql_query")
+    raw_result = current_trace().get("Raw DB Query Result")
+    corrected = current_trace().has_step_prefix("FailFunc")
+    if sql_query and raw_result and isinstance(raw_result["result"], list) and not corrected:
+        reuse_rows = SEMANTIC_CACHE_REUSE_ROWS and not raw_result.get("truncated", False)
+        semantic_cache.store(
+            question,
+            sql_query,
+            rows=raw_result["result"] if reuse_rows else None,
+            answer=answer if reuse_rows else None,
+            embedding=embedding
+        )
+
+@traced
+@instrumented("pipeline_1")
+def invoke_with_semantic_cache(x):
+    """
+    Serves the question from the semantic cache when a similar question was answered before,
+    otherwise runs the full chain and caches the SQL query it generated.
+    """
+    question = x["question"]
+    if not SEMANTIC_CACHE_ENABLED:
+        return full_chain.invoke(x)
+
+    embedding = semantic_cache.embed(question)
+    cached = semantic_cache.lookup(question, embedding)
+    if cached:
+        answer = answer_from_cache(question, cached)
+        if answer is not None:
+            return answer
+        semantic_cache.invalidate_question(cached["question"])
+        current_trace().clear()
+
+    answer = full_chain.invoke(x)
+    store_in_semantic_cache(question, answer, embedding)
+    return answer
+
+@traced
+@instrumented("pipeline_1")
+async def ainvoke_with_semantic_cache(x):
+    """Async version of `invoke_with_semantic_cache`."""
+    question = x["question"]
+    if not SEMANTIC_CACHE_ENABLED:
+        return await full_chain.ainvoke(x)
+
+    embedding = await asyncio.to_thread(semantic_cache.embed, question)
+    cached = semantic_cache.lookup(question, embedding)
+    if cached:
+        answer = await aanswer_from_cache(question, cached)
+        if answer is not None:
+            return answer
+        semantic_cache.invalidate_question(cached["question"])
+        current_trace().clear()
+
+    answer = await full_chain.ainvoke(x)
+    store_in_semantic_cache(question, answer, embedding)
+    return answer
+
+chain = RunnableLambda(invoke_with_semantic_cache, afunc=ainvoke_with_semantic_cache)
+
+def stream_answer(question, trace=None):
+    """
+    Runs the read pipeline and streams the insights token by token.
+
+    The first value yielded is None, sent once the SQL query has executed, so the caller can
+    render the query and the result preview from the trace before the insights start. The
+    following values are text chunks of the insights.
+
+    Args:
+        question (str): The user's question.
+        trace (Trace, optional): Receives this call's steps.
+
+    Yields:
+        None, then str chunks of the insights.
+    """
+    return traced_stream(_stream_answer(question), Trace() if trace is None else trace)
+
+@instrumented("pipeline_1")
+def _stream_answer(question):
+    embedding = None
+    if SEMANTIC_CACHE_ENABLED:
+        embedding = semantic_cache.embed(question)
+        cached = semantic_cache.lookup(question, embedding)
+        if cached:
+            answer = record_cache_hit(question, cached)
+            if answer is not None:
+                yield None
+                yield answer
+                return
+            if record_cached_execution(execute_guarded_select(cached["sql"])):
+                yield None
+                yield from stream_insights_from_intermediate(current_trace())
+                return
+            semantic_cache.invalidate_question(cached["question"])
+            current_trace().clear()
+
+    sql_chain.invoke({"question": question})
+    yield None
+
+    chunks = []
+    for chunk in stream_insights_from_intermediate(current_trace()):
+        chunks.append(chunk)
+        yield chunk
+    if embedding is not None:
+        store_in_semantic_cache(question, "".join(chunks), embedding)
+
+async def arun(question, trace=None):
+    """
+    Async entry point of the read pipeline.
+
+    LLM calls use the model's native async API, while retrieval and database calls run in
+    worker threads. Each call records its steps in its own trace, so one process can answer
+    many questions concurrently.
+
+    Args:
+        question (str): The user's question.
+        trace (Trace, optional): Receives this call's steps.
+
+    Returns:
+        str: The generated insights.
+    """
+    with use_trace(trace):
+        return await chain.ainvoke({"question": question})
+
 # query = """ list the top 30 movies present in the database
 # """
 
@@ -189,4 +757,4 @@ chain = (
 #         print(f"\nAn unexpected error occurred: {str(e)}")
 #         response = f"An unexpected error occurred: {str(e)}"
 
-# print(intermediate_results)
\ No newline at end of file
+# print(trace)
\ No newline at end of file
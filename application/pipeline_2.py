@@ -1,69 +1,91 @@
 import os
-import httpx
-from langchain.chat_models import init_chat_model
+from tools.database_tools import bulk_insert
+from tools.trace import Trace, current_trace, use_trace, traced, traced_stream
+from tools.instrumentation import instrumented
+from tools.modify_pipeline import bulk_modify_records, build_modify_chain, with_insights, stream_insights_from_intermediate
+from utils.prompts import insert_sql_gen_prompt_template, insert_column_mapping_prompt_template
 from langchain_core.runnables import RunnableLambda
-from langchain_core.output_parsers import StrOutputParser
-from tools.database_tools import  execute_query, execute_modify_query
-from tools.retriever_tool import retrieve_schema
-from tools.llm_tools import generate_sql_query, generate_insights, handle_errors
-from utils.prompts import (
-    insights_prompt_template,
-    insert_sql_gen_prompt_template,
-)
 from dotenv import load_dotenv
-import pandas as pd
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "./configs/.env"))
-api_key = os.getenv("MISTRAL_API_KEY")
 
-llm = init_chat_model("mistral-medium", model_provider="mistralai", temperature=0.3, mistral_api_key=api_key)
+BULK_INSERT_MIN_ROWS = int(os.getenv("BULK_INSERT_MIN_ROWS", "20"))
 
-retriever = RunnableLambda(lambda x: {"schema_info": retrieve_schema(f"{x['question']} + {x['data']}"), "question": x["question"], "data": x["data"]})
+def bulk_insert_records(x):
+    """
+    Inserts a large upload without asking the LLM to write the INSERT statement.
+
+    The LLM only maps the CSV columns to a table and its columns. The records are then
+    loaded with parameterized, batched inserts in a single transaction.
+
+    Args:
+        x (dict): question, data (the uploaded records) and optionally on_progress,
+            called as `on_progress(done, total)` after each batch.
+
+    Returns:
+        dict: The result of `bulk_insert`, or an error result if no mapping could be made.
+    """
+    return bulk_modify_records(x, insert_column_mapping_prompt_template, "columns", "Column Mapping", bulk_insert)
 
-intermediate_results2 = []
+modify_chain2 = build_modify_chain(insert_sql_gen_prompt_template, bulk_insert_records, BULK_INSERT_MIN_ROWS)
 
-def generate_insights_from_intermediate(intermediate_results):
+insert_chain2 = with_insights(modify_chain2)
+
+@traced
+@instrumented("pipeline_2")
+def invoke_chain2(x):
+    """Runs the insertion pipeline in its own trace, unless the caller has started one."""
+    return insert_chain2.invoke(x)
+
+@traced
+@instrumented("pipeline_2")
+async def ainvoke_chain2(x):
+    """Async version of `invoke_chain2`."""
+    return await insert_chain2.ainvoke(x)
+
+chain2 = RunnableLambda(invoke_chain2, afunc=ainvoke_chain2)
+
+def stream_answer2(question, data, on_progress=None, trace=None):
     """
-    Extracts relevant data from intermediate results and generates insights.
+    Runs the insertion pipeline and streams the insights token by token.
+
+    The first value yielded is None, sent once the query has executed, so the caller can
+    render it before the insights start. The following values are text chunks of the insights.
+
+    Args:
+        question (str): The user's question.
+        data (list): The uploaded records.
+        on_progress (callable, optional): Receives `(done, total)` rows during bulk inserts.
+        trace (Trace, optional): Receives this call's steps.
+
+    Yields:
+        None, then str chunks of the insights.
+    """
+    return traced_stream(_stream_answer2(question, data, on_progress), Trace() if trace is None else trace)
+
+@instrumented("pipeline_2")
+def _stream_answer2(question, data, on_progress):
+    modify_chain2.invoke({"question": question, "data": data, "on_progress": on_progress})
+    yield None
+    yield from stream_insights_from_intermediate(current_trace())
+
+async def arun2(question, data, trace=None):
+    """
+    Async entry point of the insertion pipeline.
+
+    LLM calls use the model's native async API, while retrieval and database calls run in
+    worker threads. Each call records its steps in its own trace.
+
+    Args:
+        question (str): The user's question.
+        data (list): The uploaded records.
+        trace (Trace, optional): Receives this call's steps.
+
+    Returns:
+        str: The generated insights.
     """
-    relevant_data = {}
-    for res in intermediate_results:
-        if res['step'] == "Human Message":
-            relevant_data["input"] = res['result']
-        elif res['step'] == "AI parsed_sql_query":
-            relevant_data["sql_query"] = res['result']  
-        elif res['step'] == "Raw DB Query Result":
-            relevant_data["output"] = res.get("result", res)  
-            relevant_data["columns"] = res.get("columns", [])  
-    
-    insights_input = insights_prompt_template.format(**relevant_data)
-    print(insights_input)
-
-    result = llm.invoke(insights_input)
-    return result
-
-chain2 = (
-        retriever 
-        | RunnableLambda(lambda x: intermediate_results2.append({"step": "Human Message", "result": x}) or x)  
-        | insert_sql_gen_prompt_template
-        | llm
-        | StrOutputParser()
-        | RunnableLambda(lambda x: intermediate_results2.append({"step": "AI llm_output", "result": x}) or x)
-        | RunnableLambda(lambda x: print(f"\nGenerated SQL Query:\n{x}") or x)
-        | StrOutputParser()
-        | RunnableLambda(lambda sql_query: intermediate_results2.append({"step": "AI parsed_sql_query", "result": sql_query.replace("\\", "")}) or sql_query)
-        | RunnableLambda(lambda sql_query: execute_modify_query(sql_query.replace("\\", "")))
-        | RunnableLambda(lambda result: print(f"\nRaw Result obtained from DB:\n{result}") or result)
-        | RunnableLambda(lambda result: (
-            intermediate_results2.append({
-                "step": "Raw DB Query Result",
-                "result": result.get("result", result),  
-                "columns": result.get("columns", [])  
-            }) or result
-        ))
-        | RunnableLambda(lambda x: generate_insights_from_intermediate(intermediate_results2))  
-        | StrOutputParser()  
-    )
+    with use_trace(trace):
+        return await chain2.ainvoke({"question": question, "data": data})
 
 # query = """ insert the following data into the staff table"""
 
@@ -89,4 +111,4 @@ chain2 = (
 #             print(f"\nAn unexpected error occurred: {str(e)}")
 #             response = f"An unexpected error occurred: {str(e)}"
 
-# print(intermediate_results2)
+# print(trace)
@@ -1,69 +1,91 @@
 import os
-import httpx
-from langchain.chat_models import init_chat_model
+from tools.database_tools import bulk_delete
+from tools.trace import Trace, current_trace, use_trace, traced, traced_stream
+from tools.instrumentation import instrumented
+from tools.modify_pipeline import bulk_modify_records, build_modify_chain, with_insights, stream_insights_from_intermediate
+from utils.prompts import delete_sql_gen_prompt_template, delete_key_mapping_prompt_template
 from langchain_core.runnables import RunnableLambda
-from langchain_core.output_parsers import StrOutputParser
-from tools.database_tools import execute_modify_query
-from tools.retriever_tool import retrieve_schema
-from utils.prompts import (
-    insights_prompt_template,
-    insert_sql_gen_prompt_template,
-    delete_sql_gen_prompt_template
-)
 from dotenv import load_dotenv
-import pandas as pd
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "./configs/.env"))
-api_key = os.getenv("MISTRAL_API_KEY")
 
-llm = init_chat_model("mistral-medium", model_provider="mistralai", temperature=0.3, mistral_api_key=api_key)
+BULK_DELETE_MIN_ROWS = int(os.getenv("BULK_DELETE_MIN_ROWS", "20"))
 
-retriever = RunnableLambda(lambda x: {"schema_info": retrieve_schema(f"{x['question']} + {x['data']}"), "question": x["question"], "data": x["data"]})
+def bulk_delete_records(x):
+    """
+    Deletes the rows listed in a large upload without asking the LLM to write the DELETE statement.
+
+    The LLM only picks the table and the CSV columns identifying its rows. The keys are then
+    loaded into a temporary table and the rows deleted with one `DELETE ... JOIN`.
+
+    Args:
+        x (dict): question, data (the uploaded records) and optionally on_progress,
+            called as `on_progress(done, total)` after each batch of keys.
+
+    Returns:
+        dict: The result of `bulk_delete`, or an error result if no mapping could be made.
+    """
+    return bulk_modify_records(x, delete_key_mapping_prompt_template, "keys", "Key Mapping", bulk_delete)
 
-intermediate_results3 = []
+modify_chain3 = build_modify_chain(delete_sql_gen_prompt_template, bulk_delete_records, BULK_DELETE_MIN_ROWS)
 
-def generate_insights_from_intermediate(intermediate_results):
+delete_chain3 = with_insights(modify_chain3)
+
+@traced
+@instrumented("pipeline_3")
+def invoke_chain3(x):
+    """Runs the deletion pipeline in its own trace, unless the caller has started one."""
+    return delete_chain3.invoke(x)
+
+@traced
+@instrumented("pipeline_3")
+async def ainvoke_chain3(x):
+    """Async version of `invoke_chain3`."""
+    return await delete_chain3.ainvoke(x)
+
+chain3 = RunnableLambda(invoke_chain3, afunc=ainvoke_chain3)
+
+def stream_answer3(question, data, on_progress=None, trace=None):
     """
-    Extracts relevant data from intermediate results and generates insights.
+    Runs the deletion pipeline and streams the insights token by token.
+
+    The first value yielded is None, sent once the query has executed, so the caller can
+    render it before the insights start. The following values are text chunks of the insights.
+
+    Args:
+        question (str): The user's question.
+        data (list): The uploaded records.
+        on_progress (callable, optional): Receives `(done, total)` keys during bulk deletes.
+        trace (Trace, optional): Receives this call's steps.
+
+    Yields:
+        None, then str chunks of the insights.
+    """
+    return traced_stream(_stream_answer3(question, data, on_progress), Trace() if trace is None else trace)
+
+@instrumented("pipeline_3")
+def _stream_answer3(question, data, on_progress):
+    modify_chain3.invoke({"question": question, "data": data, "on_progress": on_progress})
+    yield None
+    yield from stream_insights_from_intermediate(current_trace())
+
+async def arun3(question, data, trace=None):
+    """
+    Async entry point of the deletion pipeline.
+
+    LLM calls use the model's native async API, while retrieval and database calls run in
+    worker threads. Each call records its steps in its own trace.
+
+    Args:
+        question (str): The user's question.
+        data (list): The uploaded records.
+        trace (Trace, optional): Receives this call's steps.
+
+    Returns:
+        str: The generated insights.
     """
-    relevant_data = {}
-    for res in intermediate_results:
-        if res['step'] == "Human Message":
-            relevant_data["input"] = res['result']
-        elif res['step'] == "AI parsed_sql_query":
-            relevant_data["sql_query"] = res['result']  
-        elif res['step'] == "Raw DB Query Result":
-            relevant_data["output"] = res.get("result", res)  
-            relevant_data["columns"] = res.get("columns", [])  
-    
-    insights_input = insights_prompt_template.format(**relevant_data)
-    print(insights_input)
-
-    result = llm.invoke(insights_input)
-    return result
-
-chain3 = (
-        retriever 
-        | RunnableLambda(lambda x: intermediate_results3.append({"step": "Human Message", "result": x}) or x)  
-        | delete_sql_gen_prompt_template
-        | llm
-        | StrOutputParser()
-        | RunnableLambda(lambda x: intermediate_results3.append({"step": "AI llm_output", "result": x}) or x)
-        | RunnableLambda(lambda x: print(f"\nGenerated SQL Query:\n{x}") or x)
-        | StrOutputParser()
-        | RunnableLambda(lambda sql_query: intermediate_results3.append({"step": "AI parsed_sql_query", "result": sql_query.replace("\\", "")}) or sql_query)
-        | RunnableLambda(lambda sql_query: execute_modify_query(sql_query.replace("\\", "")))
-        | RunnableLambda(lambda result: print(f"\nRaw Result obtained from DB:\n{result}") or result)
-        | RunnableLambda(lambda result: (
-            intermediate_results3.append({
-                "step": "Raw DB Query Result",
-                "result": result.get("result", result),  
-                "columns": result.get("columns", [])  
-            }) or result
-        ))
-        | RunnableLambda(lambda x: generate_insights_from_intermediate(intermediate_results3))  
-        | StrOutputParser()  
-    )
+    with use_trace(trace):
+        return await chain3.ainvoke({"question": question, "data": data})
 
 # query = """ delete the following data from the staff table"""
 
@@ -87,4 +109,4 @@ chain3 = (
 #             print(f"\nAn unexpected error occurred: {str(e)}")
 #             response = f"An unexpected error occurred: {str(e)}"
 
-# print(intermediate_results3)
+# print(trace)
@@ -1,10 +1,19 @@
 import os
+import re
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
 import mysql.connector
+from mysql.connector.errors import PoolError
 from dotenv import load_dotenv
 import datetime
 import decimal
 import base64
 import uuid
+import csv
+from tools.instrumentation import span, record_db_call, get_logger, Preview
 
 env_path = os.path.join(os.path.dirname(__file__), "../configs/.env")
 load_dotenv(env_path)
@@ -14,6 +23,240 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
+
+DB_FETCH_BATCH_SIZE = int(os.getenv("DB_FETCH_BATCH_SIZE", "500"))
+DB_MAX_RESULT_ROWS = int(os.getenv("DB_MAX_RESULT_ROWS", "5000"))
+DB_MAX_RESULT_BYTES = int(os.getenv("DB_MAX_RESULT_BYTES", str(16 * 1024 * 1024)))
+DB_MAX_EXPORT_ROWS = int(os.getenv("DB_MAX_EXPORT_ROWS", "200000"))
+DB_BULK_BATCH_SIZE = int(os.getenv("DB_BULK_BATCH_SIZE", "500"))
+DB_BULK_ON_ERROR = os.getenv("DB_BULK_ON_ERROR", "rollback")
+DB_BULK_MAX_ERRORS = int(os.getenv("DB_BULK_MAX_ERRORS", "50"))
+DB_BULK_COMMIT_ROWS = int(os.getenv("DB_BULK_COMMIT_ROWS", "0"))
+DB_MODIFY_MAX_ROWS = int(os.getenv("DB_MODIFY_MAX_ROWS", "0"))
+DB_MODIFY_DRY_RUN = os.getenv("DB_MODIFY_DRY_RUN", "false").lower() == "true"
+
+logger = get_logger(__name__)
+
+
+class PoolTimeoutError(PoolError):
+    """Raised when no pooled connection becomes available before the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of MySQL connections shared by every pipeline in the process.
+
+    Connections are created lazily up to `size`. On checkout, connections that have been
+    idle longer than `ping_after` seconds are pinged, and connections older than `recycle`
+    seconds are replaced, so stale sockets dropped by the server are never handed out.
+
+    Args:
+        size (int): Maximum number of open connections.
+        timeout (float): Seconds to wait for a free connection before raising PoolTimeoutError.
+        recycle (float): Maximum lifetime of a connection in seconds.
+        ping_after (float): Idle time in seconds after which a connection is health-checked.
+        **connect_kwargs: Arguments passed to `mysql.connector.connect`.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE,
+                 ping_after=DB_POOL_PING_AFTER, **connect_kwargs):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created_at = {}
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._discarded = 0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.connect_kwargs)
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _is_healthy(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if now - created_at > self.recycle:
+            return False
+        if now - last_used > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Checks a connection out of the pool, creating one if the pool is not yet full.
+
+        Args:
+            timeout (float, optional): Overrides the pool's checkout timeout.
+
+        Returns:
+            MySQLConnection: A healthy, open connection.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            idle = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        idle = self._idle.popleft()
+                        self._in_use += 1
+                        break
+
+                    if self._open < self.size:
+                        self._open += 1
+                        self._in_use += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {timeout} seconds "
+                            f"(pool size {self.size})."
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if idle is None:
+                break
+
+            # Health-check outside the lock so a slow ping does not block other checkouts.
+            conn, created_at, last_used = idle
+            if self._is_healthy(conn, created_at, last_used):
+                return conn
+            self._close(conn)
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._discarded += 1
+                self._cond.notify()
+
+        # Connect outside the lock so a slow handshake does not block other checkouts.
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool. Open transactions are rolled back first.
+
+        Args:
+            conn (MySQLConnection): The connection obtained from `acquire`.
+            discard (bool, optional): Close the connection instead of reusing it.
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._close(conn)
+                self._open -= 1
+                self._discarded += 1
+            else:
+                created_at = self._created_at.get(id(conn), time.monotonic())
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and always returns it."""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def metrics(self):
+        """
+        Returns a snapshot of the pool's counters.
+
+        Returns:
+            dict: size, open, idle, in_use, waiting, created, discarded and timeouts.
+        """
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "created": self._created,
+                "discarded": self._discarded,
+                "timeouts": self._timeouts,
+            }
+
+    def close_all(self):
+        """Closes every idle connection. Checked-out connections are closed on release."""
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.popleft()
+                self._close(conn)
+                self._open -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    host=DB_HOST,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    database=DB_NAME
+                )
+    return _pool
+
+def pool_metrics():
+    """Returns the metrics of the process-wide connection pool."""
+    return get_pool().metrics()
+
 def extract_corrected_sql(ai_message):
     """
     Extracts the corrected SQL query from the AI model's response.
@@ -43,76 +286,538 @@ def establish_mysql_connection():
         str: Success message or error message
     """
     try:
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        conn.close()
+        with get_pool().connection() as conn:
+            conn.ping(reconnect=False)
         return "Connection established"
     except mysql.connector.Error as e:
         return f"Database error: {e}"
     except Exception as e:
         return f"Unexpected error: {e}"
 
+def _row_size(row):
+    """Roughly estimates the in-memory size of a result row in bytes."""
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes, bytearray)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+class SelectStream:
+    """
+    Streams the rows of a SELECT query in fixed-size batches from an unbuffered cursor.
+
+    Rows are read from the server only as batches are consumed, and reading stops once
+    `max_rows` rows or roughly `max_bytes` bytes have been produced. If the stream is
+    left before the result is exhausted, its connection is discarded instead of draining
+    the remaining rows over the network.
+
+    Usage:
+        with SelectStream("SELECT * FROM rental") as stream:
+            for batch in stream:
+                ...
+
+    Args:
+        query (str): The SELECT query to execute.
+        batch_size (int, optional): Number of rows per batch.
+        max_rows (int, optional): Hard cap on the number of rows produced.
+        max_bytes (int, optional): Hard cap on the estimated size of the rows produced.
+    """
+
+    def __init__(self, query, batch_size=DB_FETCH_BATCH_SIZE, max_rows=DB_MAX_RESULT_ROWS,
+                 max_bytes=DB_MAX_RESULT_BYTES):
+        self.query = query
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.columns = []
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.truncated = False
+        self.execute_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self._conn = None
+        self._cursor = None
+        self._exhausted = False
+
+    def __enter__(self):
+        self._conn = get_pool().acquire()
+        try:
+            self._cursor = self._conn.cursor(buffered=False)
+            start = time.perf_counter()
+            self._cursor.execute(self.query)
+            self.execute_seconds = time.perf_counter() - start
+            self.columns = [desc[0] for desc in self._cursor.description] if self._cursor.description else []
+        except Exception as e:
+            self.close(discard=isinstance(e, (mysql.connector.errors.OperationalError,
+                                              mysql.connector.errors.InterfaceError)))
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self):
+        while not self._exhausted and not self.truncated:
+            start = time.perf_counter()
+            batch = self._cursor.fetchmany(self.batch_size)
+            self.fetch_seconds += time.perf_counter() - start
+            if not batch:
+                self._exhausted = True
+                return
+
+            kept = []
+            for row in batch:
+                if self.rows_read >= self.max_rows or self.bytes_read >= self.max_bytes:
+                    self.truncated = True
+                    break
+                kept.append(row)
+                self.rows_read += 1
+                self.bytes_read += _row_size(row)
+
+            if len(batch) < self.batch_size and not self.truncated:
+                self._exhausted = True
+            if kept:
+                yield kept
+
+    def close(self, discard=None):
+        """Closes the cursor and returns the connection to the pool."""
+        if self._conn is None:
+            return
+        if discard is None:
+            discard = not self._exhausted
+        if self._cursor is not None and not discard:
+            try:
+                self._cursor.close()
+            except Exception:
+                discard = True
+        get_pool().release(self._conn, discard=discard)
+        self._conn = None
+        self._cursor = None
+
+def write_select_query_csv(query: str, file, max_rows=DB_MAX_EXPORT_ROWS):
+    """
+    Streams the result of a SELECT query into a CSV file batch by batch.
+
+    Args:
+        query (str): The SELECT query to execute.
+        file (TextIO): An open text file (or file-like object) to write to.
+        max_rows (int, optional): Hard cap on the number of exported rows.
+
+    Returns:
+        dict: The number of rows written and whether the export was truncated.
+    """
+    writer = csv.writer(file)
+    with span("db.export") as current:
+        with SelectStream(query, max_rows=max_rows, max_bytes=float("inf")) as stream:
+            writer.writerow(stream.columns)
+            for batch in stream:
+                writer.writerows(batch)
+        record_db_call(current, "export", stream.rows_read, stream.execute_seconds, stream.fetch_seconds)
+    return {"rows": stream.rows_read, "truncated": stream.truncated}
+
 def execute_select_query(query: str):
-    """Executes a SELECT query and returns the results."""
-    conn = None
-    cursor = None
+    """
+    Executes a SELECT query and returns the results, capped at DB_MAX_RESULT_ROWS rows
+    and DB_MAX_RESULT_BYTES bytes. `truncated` is set when the cap was hit, and `preview`
+    holds the rows of the first fetched batch.
+    """
     try:
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        cursor = conn.cursor()
-        cursor.execute(query)
-        results = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description] if cursor.description else []
+        results = []
+        preview = []
+        with span("db.select") as current:
+            with SelectStream(query) as stream:
+                for batch in stream:
+                    if not results:
+                        preview = batch
+                    results.extend(batch)
+            record_db_call(current, "select", stream.rows_read, stream.execute_seconds, stream.fetch_seconds)
+            current.set(truncated=stream.truncated)
+        column_names = stream.columns
         results = [tuple(column_names)] + results
-        print("Results: ", results)
+        logger.debug("Results: %s", Preview(results))
 
-        return {"success": True, "columns": column_names, "result": results}
+        return {"success": True, "columns": column_names, "result": results, "truncated": stream.truncated,
+                "preview": preview}
 
     except mysql.connector.Error as e:
         return {"failed_query": query, "success": False, "error": f"MySQL Error: {e}"}
     except Exception as e:
         return {"failed_query": query, "success": False, "error": f"Unexpected Error: {e}"}
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
-def execute_modify_query(query: str):
-    """Executes an INSERT, UPDATE, DELETE, or other modification query."""
-    conn = None
-    cursor = None
-    try:
-        conn = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
+def _statement_type(query: str):
+    """The leading keyword of a statement, lower case ("insert", "delete", ...)."""
+    words = query.split(None, 1)
+    return words[0].lower() if words else "unknown"
+
+class Transaction:
+    """
+    A transaction on one pooled connection, used as a context manager.
+
+    Statements run through `execute`/`executemany` report their row count and last insert ID.
+    The transaction commits when the block exits normally and rolls back on an exception.
+    In dry-run mode every commit is replaced by a rollback, so statements can be executed
+    to learn how many rows they would affect without changing anything.
+
+    Example:
+        with Transaction() as tx:
+            tx.execute("UPDATE film SET rental_rate = 0.99 WHERE film_id = %s", (1,))
+            tx.savepoint("before_delete")
+            if tx.execute("DELETE FROM rental WHERE ...")["rowcount"] > 100:
+                tx.rollback_to("before_delete")
+
+    Args:
+        dry_run (bool, optional): Roll back instead of committing.
+        pool (ConnectionPool, optional): The pool to take the connection from. Defaults to the shared pool.
+    """
+
+    def __init__(self, dry_run: bool = False, pool=None):
+        self.dry_run = dry_run
+        self.pool = pool
+        self.conn = None
+        self.cursor = None
+        self.committed_rows = 0
+
+    def __enter__(self):
+        self.pool = self.pool or get_pool()
+        self.conn = self.pool.acquire()
+        try:
+            self.cursor = self.conn.cursor()
+            self.conn.start_transaction()
+        except Exception:
+            self.pool.release(self.conn, discard=True)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        discard = exc_type is not None and issubclass(
+            exc_type, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
         )
-        cursor = conn.cursor()
-        cursor.execute(query)
-        conn.commit()
-        affected_rows = cursor.rowcount
+        try:
+            if exc_type is None:
+                self.commit(restart=False)
+            elif not discard:
+                self.conn.rollback()
+        finally:
+            try:
+                self.cursor.close()
+            except Exception:
+                discard = True
+            self.pool.release(self.conn, discard=discard)
+        return False
+
+    def execute(self, query: str, params=None):
+        """
+        Executes one statement.
+
+        Returns:
+            dict: rowcount and lastrowid.
+        """
+        with span("db.execute") as current:
+            self.cursor.execute(query, params)
+            record_db_call(current, _statement_type(query), max(self.cursor.rowcount or 0, 0), current.elapsed())
+        return {"rowcount": self.cursor.rowcount, "lastrowid": self.cursor.lastrowid}
+
+    def executemany(self, query: str, rows):
+        """
+        Executes a parameterized statement once per row, batched by the driver.
+
+        Returns:
+            dict: rowcount and lastrowid.
+        """
+        with span("db.execute", batched=True) as current:
+            self.cursor.executemany(query, rows)
+            record_db_call(current, _statement_type(query), max(self.cursor.rowcount or 0, 0), current.elapsed())
+        return {"rowcount": self.cursor.rowcount, "lastrowid": self.cursor.lastrowid}
+
+    def savepoint(self, name: str):
+        """Sets a savepoint that `rollback_to` can return to."""
+        self.cursor.execute(f"SAVEPOINT {quote_identifier(name)}")
+
+    def rollback_to(self, name: str):
+        """Undoes everything executed since the savepoint, keeping the transaction open."""
+        self.cursor.execute(f"ROLLBACK TO SAVEPOINT {quote_identifier(name)}")
 
-        return {"success": True, "columns": [], "result": f"Query executed successfully."}
+    def release_savepoint(self, name: str):
+        """Removes a savepoint without undoing anything."""
+        self.cursor.execute(f"RELEASE SAVEPOINT {quote_identifier(name)}")
+
+    def commit(self, restart: bool = True):
+        """
+        Commits the work done so far (rolls it back in dry-run mode).
+
+        Args:
+            restart (bool, optional): Start a new transaction for the statements that follow.
+        """
+        if self.dry_run:
+            self.conn.rollback()
+        else:
+            self.conn.commit()
+        if restart:
+            self.conn.start_transaction()
+
+    def rollback(self, restart: bool = True):
+        """
+        Rolls back the uncommitted work.
+
+        Args:
+            restart (bool, optional): Start a new transaction for the statements that follow.
+        """
+        self.conn.rollback()
+        if restart:
+            self.conn.start_transaction()
+
+def execute_modify_query(query: str, dry_run: bool = DB_MODIFY_DRY_RUN, max_rows: int = DB_MODIFY_MAX_ROWS):
+    """
+    Executes an INSERT, UPDATE, DELETE, or other modification query in its own transaction.
+
+    Args:
+        query (str): The statement to execute.
+        dry_run (bool, optional): Execute the statement and report its row count, then roll back.
+        max_rows (int, optional): Roll back instead of committing if the statement affects more
+            rows than this. 0 disables the check.
+
+    Returns:
+        dict: success, rowcount, lastrowid, dry_run and a result message.
+    """
+    try:
+        with Transaction(dry_run=dry_run) as tx:
+            outcome = tx.execute(query)
+            if max_rows and outcome["rowcount"] > max_rows:
+                tx.rollback()
+                return {
+                    "failed_query": query,
+                    "success": False,
+                    "rowcount": outcome["rowcount"],
+                    "result": f"Rolled back: the query affected {outcome['rowcount']} rows, more than the limit of {max_rows}."
+                }
+
+        if dry_run:
+            message = f"Dry run: the query would affect {outcome['rowcount']} rows. No changes were made."
+        else:
+            message = f"Query executed successfully. {outcome['rowcount']} rows affected."
+        return {
+            "success": True,
+            "columns": [],
+            "rowcount": outcome["rowcount"],
+            "lastrowid": outcome["lastrowid"],
+            "dry_run": dry_run,
+            "result": message
+        }
 
     except mysql.connector.Error as e:
         return {"failed_query": query, "success": False, "result": f"MySQL Error: {e}"}
     except Exception as e:
         return {"failed_query": query, "success": False, "result": f"Unexpected Error: {e}"}
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+def quote_identifier(name: str):
+    """Backtick-quotes a table or column name, rejecting anything but letters, digits and underscores."""
+    if not re.fullmatch(r"\w+", name or ""):
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return f"`{name}`"
+
+def _sql_value(value):
+    """Turns the NaN pandas uses for empty CSV cells into NULL."""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+def _insert_rows_individually(tx, statement, rows, offset, errors, max_errors):
+    """Inserts the rows of a failed batch one by one, each under its own savepoint."""
+    inserted = 0
+    for i, row in enumerate(rows):
+        tx.savepoint("bulk_row")
+        try:
+            tx.execute(statement, row)
+            inserted += 1
+        except mysql.connector.Error as e:
+            tx.rollback_to("bulk_row")
+            if len(errors) < max_errors:
+                errors.append({"row": offset + i, "error": str(e)})
+    return inserted
+
+def bulk_insert(table: str, columns, rows, batch_size: int = DB_BULK_BATCH_SIZE, on_error: str = DB_BULK_ON_ERROR,
+                on_progress=None, max_errors: int = DB_BULK_MAX_ERRORS, commit_rows: int = DB_BULK_COMMIT_ROWS,
+                dry_run: bool = DB_MODIFY_DRY_RUN):
+    """
+    Inserts many rows with a parameterized INSERT, sent in `executemany` batches.
+
+    A batch that fails is retried row by row to find the rows at fault. With `on_error="rollback"`
+    the load stops after the first failing batch and is rolled back, so only that batch's row
+    errors are reported; with `on_error="skip"` the failing rows are left out and the rest is
+    committed. By default everything runs in one transaction; with
+    `commit_rows` set, the work is committed every `commit_rows` rows, and a rollback only
+    undoes the rows since the last commit.
+
+    Args:
+        table (str): The target table.
+        columns (list): The target columns, in the order of the values in each row.
+        rows (list): The rows to insert, as sequences of values.
+        batch_size (int, optional): Rows per `executemany` call.
+        on_error (str, optional): "rollback" or "skip".
+        on_progress (callable, optional): Called as `on_progress(done, total)` after each batch.
+        max_errors (int, optional): Maximum number of row errors reported.
+        commit_rows (int, optional): Commit after about this many rows. 0 commits once at the end.
+        dry_run (bool, optional): Insert, report the counts, then roll back.
+
+    Returns:
+        dict: query, success, inserted, failed (count), errors (row index and message), batches,
+            committed (rows committed) and a result message.
+    """
+    statement = None
+    errors, inserted, failed, batches, committed, pending, processed = [], 0, 0, 0, 0, 0, 0
+
+    try:
+        statement = (
+            f"INSERT INTO {quote_identifier(table)} ({', '.join(quote_identifier(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        with Transaction(dry_run=dry_run) as tx:
+            for start in range(0, len(rows), batch_size):
+                batch = [tuple(_sql_value(value) for value in row) for row in rows[start:start + batch_size]]
+                tx.savepoint("bulk_batch")
+                try:
+                    tx.executemany(statement, batch)
+                    batch_inserted = len(batch)
+                except mysql.connector.Error:
+                    tx.rollback_to("bulk_batch")
+                    batch_inserted = _insert_rows_individually(tx, statement, batch, start, errors, max_errors)
+                    failed += len(batch) - batch_inserted
+                inserted += batch_inserted
+                pending += batch_inserted
+                batches += 1
+                processed = min(start + batch_size, len(rows))
+                if on_progress is not None:
+                    on_progress(processed, len(rows))
+
+                if failed and on_error != "skip":
+                    # Everything will be rolled back; the remaining batches are not sent.
+                    break
+                if commit_rows and pending >= commit_rows:
+                    tx.commit()
+                    committed += pending
+                    pending = 0
+
+            success = failed == 0 or on_error == "skip"
+            if success:
+                committed += pending
+            else:
+                tx.rollback()
+    except ValueError as e:
+        return {"query": statement, "failed_query": statement, "success": False, "inserted": 0, "failed": len(rows),
+                "errors": errors, "batches": batches, "committed": committed, "dry_run": dry_run,
+                "result": f"Invalid Insert: {e}"}
+    except mysql.connector.Error as e:
+        return {"query": statement, "failed_query": statement, "success": False, "inserted": 0, "failed": len(rows),
+                "errors": errors, "batches": batches, "committed": committed, "dry_run": dry_run,
+                "result": f"MySQL Error: {e}"}
+
+    if dry_run:
+        result = f"Dry run: {inserted} rows would be inserted into {table}, {failed} would fail. No changes were made."
+        if processed < len(rows):
+            result += f" Stopped after the first failing batch, at row {processed} of {len(rows)}."
+        committed = 0
+    elif success:
+        result = f"Inserted {inserted} rows into {table} in {batches} batches."
+        if failed:
+            result += f" Skipped {failed} rows that failed."
+    else:
+        result = f"Rolled back the insert into {table}: {failed} rows failed in the batch ending at row {processed}."
+        if processed < len(rows):
+            result += f" The remaining {len(rows) - processed} rows were not tried."
+        if committed:
+            result += f" {committed} rows committed in earlier chunks were kept."
+    return {
+        "query": statement,
+        "failed_query": statement if failed else None,
+        "success": success,
+        "inserted": committed if not dry_run else inserted,
+        "failed": failed,
+        "errors": errors,
+        "batches": batches,
+        "committed": committed,
+        "dry_run": dry_run,
+        "result": result
+    }
+
+def bulk_delete(table: str, key_columns, keys, batch_size: int = DB_BULK_BATCH_SIZE, on_progress=None,
+                dry_run: bool = DB_MODIFY_DRY_RUN, max_rows: int = DB_MODIFY_MAX_ROWS):
+    """
+    Deletes the rows matching many keys with a single set-based DELETE.
+
+    The keys are loaded into a temporary table (with the key columns' types) by batched
+    inserts, and the rows are deleted with one `DELETE ... JOIN` against it, all in one
+    transaction. Keys containing NULL match no row and are skipped.
+
+    Args:
+        table (str): The table to delete from.
+        key_columns (list): The columns identifying the rows, in the order of the values in each key.
+        keys (list): The keys of the rows to delete, as sequences of values.
+        batch_size (int, optional): Keys per `executemany` call.
+        on_progress (callable, optional): Called as `on_progress(done, total)` after each batch of keys.
+        dry_run (bool, optional): Delete, report the row count, then roll back.
+        max_rows (int, optional): Roll back if more rows than this would be deleted. 0 disables the check.
+
+    Returns:
+        dict: query, success, deleted (rows affected), keys (keys loaded), batches and a result message.
+    """
+    key_table = "`bulk_delete_keys`"
+    statement = None
+    keys = [tuple(_sql_value(value) for value in key) for key in keys]
+    keys = [key for key in keys if None not in key]
+    batches = 0
+
+    try:
+        table_name = quote_identifier(table)
+        columns = [quote_identifier(column) for column in key_columns]
+        statement = (
+            f"DELETE target FROM {table_name} AS target JOIN {key_table} AS k ON "
+            + " AND ".join(f"target.{column} = k.{column}" for column in columns)
+        )
+        with Transaction(dry_run=dry_run) as tx:
+            try:
+                # Creating and dropping a temporary table does not end the transaction.
+                tx.execute(f"DROP TEMPORARY TABLE IF EXISTS {key_table}")
+                tx.execute(
+                    f"CREATE TEMPORARY TABLE {key_table} (INDEX ({', '.join(columns)})) "
+                    f"SELECT {', '.join(columns)} FROM {table_name} LIMIT 0"
+                )
+                insert = f"INSERT INTO {key_table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                for start in range(0, len(keys), batch_size):
+                    tx.executemany(insert, keys[start:start + batch_size])
+                    batches += 1
+                    if on_progress is not None:
+                        on_progress(min(start + batch_size, len(keys)), len(keys))
+
+                deleted = tx.execute(statement)["rowcount"]
+                if max_rows and deleted > max_rows:
+                    tx.rollback()
+                    return {
+                        "query": statement, "failed_query": statement, "success": False, "deleted": 0,
+                        "keys": len(keys), "batches": batches,
+                        "result": f"Rolled back: the delete matched {deleted} rows, more than the limit of {max_rows}."
+                    }
+            finally:
+                tx.execute(f"DROP TEMPORARY TABLE IF EXISTS {key_table}")
+    except ValueError as e:
+        return {"query": statement, "failed_query": statement, "success": False, "deleted": 0, "keys": len(keys),
+                "batches": batches, "dry_run": dry_run, "result": f"Invalid Delete: {e}"}
+    except mysql.connector.Error as e:
+        return {"query": statement, "failed_query": statement, "success": False, "deleted": 0, "keys": len(keys),
+                "batches": batches, "dry_run": dry_run, "result": f"MySQL Error: {e}"}
+
+    if dry_run:
+        result = f"Dry run: {deleted} rows would be deleted from {table} matching {len(keys)} keys. No changes were made."
+    else:
+        result = f"Deleted {deleted} rows from {table} matching {len(keys)} keys."
+    return {
+        "query": statement,
+        "success": True,
+        "deleted": deleted,
+        "keys": len(keys),
+        "batches": batches,
+        "dry_run": dry_run,
+        "result": result
+    }
 
 def execute_query(query: str):
     """Identifies the query type and calls the appropriate execution function."""
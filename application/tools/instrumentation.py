@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import functools
+import threading
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from tools.trace import active_trace
+from tools.result_summary import estimate_tokens
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_PREVIEW_CHARS = int(os.getenv("LOG_PREVIEW_CHARS", "500"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SPANS_LOG_PATH = os.getenv("SPANS_LOG_PATH", "")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "text_to_sql_"
+
+_root_logger = logging.getLogger("text_to_sql")
+if not _root_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _root_logger.addHandler(_handler)
+    _root_logger.setLevel(LOG_LEVEL)
+    _root_logger.propagate = False
+
+def get_logger(name: str):
+    """Returns the logger of a module. All of them log at LOG_LEVEL."""
+    return logging.getLogger(f"text_to_sql.{name}")
+
+logger = get_logger("instrumentation")
+
+class Preview:
+    """
+    A log argument that is converted to text only if the message is actually emitted, and
+    then shortened to LOG_PREVIEW_CHARS characters. Keeps large prompts and result sets
+    from being formatted on every request.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = LOG_PREVIEW_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if self.limit and len(text) > self.limit:
+            return f"{text[:self.limit]} ... [{len(text)} characters]"
+        return text
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """
+    Process-wide counters, gauges and latency histograms, exported in the Prometheus text format.
+
+    Args:
+        buckets (tuple, optional): Upper bounds of the histogram buckets, in seconds.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Adds `value` to a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Sets a gauge to `value`."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Records one observation in a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(self.buckets)}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+
+    def snapshot(self):
+        """
+        Returns the current values.
+
+        Returns:
+            dict: counters and gauges ({name: [{labels, value}]}) and histograms
+                ({name: [{labels, count, sum, mean}]}).
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: dict(value) for key, value in self._histograms.items()}
+        snapshot = {"counters": {}, "gauges": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items()):
+            snapshot["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), value in sorted(gauges.items()):
+            snapshot["gauges"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            snapshot["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": histogram["count"],
+                "sum": histogram["sum"],
+                "mean": histogram["sum"] / histogram["count"] if histogram["count"] else 0.0
+            })
+        return snapshot
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._histograms.items())
+
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+                typed.add(name)
+            lines.append(f"{METRIC_PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+                typed.add(name)
+            lines.append(f"{METRIC_PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                typed.add(name)
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{label_text(labels)} {histogram['sum']}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+metrics = Metrics()
+
+_current_span = ContextVar("span", default=None)
+
+def _kind(name: str):
+    """The kind of a span: the part of its name before the first dot ("db.select" -> "db")."""
+    return name.split(".", 1)[0]
+
+class Span:
+    """
+    One timed stage of a request. Spans nest: a span started while another one is active
+    becomes its child. Finished spans are added to the active trace and their duration is
+    recorded in the `stage_duration_seconds` histogram.
+
+    Args:
+        name (str): The stage name, e.g. "sql_generation", "llm" or "db.select".
+        parent (Span, optional): The enclosing span.
+        **attributes: Values describing the stage, such as row or token counts.
+    """
+
+    def __init__(self, name: str, parent=None, **attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.parent_id = parent.span_id if parent is not None else None
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self.attributes = attributes
+        self._start = time.perf_counter()
+
+    @property
+    def stage(self):
+        """The name of the closest enclosing span of a different kind, used as the stage label."""
+        parent = self.parent
+        while parent is not None and _kind(parent.name) == _kind(self.name):
+            parent = parent.parent
+        return parent.name if parent is not None else "none"
+
+    def elapsed(self):
+        """Seconds since the span started."""
+        return time.perf_counter() - self._start
+
+    def set(self, **attributes):
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        """Ends the span and records it. Returns its duration in seconds."""
+        if self.duration is not None:
+            return self.duration
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        metrics.observe("stage_duration_seconds", self.duration, stage=self.name)
+        trace = active_trace()
+        if trace is not None:
+            trace.add_span(self.to_dict())
+        return self.duration
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+def start_span(name: str, **attributes):
+    """
+    Starts a span without making it the active one. For generators, which cannot keep a
+    context variable set across their yields; end it with `finish()`.
+    """
+    return Span(name, _current_span.get(), **attributes)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed block as a stage of the current request.
+
+    Yields:
+        Span: The span, to add attributes with `set`. Its `duration` is set once the block exits.
+    """
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish(error)
+
+def timed(name: str):
+    """Decorates a function so that each call is timed as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summarize_spans(spans):
+    """
+    Sums the time spent in the LLM, the database and retrieval. Nested spans of the same
+    kind are only counted once.
+
+    Returns:
+        dict: {kind: {"seconds": total, "calls": count}}
+    """
+    names = {entry["span_id"]: entry["name"] for entry in spans}
+    summary = {}
+    for entry in spans:
+        kind = _kind(entry["name"])
+        if kind not in ("llm", "db", "retrieval") or entry["duration_ms"] is None:
+            continue
+        if entry["parent_id"] in names and _kind(names[entry["parent_id"]]) == kind:
+            continue
+        totals = summary.setdefault(kind, {"seconds": 0.0, "calls": 0})
+        totals["seconds"] += entry["duration_ms"] / 1000
+        totals["calls"] += 1
+    return summary
+
+_spans_lock = threading.Lock()
+
+def export_trace(pipeline: str, root: Span, trace=None):
+    """
+    Logs a one-line summary of a finished request and, if SPANS_LOG_PATH is set, appends
+    its spans to that file as one JSON line.
+    """
+    trace = active_trace() if trace is None else trace
+    spans = list(trace.spans) if trace is not None else [root.to_dict()]
+    summary = summarize_spans(spans)
+    logger.info(
+        "%s finished in %.3fs (%s)", pipeline, root.duration,
+        ", ".join(f"{kind} {totals['seconds']:.3f}s in {totals['calls']} calls" for kind, totals in summary.items()) or "no stages"
+    )
+    if not SPANS_LOG_PATH:
+        return
+    record = {"pipeline": pipeline, "trace_id": root.span_id, "duration_ms": root.to_dict()["duration_ms"],
+              "error": root.error, "summary": summary, "spans": spans}
+    line = json.dumps(record, default=str)
+    with _spans_lock:
+        with open(SPANS_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+@contextmanager
+def request_span(pipeline: str):
+    """Times a whole request as the root span and exports its trace when it ends."""
+    root = start_span(pipeline)
+    token = _current_span.set(root)
+    error = None
+    try:
+        yield root
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish(error)
+        metrics.inc("requests_total", pipeline=pipeline, status="error" if error is not None else "ok")
+        export_trace(pipeline, root)
+
+def instrumented(pipeline: str):
+    """Decorates a pipeline entry point (function, coroutine function or generator) with `request_span`."""
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with request_span(pipeline):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with request_span(pipeline):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with request_span(pipeline):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _prompt_text(prompt):
+    if hasattr(prompt, "to_string"):
+        return prompt.to_string()
+    if isinstance(prompt, list):
+        return "\n".join(str(getattr(message, "content", message)) for message in prompt)
+    return str(prompt)
+
+def estimate_prompt_tokens(prompt):
+    """Estimates the tokens of a prompt (string, prompt value or messages) from its length."""
+    return estimate_tokens(_prompt_text(prompt))
+
+def record_llm_call(current: Span, prompt, output, resource: str):
+    """
+    Records the prompt and completion tokens of an LLM call on its span and in the token
+    counters. Uses the provider's usage metadata, or an estimate from the text length.
+    """
+    usage = getattr(output, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens") or estimate_prompt_tokens(prompt)
+    completion_tokens = usage.get("output_tokens") or estimate_tokens(str(getattr(output, "content", output) or ""))
+    current.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, estimated=not usage)
+    metrics.inc("llm_calls_total", resource=resource, stage=current.stage)
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, resource=resource, stage=current.stage)
+    metrics.inc("llm_completion_tokens_total", completion_tokens, resource=resource, stage=current.stage)
+
+def record_db_call(current: Span, operation: str, rows: int, execute_seconds: float = None, fetch_seconds: float = None):
+    """Records the row count and, if measured separately, the execute and fetch times of a database call."""
+    current.set(operation=operation, rows=rows)
+    metrics.inc("db_rows_total", rows, operation=operation)
+    if execute_seconds is not None:
+        current.set(execute_ms=round(execute_seconds * 1000, 3))
+        metrics.observe("db_execute_seconds", execute_seconds, operation=operation)
+    if fetch_seconds is not None:
+        current.set(fetch_ms=round(fetch_seconds * 1000, 3))
+        metrics.observe("db_fetch_seconds", fetch_seconds, operation=operation)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = metrics.render().encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """
+    Serves the metrics at /metrics (Prometheus) and /metrics.json from a background thread.
+
+    Returns:
+        ThreadingHTTPServer or None: The server, or None if `port` is 0.
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on port %d", port)
+    return server
@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, Optional
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
+from tools.instrumentation import get_logger
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live")
+LLM_RECORDINGS_PATH = os.getenv(
+    "LLM_RECORDINGS_PATH", os.path.join(os.path.dirname(__file__), "../cache/llm_recordings.jsonl")
+)
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")
+
+logger = get_logger(__name__)
+
+def prompt_key(messages, model: str, temperature: float):
+    """
+    Hashes what decides a completion: the model, its temperature and the prompt messages.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    payload = json.dumps({
+        "model": model,
+        "temperature": temperature,
+        "messages": [[message.type, message.content] for message in messages]
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RecordingStore:
+    """
+    Prompt-to-completion pairs kept in a JSON lines file, one recorded call per line.
+
+    The file is read on first use and appended to as calls are recorded, so recordings
+    of several runs accumulate. When a prompt was recorded more than once, the latest
+    completion is served.
+
+    Args:
+        path (str, optional): Location of the file.
+    """
+
+    def __init__(self, path=LLM_RECORDINGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+        self._entries = entries
+        return entries
+
+    def get(self, key: str):
+        """Returns the latest entry recorded for a prompt key, or None."""
+        with self._lock:
+            return self._load().get(key)
+
+    def add(self, entry: dict):
+        """Records a call and appends it to the file."""
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._load()[entry["key"]] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def recording_store(path=LLM_RECORDINGS_PATH):
+    """Returns the store of a recordings file, shared by every model recording to or replaying from it."""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RecordingStore(path)
+        return _stores[path]
+
+def _as_chunk(message):
+    """Models without native streaming yield one complete message instead of chunks."""
+    if isinstance(message, AIMessageChunk):
+        return message
+    return AIMessageChunk(content=message.content, usage_metadata=getattr(message, "usage_metadata", None))
+
+class RecordingChatModel(BaseChatModel):
+    """
+    Forwards every call to a live chat model and records the prompt, the completion, its
+    token usage and latency in a `RecordingStore`.
+    """
+
+    inner: Any
+    store: Any
+    model: str
+    temperature: float
+
+    @property
+    def _llm_type(self):
+        return "recording"
+
+    def _record(self, messages, message, latency: float):
+        if message is None:
+            return
+        self.store.add({
+            "key": prompt_key(messages, self.model, self.temperature),
+            "model": self.model,
+            "temperature": self.temperature,
+            "messages": [[m.type, m.content] for m in messages],
+            "completion": message.content,
+            "usage": getattr(message, "usage_metadata", None),
+            "latency": round(latency, 3)
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        self._record(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        self._record(messages, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        start, output = time.perf_counter(), None
+        for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+            chunk = _as_chunk(chunk)
+            output = chunk if output is None else output + chunk
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        self._record(messages, output, time.perf_counter() - start)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        start, output = time.perf_counter(), None
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            chunk = _as_chunk(chunk)
+            output = chunk if output is None else output + chunk
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+        self._record(messages, output, time.perf_counter() - start)
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Answers from a `RecordingStore` without calling the API.
+
+    Each call waits `latency` seconds before answering, or as long as the recorded call
+    took when `latency` is None. Streamed calls spread that wait over their chunks. A prompt
+    that was never recorded raises a LookupError.
+    """
+
+    store: Any
+    model: str
+    temperature: float
+    latency: Optional[float] = None
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def _lookup(self, messages):
+        key = prompt_key(messages, self.model, self.temperature)
+        entry = self.store.get(key)
+        if entry is None:
+            raise LookupError(
+                f"No recorded completion for prompt {key[:12]} in {self.store.path}; "
+                "record it with LLM_BACKEND=record."
+            )
+        return entry
+
+    def _delay(self, entry):
+        return float(entry.get("latency") or 0) if self.latency is None else self.latency
+
+    @staticmethod
+    def _chunks(entry):
+        """Splits a completion into word-sized chunks; the last one carries the token usage."""
+        parts = re.findall(r"\s*\S+", entry["completion"]) or [entry["completion"]]
+        for index, part in enumerate(parts):
+            usage = entry.get("usage") if index == len(parts) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=part, usage_metadata=usage))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        time.sleep(self._delay(entry))
+        message = AIMessage(content=entry["completion"], usage_metadata=entry.get("usage"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        await asyncio.sleep(self._delay(entry))
+        message = AIMessage(content=entry["completion"], usage_metadata=entry.get("usage"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        chunks = list(self._chunks(entry))
+        for chunk in chunks:
+            time.sleep(self._delay(entry) / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        chunks = list(self._chunks(entry))
+        for chunk in chunks:
+            await asyncio.sleep(self._delay(entry) / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.message.content, chunk=chunk)
+            yield chunk
+
+def replay_latency(setting: str = LLM_REPLAY_LATENCY):
+    """Reads LLM_REPLAY_LATENCY: a number of seconds, or "recorded" (returned as None)."""
+    return None if setting.strip().lower() == "recorded" else float(setting)
+
+def wrap_chat_model(build_live, model: str, temperature: float, backend: str = LLM_BACKEND):
+    """
+    Builds the chat model of the configured backend.
+
+    Args:
+        build_live (callable): Builds the live model; not called in replay mode.
+        model (str): The model name, part of the recording key.
+        temperature (float): The sampling temperature, part of the recording key.
+        backend (str, optional): "live", "record" or "replay".
+
+    Returns:
+        BaseChatModel: The live model, or a recording or replaying model in its place.
+    """
+    if backend == "live":
+        return build_live()
+    store = recording_store()
+    if backend == "record":
+        logger.info("Recording LLM calls of %s (temperature %s) to %s", model, temperature, store.path)
+        return RecordingChatModel(inner=build_live(), store=store, model=model, temperature=temperature)
+    if backend == "replay":
+        logger.info("Replaying LLM calls of %s (temperature %s) from %s (%d recorded)",
+                    model, temperature, store.path, len(store))
+        return ReplayChatModel(store=store, model=model, temperature=temperature, latency=replay_latency())
+    raise ValueError(f"Unknown LLM_BACKEND: {backend} (expected live, record or replay)")
@@ -0,0 +1,299 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from concurrent.futures import CancelledError
+from contextvars import ContextVar
+from contextlib import contextmanager, asynccontextmanager
+from dotenv import load_dotenv
+from tools.instrumentation import metrics, get_logger, estimate_prompt_tokens
+from tools.retry_policy import retry_policy, classify_error, QueueTimeoutError
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+# The defaults are the limits of Mistral's free tier. 0 disables a limit.
+LLM_MAX_RPS = float(os.getenv("LLM_MAX_RPS", "1"))
+LLM_MAX_TPM = int(os.getenv("LLM_MAX_TPM", "500000"))
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "300"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+
+# Lower runs first. Calls of other stages are interactive (0); "none" are calls made outside
+# any stage, such as the background agreement checks of the question validator.
+STAGE_PRIORITIES = {"sql_correction": 1, "insights": 2, "none": 3}
+
+# How often queued coroutines look again whether it is their turn.
+ASYNC_POLL_INTERVAL = 0.05
+
+logger = get_logger(__name__)
+
+# Set by `cancel_on` for calls that must not start once their result is no longer needed.
+_cancel_event = ContextVar("llm_cancel_event", default=None)
+
+@contextmanager
+def cancel_on(event):
+    """
+    Makes LLM calls made in this context give up before they are admitted once `event` is set.
+    A call that has already started is not interrupted.
+
+    Args:
+        event (threading.Event): Set, through `LLMScheduler.cancel`, when the calls are not needed.
+    """
+    token = _cancel_event.set(event)
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+def _check_cancelled(stage: str):
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise CancelledError(f"LLM call ({stage}) was cancelled before it started.")
+
+class TokenBucket:
+    """
+    Holds up to `capacity` units, refilled at `rate` units per second.
+
+    The level may drop below zero when a call turns out to use more than it reserved;
+    later calls then wait until it is paid back.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float):
+        """Seconds until `amount` units are available, assuming `refill` was just called."""
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+class LLMScheduler:
+    """
+    Paces the LLM calls of the whole process to stay within the provider's rate limits.
+
+    A call first reserves one request from a requests-per-second bucket and its estimated
+    prompt and completion tokens from a tokens-per-minute bucket. Calls that cannot start
+    yet are queued by priority (see `STAGE_PRIORITIES`) and then in arrival order, so SQL
+    generation overtakes queued insights. Only the head of the queue may take from the
+    buckets, which keeps large calls from being starved by small ones. Once a call has
+    finished, the token reservation is corrected to the tokens actually used. A rate limit
+    reported by the API anyway pauses all calls for the Retry-After time or the retry
+    policy's backoff.
+
+    Args:
+        max_rps (float, optional): Requests per second. 0 disables the limit.
+        max_tpm (int, optional): Prompt and completion tokens per minute. 0 disables the limit.
+        completion_tokens (int, optional): Completion tokens reserved for each call.
+        timeout (float, optional): Longest wait in the queue before a QueueTimeoutError, in seconds.
+    """
+
+    def __init__(self, max_rps: float = LLM_MAX_RPS, max_tpm: int = LLM_MAX_TPM,
+                 completion_tokens: int = LLM_COMPLETION_TOKENS, timeout: float = LLM_QUEUE_TIMEOUT):
+        self.completion_tokens = completion_tokens
+        self.timeout = timeout
+        self._queue = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        # Reentrant, so that `acquire` can check and wait under one hold of the lock.
+        self._condition = threading.Condition(threading.RLock())
+        self.set_limits(max_rps, max_tpm)
+
+    def set_limits(self, max_rps: float, max_tpm: int):
+        """Replaces the requests-per-second and tokens-per-minute limits. 0 disables a limit."""
+        with self._condition:
+            self.requests = TokenBucket(max_rps, max(1.0, max_rps)) if max_rps else None
+            self.tokens = TokenBucket(max_tpm / 60, max_tpm) if max_tpm else None
+            self._condition.notify_all()
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    def depth(self):
+        """Returns the number of queued calls."""
+        with self._condition:
+            return len(self._queue)
+
+    def _update_depth(self):
+        counts = {priority: 0 for priority in sorted(set(STAGE_PRIORITIES.values()) | {0})}
+        for priority, _ in self._queue:
+            counts[priority] += 1
+        for priority, count in counts.items():
+            metrics.set("llm_queue_depth", count, priority=priority)
+
+    def _enqueue(self, priority: int):
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            self._update_depth()
+            self._condition.notify_all()
+        return ticket
+
+    def _leave(self, ticket):
+        with self._condition:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._update_depth()
+            self._condition.notify_all()
+
+    def _try_take(self, ticket, tokens: float):
+        """
+        Takes a request and `tokens` from the buckets if `ticket` is at the head of the queue.
+
+        Returns:
+            float or None: 0 if taken, else seconds until it may be, or None while other
+                calls are ahead.
+        """
+        with self._condition:
+            if self._queue[0] != ticket:
+                return None
+            now = time.monotonic()
+            waits = [self._paused_until - now]
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    waits.append(bucket.wait_time(amount))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.level -= amount
+            heapq.heappop(self._queue)
+            self._update_depth()
+            self._condition.notify_all()
+            return 0.0
+
+    def _timeout_error(self, stage: str):
+        return QueueTimeoutError(f"LLM call ({stage}) waited more than {self.timeout:g}s for the rate limiter.")
+
+    def acquire(self, tokens: float, stage: str = "none"):
+        """
+        Waits until a call of `stage` with `tokens` estimated tokens may start.
+
+        Returns:
+            float: Seconds spent waiting.
+
+        Raises:
+            QueueTimeoutError: If the call waited longer than the queue timeout.
+            CancelledError: If the call was cancelled through `cancel_on` before it was admitted.
+        """
+        start = time.monotonic()
+        ticket = self._enqueue(STAGE_PRIORITIES.get(stage, 0))
+        try:
+            with self._condition:
+                while True:
+                    _check_cancelled(stage)
+                    wait = self._try_take(ticket, tokens)
+                    if wait == 0:
+                        return time.monotonic() - start
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise self._timeout_error(stage)
+                    # Woken early when the queue changes, e.g. when this call reaches the head.
+                    self._condition.wait(min(wait, remaining) if wait is not None else remaining)
+        finally:
+            self._leave(ticket)
+
+    async def aacquire(self, tokens: float, stage: str = "none"):
+        """Async version of `acquire`; waits without blocking the event loop."""
+        start = time.monotonic()
+        ticket = self._enqueue(STAGE_PRIORITIES.get(stage, 0))
+        try:
+            while True:
+                _check_cancelled(stage)
+                wait = self._try_take(ticket, tokens)
+                if wait == 0:
+                    return time.monotonic() - start
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    raise self._timeout_error(stage)
+                await asyncio.sleep(min(wait or ASYNC_POLL_INTERVAL, ASYNC_POLL_INTERVAL, remaining))
+        finally:
+            self._leave(ticket)
+
+    def cancel(self, event):
+        """Sets a `cancel_on` event and wakes the calls waiting in the queue, so they give up."""
+        event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def settle(self, reserved: float, used: float):
+        """Corrects a token reservation to the tokens a finished call actually used."""
+        if self.tokens is None:
+            return
+        with self._condition:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level += reserved - used
+            self._condition.notify_all()
+
+    def pause(self, error):
+        """Holds every queued call back after the API reported a rate limit."""
+        delay = retry_policy.backoff(0, error)
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        metrics.inc("llm_rate_limited_total")
+        logger.warning("LLM rate limit hit, pausing calls for %.1fs", delay)
+
+    def _reservation(self, prompt):
+        return estimate_prompt_tokens(prompt) + self.completion_tokens
+
+    def _admitted(self, current, waited: float):
+        current.set(queue_ms=round(waited * 1000, 3))
+        metrics.observe("llm_queue_wait_seconds", waited, stage=current.stage)
+
+    def _finished(self, current, reserved: float, error=None):
+        if error is not None and classify_error(error) == "rate_limit":
+            self.pause(error)
+        used = current.attributes.get("prompt_tokens", 0) + current.attributes.get("completion_tokens", 0)
+        if error is None and used:
+            self.settle(reserved, used)
+
+    @contextmanager
+    def admit(self, prompt, current):
+        """
+        Runs an LLM call once the scheduler admits it.
+
+        Args:
+            prompt: The prompt of the call, for the token estimate.
+            current (Span): The span of the call. Its stage decides the priority; its token
+                counts, once recorded, settle the reservation.
+        """
+        if not self.enabled:
+            _check_cancelled(current.stage)
+            yield
+            return
+        reserved = self._reservation(prompt)
+        self._admitted(current, self.acquire(reserved, current.stage))
+        try:
+            yield
+        except BaseException as e:
+            self._finished(current, reserved, e)
+            raise
+        self._finished(current, reserved)
+
+    @asynccontextmanager
+    async def aadmit(self, prompt, current):
+        """Async version of `admit`."""
+        if not self.enabled:
+            _check_cancelled(current.stage)
+            yield
+            return
+        reserved = self._reservation(prompt)
+        self._admitted(current, await self.aacquire(reserved, current.stage))
+        try:
+            yield
+        except BaseException as e:
+            self._finished(current, reserved, e)
+            raise
+        self._finished(current, reserved)
+
+llm_scheduler = LLMScheduler()
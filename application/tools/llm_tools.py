@@ -1,14 +1,11 @@
-from langchain.chat_models import init_chat_model
+import re
+import json
 from langchain.tools import tool
 from utils.prompts import sql_gen_prompt_template, insights_prompt_template, error_handling_prompt_template
-import os
-from dotenv import load_dotenv
+from tools.resources import LazyRunnable
+from tools.database_tools import quote_identifier
 
-load_dotenv("../configs/.env")
-
-api_key = os.getenv("MISTRAL_API_KEY")
-
-mistral = init_chat_model("mistral-medium", model_provider="mistralai", temperature=0.5, mistral_api_key=api_key)
+mistral = LazyRunnable("llm_tools")
 
 def generate_sql_query(query: str, schema_info: str):
     """
@@ -52,3 +49,49 @@ def generate_insights(query_result: str):
     prompt = insights_prompt_template.format(result=query_result)
     return mistral.invoke(prompt)
 
+def parse_column_mapping(text: str, csv_columns, field: str = "columns"):
+    """
+    Reads a table and column mapping returned by the LLM as JSON.
+
+    Args:
+        text (str): The LLM output, containing a JSON object.
+        csv_columns (list): The columns of the uploaded CSV.
+        field (str, optional): The key holding the CSV-to-table column mapping.
+
+    Returns:
+        dict: {"table": str, field: {csv_column: table_column}}, without unmapped columns.
+
+    Raises:
+        ValueError: If no usable mapping can be read from the output, or it names a CSV column
+            that does not exist or a table or column that is not a plain identifier.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        raise ValueError("The column mapping is not a JSON object.")
+    try:
+        mapping = json.loads(match.group(0))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"The column mapping is not valid JSON: {e}")
+    if not isinstance(mapping, dict):
+        raise ValueError("The column mapping is not a JSON object.")
+
+    table, pairs = mapping.get("table"), mapping.get(field) or {}
+    if not isinstance(table, str) or not isinstance(pairs, dict):
+        raise ValueError(f"The column mapping needs a table name and a \"{field}\" object.")
+    quote_identifier(table)
+
+    columns = {}
+    for csv_column, table_column in pairs.items():
+        if table_column is None or table_column == "":
+            continue
+        if csv_column not in csv_columns:
+            raise ValueError(f"The column mapping names {csv_column!r}, which is not a CSV column.")
+        if not isinstance(table_column, str):
+            raise ValueError(f"The column mapping maps {csv_column!r} to {table_column!r}, which is not a column name.")
+        quote_identifier(table_column)
+        columns[csv_column] = table_column
+    if not columns:
+        raise ValueError("The column mapping names no columns.")
+    if len(set(columns.values())) < len(columns):
+        raise ValueError("The column mapping maps several CSV columns to the same table column.")
+    return {"table": table, field: columns}
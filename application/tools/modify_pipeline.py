@@ -0,0 +1,174 @@
+from langchain_core.runnables import RunnableLambda, RunnableBranch
+from langchain_core.output_parsers import StrOutputParser
+from tools.database_tools import execute_modify_query
+from tools.resources import LazyRunnable
+from tools.trace import current_trace
+from tools.instrumentation import span, get_logger, Preview
+from tools.retriever_tool import retrieve_schema_for_records
+from tools.result_summary import summarize_result
+from tools.sql_validator import clean_sql
+from tools.semantic_cache import semantic_cache, extract_tables
+from tools.llm_tools import parse_column_mapping
+from utils.prompts import insights_prompt_template
+
+logger = get_logger(__name__)
+
+llm = LazyRunnable("llm")
+
+retriever = RunnableLambda(lambda x: {"schema_info": retrieve_schema_for_records(x["question"], x["data"]), "question": x["question"], "data": x["data"]})
+
+def invalidate_cached_reads(sql_query, result):
+    """Drops semantic cache entries that read from tables modified by a successful query."""
+    if result.get("success", False) and not result.get("dry_run", False):
+        semantic_cache.invalidate_tables(extract_tables(sql_query))
+    return result
+
+def extract_insights_input(trace):
+    """
+    Extracts relevant data from the trace and formats the insights prompt.
+    """
+    relevant_data = {}
+    if "Human Message" in trace:
+        relevant_data["input"] = trace.result("Human Message")
+    if "AI parsed_sql_query" in trace:
+        relevant_data["sql_query"] = trace.result("AI parsed_sql_query")
+    res = trace.get("Raw DB Query Result")
+    if res is not None:
+        relevant_data["output"] = summarize_result(
+            res.get("result", res), res.get("columns", []), res.get("truncated", False)
+        )
+        relevant_data["columns"] = res.get("columns", [])
+
+    insights_input = insights_prompt_template.format(**relevant_data)
+    logger.debug("Insights input:\n%s", Preview(insights_input))
+    return insights_input
+
+def generate_insights_from_intermediate(trace):
+    """
+    Extracts relevant data from the trace and generates insights.
+    """
+    with span("insights"):
+        return llm.invoke(extract_insights_input(trace))
+
+async def agenerate_insights_from_intermediate(trace):
+    """Async version of `generate_insights_from_intermediate`."""
+    with span("insights"):
+        return await llm.ainvoke(extract_insights_input(trace))
+
+def stream_insights_from_intermediate(trace):
+    """
+    Generates insights with the model's streaming API.
+
+    Yields:
+        str: Text chunks of the insights as they arrive.
+    """
+    with span("insights", streamed=True):
+        for chunk in llm.stream(extract_insights_input(trace)):
+            yield chunk.content
+
+def bulk_modify_records(x, mapping_prompt_template, field, label, apply):
+    """
+    Applies a large upload without asking the LLM to write the statement.
+
+    The LLM only maps the CSV columns to a table and its columns. `apply` then does the work
+    with parameterized, batched statements.
+
+    Args:
+        x (dict): question, data (the uploaded records) and optionally on_progress,
+            called as `on_progress(done, total)` after each batch.
+        mapping_prompt_template: The prompt asking for the mapping.
+        field (str): The mapping key holding the CSV-to-table column mapping.
+        label (str): The name of the mapping, e.g. "Column Mapping", used in the trace and errors.
+        apply (callable): Called as `apply(table, columns, rows, on_progress=...)`, e.g. `bulk_insert`.
+
+    Returns:
+        dict: The result of `apply`, or an error result if no mapping could be made.
+    """
+    data = x["data"]
+    csv_columns = list(data[0])
+    prompt = mapping_prompt_template.format(
+        schema_info=retrieve_schema_for_records(x["question"], data),
+        question=x["question"],
+        csv_columns=", ".join(csv_columns),
+        sample_rows=data[:3]
+    )
+    current_trace().append({
+        "step": "Human Message",
+        "result": {"question": x["question"], "csv_columns": csv_columns, "rows": len(data)}
+    })
+    output = StrOutputParser().invoke(llm.invoke(prompt))
+    current_trace().append({"step": "AI llm_output", "result": output})
+    logger.info("Generated %s:\n%s", label.lower(), output)
+
+    try:
+        mapping = parse_column_mapping(output, csv_columns, field=field)
+    except ValueError as e:
+        result = {"success": False, "columns": [], "result": f"{label} Error: {e}"}
+        current_trace().append({"step": "AI parsed_sql_query", "result": "N/A"})
+    else:
+        current_trace().append({"step": label, "result": mapping})
+        rows = [[record.get(column) for column in mapping[field]] for record in data]
+        result = apply(mapping["table"], list(mapping[field].values()), rows, on_progress=x.get("on_progress"))
+        current_trace().append({"step": "AI parsed_sql_query", "result": result["query"] or "N/A"})
+        # Rows committed before a rollback (see `bulk_insert`'s commit_rows) are changes too.
+        if result.get("inserted", result.get("deleted")) and not result.get("dry_run", False):
+            semantic_cache.invalidate_tables([mapping["table"]])
+
+    logger.debug("Raw result obtained from DB:\n%s", Preview(result))
+    current_trace().append({
+        "step": "Raw DB Query Result",
+        "result": result["result"],
+        "columns": [],
+        "success": result["success"],
+        "dry_run": result.get("dry_run", False),
+        "errors": result.get("errors", [])
+    })
+    return result
+
+def build_prompt_chain(sql_gen_prompt_template):
+    """Builds the chain that has the LLM write the statement for the uploaded records and runs it."""
+    return (
+        retriever
+        | RunnableLambda(lambda x: current_trace().append({"step": "Human Message", "result": x}) or x)
+        | sql_gen_prompt_template
+        | llm
+        | StrOutputParser()
+        | RunnableLambda(lambda x: current_trace().append({"step": "AI llm_output", "result": x}) or x)
+        | RunnableLambda(lambda x: logger.info("Generated SQL query:\n%s", x) or x)
+        | StrOutputParser()
+        | RunnableLambda(clean_sql)
+        | RunnableLambda(lambda sql_query: current_trace().append({"step": "AI parsed_sql_query", "result": sql_query}) or sql_query)
+        | RunnableLambda(lambda sql_query: invalidate_cached_reads(sql_query, execute_modify_query(sql_query)))
+        | RunnableLambda(lambda result: logger.debug("Raw result obtained from DB:\n%s", Preview(result)) or result)
+        | RunnableLambda(lambda result: (
+            current_trace().append({
+                "step": "Raw DB Query Result",
+                "result": result.get("result", result),
+                "columns": result.get("columns", []),
+                "success": result.get("success", False),
+                "rowcount": result.get("rowcount"),
+                "dry_run": result.get("dry_run", False)
+            }) or result
+        ))
+    )
+
+def build_modify_chain(sql_gen_prompt_template, bulk_records, min_rows: int):
+    """
+    Builds the chain that applies an upload: uploads of at least `min_rows` records go to
+    `bulk_records`, smaller ones to an LLM-written statement. 0 disables the bulk path.
+    """
+    return RunnableBranch(
+        (lambda x: len(x["data"]) >= min_rows > 0, RunnableLambda(bulk_records)),
+        build_prompt_chain(sql_gen_prompt_template)
+    )
+
+def with_insights(modify_chain):
+    """Follows `modify_chain` with the insights about its result."""
+    return (
+        modify_chain
+        | RunnableLambda(
+            lambda x: generate_insights_from_intermediate(current_trace()),
+            afunc=lambda x: agenerate_insights_from_intermediate(current_trace())
+        )
+        | StrOutputParser()
+    )
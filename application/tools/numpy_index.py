@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+def collection_version(collection):
+    """
+    Hashes the chunk IDs of a Chroma collection. The IDs are derived from the chunks' content
+    (see utils/schema_vector.py), so the hash changes whenever the collection is re-synced
+    with different content.
+    """
+    ids = sorted(collection.get(include=[])["ids"])
+    return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+class NumpySchemaIndex:
+    """
+    An in-memory schema index holding chunk embeddings as one contiguous, L2-normalized
+    float32 matrix. Top-k search is a single matrix product followed by argpartition,
+    which for a corpus of a few dozen chunks is far cheaper than a Chroma query.
+
+    Args:
+        ids (list): Chunk IDs.
+        documents (list): Chunk texts, aligned with `ids`.
+        embeddings (array-like): One embedding per chunk, shape (n_chunks, dim).
+        metadata (dict, optional): Extra information saved alongside the index.
+    """
+
+    def __init__(self, ids, documents, embeddings, metadata=None):
+        if isinstance(embeddings, np.memmap):
+            # Saved indexes are already normalized; keep the mapping instead of copying it.
+            matrix = embeddings
+        else:
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            if matrix.size == 0:
+                matrix = matrix.reshape(0, 0)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = np.ascontiguousarray(matrix / norms)
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids):
+            raise ValueError("embeddings must have one row per chunk")
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.matrix = matrix
+        self.metadata = metadata or {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_collection(cls, collection, metadata=None):
+        """
+        Copies every chunk out of a Chroma collection.
+
+        Args:
+            collection (chromadb.Collection): The collection to copy.
+            metadata (dict, optional): Extra information saved alongside the index.
+
+        Returns:
+            NumpySchemaIndex: The index.
+        """
+        data = collection.get(include=["documents", "embeddings"])
+        return cls(data["ids"], data["documents"], data["embeddings"], metadata)
+
+    def save(self, path: str):
+        """
+        Writes the index to `<path>.npy` (embeddings) and `<path>.json` (IDs, documents, metadata).
+        Each file is written to a temporary name first and then moved into place, so readers
+        never see a partly written file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.npy.tmp", "wb") as f:
+            np.save(f, self.matrix)
+        with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "documents": self.documents, "metadata": self.metadata}, f)
+        os.replace(f"{path}.npy.tmp", f"{path}.npy")
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Loads an index written by `save`.
+
+        Args:
+            path (str): The path the index was saved to, without extension.
+            mmap (bool, optional): Memory-map the embedding matrix instead of reading it.
+
+        Returns:
+            NumpySchemaIndex: The index.
+        """
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+        matrix = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+        return cls(data["ids"], data["documents"], matrix, data.get("metadata"))
+
+    @staticmethod
+    def exists(path: str):
+        """Returns True if an index has been saved at `path`."""
+        return os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")
+
+    def _top_k(self, scores, top_n):
+        top_n = min(top_n, len(self.ids))
+        if top_n == 0:
+            return []
+        candidates = np.argpartition(-scores, top_n - 1)[:top_n]
+        return candidates[np.argsort(-scores[candidates])]
+
+    def query(self, query_embedding, top_n: int = 10):
+        """
+        Finds the chunks most similar to one query embedding.
+
+        Args:
+            query_embedding (array-like): The query embedding.
+            top_n (int, optional): The number of results. Defaults to 10.
+
+        Returns:
+            list: (chunk_id, document, score) tuples, most similar first.
+        """
+        return self.query_batch([query_embedding], top_n)[0]
+
+    def query_batch(self, query_embeddings, top_n: int = 10):
+        """
+        Finds the chunks most similar to each of several query embeddings at once.
+
+        Args:
+            query_embeddings (array-like): Query embeddings, shape (n_queries, dim).
+            top_n (int, optional): The number of results per query. Defaults to 10.
+
+        Returns:
+            list: One list of (chunk_id, document, score) tuples per query.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (queries / norms) @ self.matrix.T
+
+        results = []
+        for row in scores:
+            results.append([
+                (self.ids[i], self.documents[i], float(row[i]))
+                for i in self._top_k(row, top_n)
+            ])
+        return results
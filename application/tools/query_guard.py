@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import mysql.connector
+from dotenv import load_dotenv
+from tools.database_tools import get_pool
+from tools.instrumentation import span, get_logger
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+QUERY_GUARD_ENABLED = os.getenv("QUERY_GUARD_ENABLED", "true").lower() == "true"
+QUERY_GUARD_LIMIT = int(os.getenv("QUERY_GUARD_LIMIT", "30"))
+QUERY_GUARD_MAX_EXECUTION_MS = int(os.getenv("QUERY_GUARD_MAX_EXECUTION_MS", "10000"))
+QUERY_GUARD_MAX_COST = float(os.getenv("QUERY_GUARD_MAX_COST", "1000000"))
+QUERY_GUARD_MAX_ROWS = int(os.getenv("QUERY_GUARD_MAX_ROWS", "1000000"))
+QUERY_GUARD_MAX_FULL_SCAN_ROWS = int(os.getenv("QUERY_GUARD_MAX_FULL_SCAN_ROWS", "100000"))
+
+logger = get_logger(__name__)
+
+TRAILING_LIMIT_PATTERN = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*$", re.IGNORECASE)
+LEADING_SELECT_PATTERN = re.compile(r"^\s*select\b", re.IGNORECASE)
+READ_QUERY_PATTERN = re.compile(r"^\s*(select|with|\()", re.IGNORECASE)
+
+def inject_limit(query: str, limit: int = QUERY_GUARD_LIMIT):
+    """
+    Appends a LIMIT clause to a SELECT query that does not end with one.
+
+    Returns:
+        str: The query without a trailing semicolon, unchanged otherwise if it is not a SELECT,
+            already has a LIMIT or `limit` is 0.
+    """
+    query = query.strip().rstrip(";").strip()
+    if not limit or not READ_QUERY_PATTERN.match(query) or TRAILING_LIMIT_PATTERN.search(query):
+        return query
+    return f"{query} LIMIT {limit}"
+
+def add_execution_time_hint(query: str, max_ms: int = QUERY_GUARD_MAX_EXECUTION_MS):
+    """
+    Adds a MAX_EXECUTION_TIME optimizer hint to the leading SELECT, so that MySQL aborts the
+    statement once it runs longer than `max_ms` milliseconds.
+
+    Returns:
+        str: The query, unchanged if it does not start with SELECT, already has the hint or `max_ms` is 0.
+    """
+    if not max_ms or "MAX_EXECUTION_TIME" in query.upper():
+        return query
+    return LEADING_SELECT_PATTERN.sub(lambda m: f"{m.group(0)} /*+ MAX_EXECUTION_TIME({max_ms}) */", query, count=1)
+
+def explain(query: str):
+    """Returns the parsed `EXPLAIN FORMAT=JSON` plan of a query."""
+    with span("db.explain"), get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN FORMAT=JSON {query}")
+            return json.loads(cursor.fetchall()[0][0])
+        finally:
+            cursor.close()
+
+def _plan_tables(node):
+    """Yields every table access in a plan, however deeply nested."""
+    if isinstance(node, dict):
+        if "table_name" in node and "access_type" in node:
+            yield node
+        for value in node.values():
+            yield from _plan_tables(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_tables(value)
+
+def analyze_plan(plan: dict):
+    """
+    Extracts the estimates the guard checks from an EXPLAIN plan.
+
+    Returns:
+        dict: query_cost, estimated_rows (largest row estimate produced by a join step) and
+            full_scans (tables read with a full table scan, with their estimated rows).
+    """
+    query_cost = float(plan.get("query_block", {}).get("cost_info", {}).get("query_cost", 0) or 0)
+    estimated_rows, full_scans = 0, []
+    for table in _plan_tables(plan):
+        rows = int(float(table.get("rows_produced_per_join", 0) or 0))
+        estimated_rows = max(estimated_rows, rows)
+        if table["access_type"] == "ALL":
+            full_scans.append({"table": table["table_name"], "rows": int(float(table.get("rows_examined_per_scan", 0) or 0))})
+    return {"query_cost": query_cost, "estimated_rows": estimated_rows, "full_scans": full_scans}
+
+def check_query(query: str):
+    """
+    Decides whether a generated SELECT query may run, and how.
+
+    A LIMIT is added when the query has none and a MAX_EXECUTION_TIME hint bounds its run
+    time. The rewritten query is then explained, and rejected if its estimated cost, row
+    count or full table scans exceed the configured budgets.
+
+    Args:
+        query (str): The generated query.
+
+    Returns:
+        dict: decision ("allow", "rewrite" or "reject"), sql (the query to execute), rewrites
+            and violations (descriptions), and the plan estimates (query_cost, estimated_rows, full_scans).
+    """
+    if not QUERY_GUARD_ENABLED:
+        return {"decision": "allow", "sql": query, "rewrites": [], "violations": []}
+
+    rewrites = []
+    limited = inject_limit(query)
+    if limited != query.strip().rstrip(";").strip():
+        rewrites.append(f"added LIMIT {QUERY_GUARD_LIMIT}")
+    sql = add_execution_time_hint(limited)
+    if sql != limited:
+        rewrites.append(f"added MAX_EXECUTION_TIME({QUERY_GUARD_MAX_EXECUTION_MS})")
+
+    try:
+        estimates = analyze_plan(explain(sql))
+    except (mysql.connector.Error, ValueError, IndexError, TypeError) as e:
+        # A query that cannot be explained fails when executed too, and the error goes to the correction step.
+        logger.warning("EXPLAIN failed: %s", e)
+        return {"decision": "rewrite" if rewrites else "allow", "sql": sql, "rewrites": rewrites, "violations": []}
+
+    violations = []
+    if QUERY_GUARD_MAX_COST and estimates["query_cost"] > QUERY_GUARD_MAX_COST:
+        violations.append(f"estimated cost {estimates['query_cost']:.0f} exceeds {QUERY_GUARD_MAX_COST:.0f}")
+    if QUERY_GUARD_MAX_ROWS and estimates["estimated_rows"] > QUERY_GUARD_MAX_ROWS:
+        violations.append(f"estimated {estimates['estimated_rows']} rows exceed {QUERY_GUARD_MAX_ROWS}")
+    for scan in estimates["full_scans"]:
+        if QUERY_GUARD_MAX_FULL_SCAN_ROWS and scan["rows"] > QUERY_GUARD_MAX_FULL_SCAN_ROWS:
+            violations.append(
+                f"full table scan of {scan['table']} ({scan['rows']} rows) exceeds {QUERY_GUARD_MAX_FULL_SCAN_ROWS}"
+            )
+
+    if violations:
+        decision = "reject"
+    else:
+        decision = "rewrite" if rewrites else "allow"
+    return {"decision": decision, "sql": sql, "rewrites": rewrites, "violations": violations, **estimates}
@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import random
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from tools.resources import resources
+from tools.instrumentation import metrics
+from tools.sql_cache import SCHEMA_PATH
+from tools.schema_introspection import STRUCTURED_SCHEMA_PATH
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+VALIDATOR_FAST_PATH = os.getenv("VALIDATOR_FAST_PATH", "true").lower() == "true"
+VALIDATOR_VALID_SIMILARITY = float(os.getenv("VALIDATOR_VALID_SIMILARITY", "0.6"))
+VALIDATOR_INVALID_SIMILARITY = float(os.getenv("VALIDATOR_INVALID_SIMILARITY", "0.15"))
+VALIDATOR_SHADOW_RATE = float(os.getenv("VALIDATOR_SHADOW_RATE", "0.05"))
+TEST_DATA_PATH = os.path.join(os.path.dirname(__file__), "../utils/test_data.txt")
+
+INTENT_WORDS = {
+    "list", "show", "find", "get", "retrieve", "display", "count", "how", "many", "much", "which",
+    "what", "who", "when", "where", "total", "sum", "average", "avg", "top", "most", "least",
+    "highest", "lowest", "number", "all", "each", "per", "give", "fetch", "select", "return",
+}
+# Matches messages made up entirely of greetings, thanks and chit-chat, e.g. "Hi!" or
+# "Thanks, bye". A greeting followed by a real question ("Hi, list all films") does not match.
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(?:(?:hi|hello|hey|thanks|thank you|bye|goodbye|ok|okay|good (?:morning|afternoon|evening|night)"
+    r"|how are you|who are you|tell me a joke)(?:\s+(?:there|again|so much|a lot|very much|today))?[\s,.!?]*)+$",
+    re.IGNORECASE
+)
+
+def parse_validation_output(text: str):
+    """
+    Reads the validation LLM's True/False answer, tolerating case, punctuation and extra words.
+
+    Returns:
+        bool: True only if the answer says True and not False.
+    """
+    words = re.findall(r"[a-z]+", text.lower())
+    if words and words[0] in ("true", "false"):
+        return words[0] == "true"
+    return "true" in words and "false" not in words
+
+def load_schema_vocabulary(schema_path: str = SCHEMA_PATH, structured_path: str = STRUCTURED_SCHEMA_PATH):
+    """
+    Collects table names and full column identifiers from the schema description (names in
+    backticks, tables as "the `name` table") and, if it has been built, from the structured
+    schema index. Column names are not split into their parts, which are mostly generic
+    words such as "name", "last" or "date".
+
+    Returns:
+        dict: {"tables": set, "columns": set}, all lower case.
+    """
+    tables, columns = set(), set()
+    try:
+        with open(schema_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        tables.update(name.lower() for name in re.findall(r"`(\w+)` table", text))
+        columns.update(name.lower() for name in re.findall(r"`(\w+)`", text))
+    except FileNotFoundError:
+        pass
+
+    if os.path.exists(structured_path):
+        with open(structured_path, "r", encoding="utf-8") as f:
+            for table, definition in json.load(f)["tables"].items():
+                tables.add(table.lower())
+                columns.update(column["name"].lower() for column in definition["columns"])
+    return {"tables": tables, "columns": columns - tables}
+
+def load_example_questions(path: str = TEST_DATA_PATH):
+    """Reads the numbered example questions from test_data.txt."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return re.findall(r"^\d+\.\s+(.+)$", f.read(), flags=re.MULTILINE)
+    except FileNotFoundError:
+        return []
+
+class QuestionValidator:
+    """
+    Decides clearly valid and clearly invalid questions locally, so that only ambiguous
+    questions need the validation LLM call.
+
+    A question is valid if it asks for data, names a table, and either names a second table or
+    a multi-word column identifier ("first name" for `first_name`) or is similar to one of the
+    example questions in test_data.txt. It is invalid if it is nothing but small talk, or mentions nothing
+    from the schema and is far from every example. Anything else is escalated to the LLM.
+
+    Args:
+        vocabulary (dict, optional): "tables" and "columns" name sets. Defaults to those in schema.txt.
+        examples (list, optional): Known valid questions. Defaults to those in test_data.txt.
+        embed (callable, optional): Maps a list of texts to embeddings.
+    """
+
+    def __init__(self, vocabulary=None, examples=None, embed=None,
+                 valid_similarity=VALIDATOR_VALID_SIMILARITY, invalid_similarity=VALIDATOR_INVALID_SIMILARITY):
+        self.vocabulary = vocabulary if vocabulary is not None else load_schema_vocabulary()
+        self.examples = examples if examples is not None else load_example_questions()
+        self._embed = embed or (lambda texts: resources.get("embedding_model").encode(texts))
+        self.valid_similarity = valid_similarity
+        self.invalid_similarity = invalid_similarity
+        self._example_matrix = None
+        self._lock = threading.Lock()
+        self.counts = {"rules_valid": 0, "rules_invalid": 0, "escalated": 0, "shadow_checks": 0, "agreements": 0}
+
+    def _schema_mentions(self, words, names):
+        """Returns the names in `names` that the words or pairs of adjacent words mention."""
+        terms = words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+        mentions = set()
+        for term in terms:
+            for candidate in (term, term.rstrip("s"), term[:-2] if term.endswith("es") else term):
+                if candidate in names:
+                    mentions.add(candidate)
+        return mentions
+
+    def _example_similarity(self, question):
+        if not self.examples:
+            return None
+        if self._example_matrix is None:
+            matrix = np.asarray(self._embed(self.examples), dtype=np.float32)
+            self._example_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        vector = np.asarray(self._embed([question]), dtype=np.float32)[0]
+        return float(np.max(self._example_matrix @ (vector / np.linalg.norm(vector))))
+
+    def classify(self, question: str):
+        """
+        Classifies a question without calling the LLM.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            tuple: (decision, reason). The decision is True, False, or None if the LLM must decide.
+        """
+        words = re.findall(r"[a-z_]+", question.lower())
+        decision, reason = None, "ambiguous"
+
+        if not words or SMALL_TALK_PATTERN.match(question):
+            decision, reason = False, "small talk"
+        else:
+            tables = self._schema_mentions(words, self.vocabulary["tables"])
+            columns = {name for name in self._schema_mentions(words, self.vocabulary["columns"]) if "_" in name}
+            asks_for_data = bool(INTENT_WORDS.intersection(words)) or question.strip().endswith("?")
+            # Questions addressed to the assistant itself are left to the LLM.
+            addresses_assistant = bool({"you", "your"}.intersection(words))
+            if addresses_assistant:
+                pass
+            elif tables and asks_for_data:
+                if len(tables) > 1 or columns:
+                    decision, reason = True, f"asks for data about {', '.join(sorted(tables | columns))}"
+                else:
+                    similarity = self._example_similarity(question)
+                    if similarity is not None and similarity >= self.valid_similarity:
+                        decision, reason = True, f"asks for data about {', '.join(sorted(tables))}, similar to an example question ({similarity:.2f})"
+            elif not tables and not columns:
+                similarity = self._example_similarity(question)
+                if similarity is not None and similarity >= self.valid_similarity:
+                    decision, reason = True, f"similar to an example question ({similarity:.2f})"
+                elif similarity is not None and similarity <= self.invalid_similarity:
+                    decision, reason = False, f"unrelated to the schema ({similarity:.2f})"
+
+        outcome = {True: "rules_valid", False: "rules_invalid", None: "escalated"}[decision]
+        with self._lock:
+            self.counts[outcome] += 1
+        metrics.inc("question_validations_total", outcome=outcome)
+        self._publish_rates()
+        return decision, reason
+
+    def should_shadow_check(self):
+        """Returns True for the sampled share of local decisions that are also sent to the LLM."""
+        return VALIDATOR_SHADOW_RATE > 0 and random.random() < VALIDATOR_SHADOW_RATE
+
+    def record_agreement(self, local_decision: bool, llm_decision: bool):
+        """Records whether the LLM agreed with a local decision checked in shadow mode."""
+        agreed = local_decision == llm_decision
+        with self._lock:
+            self.counts["shadow_checks"] += 1
+            self.counts["agreements"] += int(agreed)
+        metrics.inc("question_validator_shadow_checks_total", agreed=str(agreed).lower())
+        self._publish_rates()
+
+    def _publish_rates(self):
+        stats = self.stats()
+        metrics.set("question_validator_fast_path_rate", stats["fast_path_rate"])
+        if stats["agreement_rate"] is not None:
+            metrics.set("question_validator_agreement_rate", stats["agreement_rate"])
+
+    def stats(self):
+        """
+        Returns the validator counters.
+
+        Returns:
+            dict: The raw counts plus fast_path_rate and agreement_rate.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        decided = counts["rules_valid"] + counts["rules_invalid"]
+        total = decided + counts["escalated"]
+        counts["fast_path_rate"] = decided / total if total else 0.0
+        counts["agreement_rate"] = counts["agreements"] / counts["shadow_checks"] if counts["shadow_checks"] else None
+        return counts
+
+question_validator = QuestionValidator()
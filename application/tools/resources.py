@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+from langchain_core.runnables import Runnable
+from tools.instrumentation import span, start_span, record_llm_call
+from tools.llm_scheduler import llm_scheduler
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+CHROMA_PATH = os.getenv("CHROMA_PATH", os.path.join(os.path.dirname(__file__), "../chroma"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "sql_data")
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH", os.path.join(os.path.dirname(__file__), "../cache/schema_index"))
+NUMPY_INDEX_MMAP = os.getenv("NUMPY_INDEX_MMAP", "true").lower() == "true"
+LLM_MODEL = os.getenv("LLM_MODEL", "mistral-medium")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "mistralai")
+WARMUP_RESOURCES = os.getenv("WARMUP_RESOURCES", "")
+
+class ResourceRegistry:
+    """
+    Builds heavy, process-wide objects (embedding model, vector store, LLM clients) lazily.
+
+    Each resource is registered with a factory and constructed at most once, on first use,
+    even when several threads ask for it at the same time. The time spent constructing each
+    resource is recorded so that cold-start cost can be reported.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._locks = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory):
+        """
+        Registers the factory used to build a resource.
+
+        Args:
+            name (str): The resource name.
+            factory (callable): A function without arguments returning the resource.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._instances.pop(name, None)
+            self._timings.pop(name, None)
+
+    def get(self, name: str):
+        """
+        Returns a resource, building it on first use.
+
+        Args:
+            name (str): The resource name.
+
+        Returns:
+            object: The shared resource instance.
+        """
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource: {name}")
+
+        with self._locks[name]:
+            if name not in self._instances:
+                start = time.perf_counter()
+                instance = self._factories[name]()
+                self._timings[name] = time.perf_counter() - start
+                self._instances[name] = instance
+        return self._instances[name]
+
+    def reset(self, name: str):
+        """Drops a built resource, so that the next `get` builds it again."""
+        with self._lock:
+            self._instances.pop(name, None)
+
+    def is_loaded(self, name: str):
+        """Returns True if the resource has already been built."""
+        return name in self._instances
+
+    def warm_up(self, names=None):
+        """
+        Builds resources ahead of the first request.
+
+        Args:
+            names (list or str, optional): Resource names, a comma-separated string, or "all".
+                Defaults to every registered resource.
+
+        Returns:
+            dict: Construction time in seconds per resource.
+        """
+        if names is None or names == "all":
+            names = list(self._factories)
+        elif isinstance(names, str):
+            names = [name.strip() for name in names.split(",") if name.strip()]
+
+        for name in names:
+            self.get(name)
+        return {name: self._timings.get(name, 0.0) for name in names}
+
+    def timings(self):
+        """
+        Returns the construction time of every resource built so far.
+        Resources built from other resources include their dependencies' time.
+
+        Returns:
+            dict: Construction time in seconds per resource.
+        """
+        return dict(self._timings)
+
+class LazyRunnable(Runnable):
+    """
+    A runnable that forwards to a registry resource, so chains can be composed at import
+    time without constructing the underlying model. Every call waits for `llm_scheduler`
+    to admit it and is timed as an "llm" span with its prompt and completion tokens.
+
+    Args:
+        name (str): The name of a registered runnable resource.
+        registry (ResourceRegistry, optional): The registry to resolve it from.
+    """
+
+    def __init__(self, name: str, registry=None):
+        self.name = name
+        self.registry = registry or resources
+
+    @property
+    def runnable(self):
+        return self.registry.get(self.name)
+
+    def invoke(self, input, config=None, **kwargs):
+        with span("llm", resource=self.name) as current, llm_scheduler.admit(input, current):
+            output = self.runnable.invoke(input, config, **kwargs)
+            record_llm_call(current, input, output, self.name)
+        return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        with span("llm", resource=self.name) as current:
+            async with llm_scheduler.aadmit(input, current):
+                output = await self.runnable.ainvoke(input, config, **kwargs)
+                record_llm_call(current, input, output, self.name)
+        return output
+
+    def stream(self, input, config=None, **kwargs):
+        current, output = start_span("llm", resource=self.name, streamed=True), None
+        try:
+            with llm_scheduler.admit(input, current):
+                for chunk in self.runnable.stream(input, config, **kwargs):
+                    output = chunk if output is None else output + chunk
+                    yield chunk
+                record_llm_call(current, input, output, self.name)
+        except BaseException as e:
+            current.finish(e)
+            raise
+        current.finish()
+
+    async def astream(self, input, config=None, **kwargs):
+        current, output = start_span("llm", resource=self.name, streamed=True), None
+        try:
+            async with llm_scheduler.aadmit(input, current):
+                async for chunk in self.runnable.astream(input, config, **kwargs):
+                    output = chunk if output is None else output + chunk
+                    yield chunk
+                record_llm_call(current, input, output, self.name)
+        except BaseException as e:
+            current.finish(e)
+            raise
+        current.finish()
+
+def _build_embedding_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+def _build_chroma_client():
+    import chromadb
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+def _build_schema_collection():
+    return resources.get("chroma_client").get_collection(name=CHROMA_COLLECTION)
+
+def _build_numpy_index():
+    from tools.numpy_index import NumpySchemaIndex, collection_version
+
+    collection = resources.get("schema_collection")
+    version = collection_version(collection)
+    if NumpySchemaIndex.exists(NUMPY_INDEX_PATH):
+        index = NumpySchemaIndex.load(NUMPY_INDEX_PATH, mmap=NUMPY_INDEX_MMAP)
+        if index.metadata.get("collection_version") == version:
+            return index
+
+    # Missing or copied before the collection was last synced: copy it out of Chroma again.
+    index = NumpySchemaIndex.from_collection(collection, {"collection_version": version})
+    index.save(NUMPY_INDEX_PATH)
+    return index
+
+def _build_chat_model(temperature):
+    def build_live():
+        from langchain.chat_models import init_chat_model
+        return init_chat_model(
+            LLM_MODEL,
+            model_provider=LLM_PROVIDER,
+            temperature=temperature,
+            mistral_api_key=os.getenv("MISTRAL_API_KEY")
+        )
+
+    def factory():
+        # LLM_BACKEND=record or replay puts a recording or replaying model in place of the live one.
+        from tools.llm_backend import wrap_chat_model
+        return wrap_chat_model(build_live, LLM_MODEL, temperature)
+    return factory
+
+resources = ResourceRegistry()
+resources.register("embedding_model", _build_embedding_model)
+resources.register("chroma_client", _build_chroma_client)
+resources.register("schema_collection", _build_schema_collection)
+resources.register("numpy_index", _build_numpy_index)
+resources.register("llm", _build_chat_model(0.3))
+resources.register("llm_tools", _build_chat_model(0.5))
@@ -0,0 +1,139 @@
+import os
+import math
+import datetime
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+INSIGHTS_SUMMARY_ENABLED = os.getenv("INSIGHTS_SUMMARY_ENABLED", "true").lower() == "true"
+INSIGHTS_MAX_TOKENS = int(os.getenv("INSIGHTS_MAX_TOKENS", "1500"))
+INSIGHTS_FULL_ROWS = int(os.getenv("INSIGHTS_FULL_ROWS", "50"))
+INSIGHTS_SAMPLE_ROWS = int(os.getenv("INSIGHTS_SAMPLE_ROWS", "5"))
+INSIGHTS_TOP_K = int(os.getenv("INSIGHTS_TOP_K", "5"))
+CHARS_PER_TOKEN = float(os.getenv("INSIGHTS_CHARS_PER_TOKEN", "4"))
+
+def estimate_tokens(text: str):
+    """Roughly estimates the number of LLM tokens in a text from its length."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def _truncate(text: str, max_tokens: int):
+    # The longest text `estimate_tokens` still counts as at most `max_tokens`.
+    max_chars = math.ceil(max_tokens * CHARS_PER_TOKEN) - 1
+    if len(text) <= max_chars:
+        return text
+    marker = " ... [truncated]"
+    return text[:max(max_chars - len(marker), 0)] + marker
+
+def _fits(result, max_tokens: int):
+    """Checks row by row whether the text of `result` fits `max_tokens`, stopping at the first row past it."""
+    max_chars, length = max_tokens * CHARS_PER_TOKEN, 2
+    for row in result:
+        length += len(str(row)) + 2
+        if length > max_chars:
+            return False
+    return True
+
+def _split_result(result, columns):
+    """Separates the header row that `execute_select_query` puts first from the data rows."""
+    if not columns or tuple(result[0]) == tuple(columns):
+        return [str(name) for name in result[0]], result[1:]
+    return list(columns), result
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+def _format_rows(rows):
+    return "\n".join("  " + " | ".join(_format_value(value) for value in row) for row in rows)
+
+def column_stats(name: str, series: pd.Series, top_k: int = INSIGHTS_TOP_K):
+    """
+    Describes one result column in a single line.
+
+    Numeric columns get min/max/mean, date columns get their range and all other columns
+    their most frequent values.
+
+    Args:
+        name (str): The column name.
+        series (pd.Series): The column values.
+        top_k (int, optional): Number of most frequent values listed for categorical columns.
+
+    Returns:
+        str: The column description.
+    """
+    values = series.dropna()
+    nulls = len(series) - len(values)
+    suffix = f", {nulls} nulls" if nulls else ""
+    if values.empty:
+        return f"- {name}: all null"
+
+    if pd.api.types.is_datetime64_any_dtype(values) or isinstance(values.iloc[0], (datetime.date, pd.Timestamp)):
+        return f"- {name} (date): from {values.min()} to {values.max()}{suffix}"
+
+    numeric = pd.to_numeric(values, errors="coerce")
+    if not isinstance(values.iloc[0], (str, bool)) and numeric.notna().all():
+        return (
+            f"- {name} (numeric): min {_format_value(numeric.min())}, max {_format_value(numeric.max())}, "
+            f"mean {_format_value(float(numeric.mean()))}{suffix}"
+        )
+
+    counts = values.astype(str).value_counts()
+    if len(counts) == len(values):
+        examples = ", ".join(counts.index[:top_k])
+        return f"- {name} (text, all values distinct): e.g. {examples}{suffix}"
+    top = ", ".join(f"{value} ({count})" for value, count in counts.head(top_k).items())
+    return f"- {name} (categorical, {len(counts)} distinct): {top}{suffix}"
+
+def summarize_result(result, columns=None, truncated: bool = False, max_tokens: int = INSIGHTS_MAX_TOKENS,
+                     full_rows: int = INSIGHTS_FULL_ROWS, sample_rows: int = INSIGHTS_SAMPLE_ROWS):
+    """
+    Builds a bounded-size description of a query result for the insights prompt.
+
+    Small results are passed through unchanged. Larger ones are replaced by a digest with the
+    column list, the row count, the first and last rows and per-column statistics, shortened
+    until it fits the token budget.
+
+    Args:
+        result (list or str): The result as returned by `execute_select_query`, header row first,
+            or a message such as "Query executed successfully.".
+        columns (list, optional): The column names.
+        truncated (bool, optional): Whether the result was capped when it was fetched.
+        max_tokens (int, optional): Token budget for the returned text.
+        full_rows (int, optional): Results with at most this many rows are sent in full if they fit.
+        sample_rows (int, optional): Number of rows shown from each end of a larger result.
+
+    Returns:
+        str: The text passed to the insights prompt as the database results.
+    """
+    if not INSIGHTS_SUMMARY_ENABLED:
+        return str(result)
+    if not isinstance(result, list) or not result:
+        return _truncate(str(result), max_tokens)
+
+    header, rows = _split_result(result, columns)
+    # The full text is only built for small results that fit; larger ones go straight to the digest.
+    if len(rows) <= full_rows and _fits(result, max_tokens):
+        return str(result)
+
+    frame = pd.DataFrame([list(row) for row in rows], columns=header)
+    count = f"{len(rows)} (capped when fetched, the full result has more rows)" if truncated else str(len(rows))
+    stats = [column_stats(name, frame.iloc[:, i]) for i, name in enumerate(header)] if rows else []
+
+    while True:
+        lines = [f"Columns: {', '.join(header)}", f"Row count: {count}"]
+        if sample_rows > 0 and rows:
+            head = rows[:sample_rows]
+            tail = rows[-sample_rows:] if len(rows) > 2 * sample_rows else rows[len(head):]
+            lines.append(f"First rows:\n{_format_rows(head)}")
+            if tail:
+                lines.append(f"Last rows:\n{_format_rows(tail)}")
+        if stats:
+            lines.append("Column statistics:")
+            lines.extend(stats)
+        digest = "\n".join(lines)
+
+        if estimate_tokens(digest) <= max_tokens or sample_rows == 0:
+            return _truncate(digest, max_tokens)
+        sample_rows //= 2
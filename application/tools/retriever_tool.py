@@ -1,34 +1,207 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+import os
+from tools.resources import resources, RETRIEVAL_BACKEND
+from tools.schema_introspection import table_definition, start_schema_refresher
+from tools.instrumentation import timed
 
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+RETRIEVAL_LARGE_UPLOAD_ROWS = int(os.getenv("RETRIEVAL_LARGE_UPLOAD_ROWS", "20"))
+RETRIEVAL_RECORD_MODE = os.getenv("RETRIEVAL_RECORD_MODE", "columns")
+RETRIEVAL_MAX_QUERIES = int(os.getenv("RETRIEVAL_MAX_QUERIES", "32"))
+SCHEMA_INDEX = os.getenv("SCHEMA_INDEX", "prose")
+SCHEMA_TABLES_TOP_N = int(os.getenv("SCHEMA_TABLES_TOP_N", "4"))
+SCHEMA_EXPAND_NEIGHBORS = os.getenv("SCHEMA_EXPAND_NEIGHBORS", "false").lower() == "true"
 
-chroma_client = chromadb.PersistentClient(path="D:\\Internship\\text-to-SQL\\application\\chroma")
-collection = chroma_client.get_collection(name="sql_data")
+def retrieve_tables_batch(query_embeddings, top_n: int = SCHEMA_TABLES_TOP_N):
+    """
+    Retrieves whole table definitions from the structured schema index.
+    The best matching tables are extended with the tables on the foreign-key
+    join paths between them (and their direct neighbors if SCHEMA_EXPAND_NEIGHBORS).
 
-def retrieve_schema(query: str, top_n: int = 10):
+    Args:
+        query_embeddings (array-like): Query embeddings, shape (n_queries, dim).
+        top_n (int, optional): The number of tables matched per query before expansion.
+
+    Returns:
+        list: One list of (table_name, table_definition) tuples per query.
     """
-    Queries the ChromaDB vector store using semantic similarity search.
+    # Builds the index in the background if it is missing; until then retrieval fails.
+    start_schema_refresher()
+    schema = resources.get("structured_schema")
+    results = []
+    for hits in resources.get("table_index").query_batch(query_embeddings, top_n):
+        tables = schema["graph"].expand([name for name, _, _ in hits], include_neighbors=SCHEMA_EXPAND_NEIGHBORS)
+        results.append([(name, table_definition(name, schema["tables"][name])) for name in tables])
+    return results
+
+@timed("retrieval")
+def retrieve_schema_chunks(query: str, top_n: int = 10):
+    """
+    Queries the schema index and returns the matching chunks with their IDs.
+    The index is ChromaDB, or the in-memory NumPy index when RETRIEVAL_BACKEND is "numpy".
+    When SCHEMA_INDEX is "structured", the chunks are whole table definitions keyed by table name.
 
     Args:
         query (str): The input query.
-        top_n (int, optional): The number of top similar results to return. Defaults to 5.
+        top_n (int, optional): The number of top similar results to return. Defaults to 10.
 
     Returns:
-        list: A list of retrieved documents with similarity scores.
+        list: A list of (chunk_id, document) tuples, most similar first.
     """
-    query_embedding = embedding_model.encode(query).tolist()  
-    results = collection.query(
+    if SCHEMA_INDEX == "structured":
+        return retrieve_schema_chunks_batch([query], top_n)[0]
+
+    if RETRIEVAL_BACKEND == "numpy":
+        query_embedding = resources.get("embedding_model").encode(query)
+        return [(chunk_id, doc) for chunk_id, doc, _ in resources.get("numpy_index").query(query_embedding, top_n)]
+
+    query_embedding = resources.get("embedding_model").encode(query).tolist()  
+    results = resources.get("schema_collection").query(
         query_embeddings=[query_embedding], 
         n_results=top_n
     )
 
+    return list(zip(results["ids"][0], results["documents"][0]))
+
+def retrieve_schema(query: str, top_n: int = 10):
+    """
+    Queries the ChromaDB vector store using semantic similarity search.
+
+    Args:
+        query (str): The input query.
+        top_n (int, optional): The number of top similar results to return. Defaults to 10.
+
+    Returns:
+        list: A list of retrieved documents with their rank.
+    """
     retrieved_docs = []
-    for  doc in enumerate(results["documents"][0]):
+    for  doc in enumerate(doc for _, doc in retrieve_schema_chunks(query, top_n)):
         retrieved_docs.append((doc))
 
     return retrieved_docs
 
+@timed("retrieval")
+def retrieve_schema_chunks_batch(queries, top_n: int = 10):
+    """
+    Retrieves schema chunks for many queries with one embedding forward pass and one index query.
+
+    Args:
+        queries (list): The input queries.
+        top_n (int, optional): The number of results per query. Defaults to 10.
+
+    Returns:
+        list: One list of (chunk_id, document) tuples per query, most similar first.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+
+    query_embeddings = resources.get("embedding_model").encode(queries)
+    if SCHEMA_INDEX == "structured":
+        return retrieve_tables_batch(query_embeddings, min(top_n, SCHEMA_TABLES_TOP_N))
+
+    if RETRIEVAL_BACKEND == "numpy":
+        return [
+            [(chunk_id, doc) for chunk_id, doc, _ in hits]
+            for hits in resources.get("numpy_index").query_batch(query_embeddings, top_n)
+        ]
+
+    results = resources.get("schema_collection").query(
+        query_embeddings=query_embeddings.tolist(),
+        n_results=top_n
+    )
+    return [list(zip(ids, docs)) for ids, docs in zip(results["ids"], results["documents"])]
+
+def retrieve_schema_batch(queries, top_n: int = 10):
+    """
+    Batched version of `retrieve_schema`.
+
+    Args:
+        queries (list): The input queries.
+        top_n (int, optional): The number of results per query. Defaults to 10.
+
+    Returns:
+        list: One list of retrieved documents with their rank per query.
+    """
+    return [
+        list(enumerate(doc for _, doc in chunks))
+        for chunks in retrieve_schema_chunks_batch(queries, top_n)
+    ]
+
+def retrieve_schema_union(queries, top_n: int = 10, max_results: int = None):
+    """
+    Retrieves schema chunks for many queries and merges them without duplicates.
+    Chunks are interleaved by rank, so every query's best matches come first.
+
+    Args:
+        queries (list): The input queries.
+        top_n (int, optional): The number of results per query. Defaults to 10.
+        max_results (int, optional): Cap on the merged results. Defaults to no cap.
+
+    Returns:
+        list: A list of retrieved documents with their rank, like `retrieve_schema`.
+    """
+    per_query = retrieve_schema_chunks_batch(queries, top_n)
+    seen = set()
+    merged = []
+    for rank in range(top_n):
+        for chunks in per_query:
+            if rank < len(chunks) and chunks[rank][0] not in seen:
+                seen.add(chunks[rank][0])
+                merged.append(chunks[rank][1])
+    if max_results is not None:
+        merged = merged[:max_results]
+    return list(enumerate(merged))
+
+def build_record_queries(question: str, records, mode: str = RETRIEVAL_RECORD_MODE,
+                         max_queries: int = RETRIEVAL_MAX_QUERIES):
+    """
+    Builds one retrieval query per uploaded record or per distinct set of columns.
+
+    Args:
+        question (str): The user's question.
+        records (list): The uploaded rows as dictionaries.
+        mode (str, optional): "columns" for one query per distinct column set,
+            "records" for one query per record.
+        max_queries (int, optional): Cap on the number of queries.
+
+    Returns:
+        list: The retrieval queries.
+    """
+    if mode == "records":
+        return [f"{question} + {record}" for record in records[:max_queries]]
+
+    column_sets = []
+    for record in records:
+        # Missing CSV cells arrive as None or NaN (which is not equal to itself).
+        columns = tuple(key for key, value in record.items() if value is not None and value == value)
+        if columns not in column_sets:
+            column_sets.append(columns)
+            if len(column_sets) >= max_queries:
+                break
+    return [f"{question} + columns: {', '.join(map(str, columns))}" for columns in column_sets]
+
+@timed("retrieval")
+def retrieve_schema_for_records(question: str, records, top_n: int = 10):
+    """
+    Retrieves schema information for a question about uploaded CSV records.
+
+    Small uploads are stringified into a single query. Uploads with more than
+    RETRIEVAL_LARGE_UPLOAD_ROWS records are split into per-record or per-column-set
+    queries (RETRIEVAL_RECORD_MODE), retrieved in one batch and merged.
+
+    Args:
+        question (str): The user's question.
+        records (list or str): The uploaded records.
+        top_n (int, optional): The number of results per query. Defaults to 10.
+
+    Returns:
+        list: A list of retrieved documents with their rank.
+    """
+    if not isinstance(records, list) or len(records) <= RETRIEVAL_LARGE_UPLOAD_ROWS:
+        return retrieve_schema(f"{question} + {records}", top_n)
+
+    queries = [question] + build_record_queries(question, records)
+    return retrieve_schema_union(queries, top_n, max_results=top_n * 2)
+
 # query = "In which store was customer with email 'MARY.SMITH@sakilacustomer.org' registered in?"
 # results = retrieve_schema(query)
 
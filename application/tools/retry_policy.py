@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import random
+import asyncio
+from dotenv import load_dotenv
+from httpx import HTTPStatusError
+from tools.instrumentation import metrics
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "16"))
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", "60"))
+RETRY_TOKEN_BUDGET = int(os.getenv("RETRY_TOKEN_BUDGET", "6000"))
+RETRY_JITTER = os.getenv("RETRY_JITTER", "true").lower() == "true"
+
+# Checked in order; the first matching pattern decides the class of a database or LLM error.
+# A 429 status is only taken from the exception, never from the message, which may echo SQL
+# literals such as "LIMIT 429".
+ERROR_CLASSES = [
+    ("rate_limit", re.compile(r"rate limit|too many requests", re.IGNORECASE)),
+    ("timeout", re.compile(r"\b3024\b|maximum statement execution time|timed? ?out", re.IGNORECASE)),
+    ("connection", re.compile(r"\b(2003|2006|2013)\b|lost connection|server has gone away|can't connect", re.IGNORECASE)),
+    ("too_expensive", re.compile(r"rejected before execution", re.IGNORECASE)),
+    ("unknown_column", re.compile(r"\b1054\b|unknown column", re.IGNORECASE)),
+    ("unknown_table", re.compile(r"\b1146\b|unknown table|doesn't exist", re.IGNORECASE)),
+    ("syntax", re.compile(r"\b1064\b|syntax error|sql syntax|expected exactly one statement", re.IGNORECASE)),
+]
+
+# Errors that go away by waiting; every other class needs the query to be corrected.
+TRANSIENT_ERRORS = {"rate_limit", "connection"}
+
+class QueueTimeoutError(TimeoutError):
+    """
+    Raised when an LLM call waited too long for the rate limiter. The queue is saturated,
+    so the call is not retried.
+    """
+
+def classify_error(error):
+    """
+    Sorts an error into a class that decides how it is retried.
+
+    Args:
+        error (Exception or str): The exception raised, or the error message of a failed result.
+
+    Returns:
+        str: rate_limit, queue_timeout, timeout, connection, too_expensive, unknown_column,
+            unknown_table, syntax or other.
+    """
+    if isinstance(error, QueueTimeoutError):
+        return "queue_timeout"
+    if isinstance(error, HTTPStatusError):
+        return "rate_limit" if error.response.status_code == 429 else "other"
+    if getattr(error, "status_code", None) == 429:
+        return "rate_limit"
+    text = str(error)
+    for name, pattern in ERROR_CLASSES:
+        if pattern.search(text):
+            return name
+    return "other"
+
+def _retry_after(error):
+    """Returns the delay requested by a Retry-After header, if any."""
+    if isinstance(error, HTTPStatusError):
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+class RetryState:
+    """
+    Tracks the attempts made for one failing request against a `RetryPolicy`.
+
+    Only the last failure is passed on in full; earlier ones are reduced to their error class
+    and a short excerpt, so correction prompts do not grow with every attempt.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.started = time.monotonic()
+        self.attempts = 0
+        self.tokens = 0
+        self.history = []
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left before the deadline."""
+        return self.policy.deadline - self.elapsed()
+
+    def stop_reason(self, tokens: int = 0):
+        """
+        Returns why no further attempt may be made, or None if one may.
+
+        Args:
+            tokens (int, optional): Estimated prompt tokens of the next attempt.
+        """
+        if self.attempts >= self.policy.max_attempts:
+            return f"reached {self.policy.max_attempts} attempts"
+        if self.remaining() <= 0:
+            return f"passed the {self.policy.deadline:.0f}s deadline"
+        if self.policy.token_budget and self.tokens + tokens > self.policy.token_budget:
+            return f"would exceed the {self.policy.token_budget} token budget"
+        return None
+
+    def add_failure(self, error_class: str, error, failed_query: str = ""):
+        """Records a failure: the initial one or that of an attempt."""
+        self.history.append({"error_class": error_class, "error": str(error), "failed_query": failed_query})
+
+    def begin_attempt(self, tokens: int = 0):
+        """Counts an attempt and the prompt tokens it spends."""
+        self.attempts += 1
+        self.tokens += tokens
+
+    def delay(self, error_class: str, error=None):
+        """Returns how long to wait before the next attempt; only transient errors wait."""
+        if error_class not in TRANSIENT_ERRORS:
+            return 0.0
+        return min(self.policy.backoff(self.attempts, error), max(self.remaining(), 0.0))
+
+    def compact_error(self):
+        """
+        Builds the error text for the next correction prompt: the latest error in full,
+        followed by one short line per earlier failure.
+        """
+        if not self.history:
+            return ""
+        earlier = [
+            f"- {entry['error_class']}: {entry['error'][:160]}"
+            for entry in self.history[:-1] if entry["error_class"] not in TRANSIENT_ERRORS
+        ]
+        if not earlier:
+            return self.history[-1]["error"]
+        return f"{self.history[-1]['error']}\nEarlier attempts also failed:\n" + "\n".join(earlier)
+
+    def summary(self):
+        """Returns the attempts, elapsed time, tokens used and error classes seen."""
+        return {
+            "attempts": self.attempts,
+            "elapsed": round(self.elapsed(), 3),
+            "tokens": self.tokens,
+            "error_classes": [entry["error_class"] for entry in self.history]
+        }
+
+class RetryPolicy:
+    """
+    Decides how failures are retried: how often, how long to wait between attempts, and when
+    to give up.
+
+    Delays grow exponentially from `base_delay` up to `max_delay`, with full jitter so that
+    concurrent sessions do not retry in lockstep. A Retry-After header takes precedence. No
+    attempt starts after the deadline or once the token budget is spent.
+
+    Args:
+        max_attempts (int, optional): Maximum number of retries.
+        base_delay (float, optional): Delay before the first retry, in seconds.
+        max_delay (float, optional): Upper bound of a single delay, in seconds.
+        deadline (float, optional): Total time allowed for all retries, in seconds.
+        token_budget (int, optional): Estimated prompt tokens allowed for all LLM retries. 0 disables it.
+        jitter (bool, optional): Randomize the delays.
+    """
+
+    def __init__(self, max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, deadline: float = RETRY_DEADLINE,
+                 token_budget: int = RETRY_TOKEN_BUDGET, jitter: bool = RETRY_JITTER):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.token_budget = token_budget
+        self.jitter = jitter
+
+    def backoff(self, attempt: int, error=None):
+        """Returns the delay before retry number `attempt + 1`, in seconds."""
+        requested = _retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def start(self):
+        """Starts tracking the retries of one request."""
+        return RetryState(self)
+
+    def _next_delay(self, state, error):
+        error_class = classify_error(error)
+        state.add_failure(error_class, error)
+        if error_class not in TRANSIENT_ERRORS or state.stop_reason() is not None:
+            return None
+        delay = state.delay(error_class, error)
+        state.begin_attempt()
+        metrics.inc("retries_total", scope="request", error_class=error_class)
+        return delay
+
+    def call(self, func, *args, on_retry=None, **kwargs):
+        """
+        Calls `func`, retrying it after rate limits and lost connections.
+
+        Args:
+            func (callable): The function to call.
+            on_retry (callable, optional): Called as `on_retry(attempt, delay, error)` before each wait.
+
+        Returns:
+            object: What `func` returns. The last error is raised once the policy gives up.
+        """
+        state = self.start()
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(state, e)
+                if delay is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(state.attempts, delay, e)
+                time.sleep(delay)
+
+    async def acall(self, func, *args, on_retry=None, **kwargs):
+        """Async version of `call` for coroutine functions."""
+        state = self.start()
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(state, e)
+                if delay is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(state.attempts, delay, e)
+                await asyncio.sleep(delay)
+
+retry_policy = RetryPolicy()
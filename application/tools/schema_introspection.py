@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from tools.database_tools import get_pool, DB_NAME
+from tools.resources import resources
+from tools.instrumentation import get_logger
+
+STRUCTURED_SCHEMA_PATH = os.getenv(
+    "STRUCTURED_SCHEMA_PATH", os.path.join(os.path.dirname(__file__), "../cache/structured_schema.json")
+)
+TABLE_INDEX_PATH = os.getenv("TABLE_INDEX_PATH", os.path.join(os.path.dirname(__file__), "../cache/table_index"))
+# Seconds after which the saved schema is compared with the database again. 0 never re-checks.
+STRUCTURED_SCHEMA_MAX_AGE = float(os.getenv("STRUCTURED_SCHEMA_MAX_AGE", "3600"))
+
+logger = get_logger(__name__)
+
+COLUMNS_QUERY = """
+    SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = %s
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+KEYS_QUERY = """
+    SELECT TABLE_NAME, COLUMN_NAME, CONSTRAINT_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = %s
+    ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+def introspect_schema(database: str = DB_NAME):
+    """
+    Reads tables, columns, types, primary keys and foreign keys from information_schema.
+
+    Args:
+        database (str, optional): The schema to introspect. Defaults to DB_NAME.
+
+    Returns:
+        dict: {table: {"columns": [...], "primary_key": [...], "foreign_keys": [...]}}
+    """
+    tables = {}
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(COLUMNS_QUERY, (database,))
+            for table, column, column_type, nullable, _ in cursor.fetchall():
+                entry = tables.setdefault(table, {"columns": [], "primary_key": [], "foreign_keys": []})
+                entry["columns"].append({"name": column, "type": column_type, "nullable": nullable == "YES"})
+
+            cursor.execute(KEYS_QUERY, (database,))
+            foreign_keys = {}
+            for table, column, constraint, ref_table, ref_column in cursor.fetchall():
+                if table not in tables:
+                    continue
+                if constraint == "PRIMARY":
+                    tables[table]["primary_key"].append(column)
+                elif ref_table:
+                    fk = foreign_keys.setdefault((table, constraint), {"columns": [], "ref_table": ref_table, "ref_columns": []})
+                    fk["columns"].append(column)
+                    fk["ref_columns"].append(ref_column)
+        finally:
+            cursor.close()
+
+    for (table, _), fk in foreign_keys.items():
+        tables[table]["foreign_keys"].append(fk)
+    return tables
+
+def table_definition(name: str, table: dict):
+    """
+    Renders one table as a compact, DDL-like line for the SQL generation prompt.
+
+    Example:
+        film_actor(actor_id SMALLINT UNSIGNED PK FK->actor.actor_id, film_id SMALLINT UNSIGNED PK FK->film.film_id, ...)
+    """
+    references = {}
+    for fk in table["foreign_keys"]:
+        for column, ref_column in zip(fk["columns"], fk["ref_columns"]):
+            references[column] = f"{fk['ref_table']}.{ref_column}"
+
+    columns = []
+    for column in table["columns"]:
+        parts = [column["name"], column["type"].upper()]
+        if column["name"] in table["primary_key"]:
+            parts.append("PK")
+        if column["name"] in references:
+            parts.append(f"FK->{references[column['name']]}")
+        if not column["nullable"] and column["name"] not in table["primary_key"]:
+            parts.append("NOT NULL")
+        columns.append(" ".join(parts))
+    return f"{name}({', '.join(columns)})"
+
+def table_search_text(name: str, table: dict, graph=None):
+    """Builds the text embedded for a table: its name, column names and related tables."""
+    text = f"Table {name} with columns {', '.join(column['name'] for column in table['columns'])}."
+    if graph is not None and graph.neighbors(name):
+        text += f" Related tables: {', '.join(sorted(graph.neighbors(name)))}."
+    return text
+
+class SchemaGraph:
+    """
+    An undirected adjacency graph of tables connected by foreign keys.
+
+    Args:
+        tables (dict): The introspected schema returned by `introspect_schema`.
+    """
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self.adjacency = {name: set() for name in tables}
+        for name, table in tables.items():
+            for fk in table["foreign_keys"]:
+                if fk["ref_table"] in self.adjacency and fk["ref_table"] != name:
+                    self.adjacency[name].add(fk["ref_table"])
+                    self.adjacency[fk["ref_table"]].add(name)
+
+    def neighbors(self, table: str):
+        """Returns the tables directly joined to `table` by a foreign key."""
+        return self.adjacency.get(table, set())
+
+    def join_path(self, source: str, target: str):
+        """
+        Finds the shortest chain of foreign-key joins between two tables.
+
+        Returns:
+            list or None: The tables on the path, including both ends, or None if unconnected.
+        """
+        if source not in self.adjacency or target not in self.adjacency:
+            return None
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1]
+            for neighbor in sorted(self.adjacency[table]):
+                if neighbor not in previous:
+                    previous[neighbor] = table
+                    queue.append(neighbor)
+        return None
+
+    def expand(self, tables, include_neighbors: bool = False):
+        """
+        Adds the tables needed to join the given tables together.
+
+        Args:
+            tables (list): The selected tables, most relevant first.
+            include_neighbors (bool, optional): Also add every direct neighbor of the selected tables.
+
+        Returns:
+            list: The selected tables followed by the join-path tables, without duplicates.
+        """
+        result = list(dict.fromkeys(tables))
+        for i, source in enumerate(tables):
+            for target in tables[i + 1:]:
+                for table in self.join_path(source, target) or []:
+                    if table not in result:
+                        result.append(table)
+        if include_neighbors:
+            for table in list(result):
+                for neighbor in sorted(self.neighbors(table)):
+                    if neighbor not in result:
+                        result.append(neighbor)
+        return result
+
+def schema_fingerprint(tables):
+    """Hashes an introspected schema; equal schemas get equal fingerprints."""
+    return hashlib.sha256(json.dumps(tables, sort_keys=True).encode("utf-8")).hexdigest()
+
+def structured_schema_version(schema_path: str = STRUCTURED_SCHEMA_PATH):
+    """
+    Returns the fingerprint of the saved structured schema, or "missing" if it has not been
+    built or cannot be read.
+    """
+    try:
+        with open(schema_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        return saved.get("version") or schema_fingerprint(saved["tables"])
+    except (FileNotFoundError, ValueError, KeyError):
+        return "missing"
+
+def build_structured_index(database: str = DB_NAME, schema_path: str = STRUCTURED_SCHEMA_PATH,
+                           index_path: str = TABLE_INDEX_PATH, tables=None):
+    """
+    Introspects the database, saves the structured schema as JSON and embeds one entry per table.
+
+    Args:
+        tables (dict, optional): An introspected schema to index instead of introspecting again.
+
+    Returns:
+        dict: The introspected schema.
+    """
+    from tools.numpy_index import NumpySchemaIndex
+
+    if tables is None:
+        tables = introspect_schema(database)
+    graph = SchemaGraph(tables)
+
+    names = sorted(tables)
+    embeddings = resources.get("embedding_model").encode([table_search_text(name, tables[name], graph) for name in names])
+    NumpySchemaIndex(names, [table_definition(name, tables[name]) for name in names], embeddings).save(index_path)
+
+    # The schema JSON is replaced last, after the index, so its new version is never seen
+    # alongside the old index. Readers such as the SQL cache never see a partly written file.
+    os.makedirs(os.path.dirname(os.path.abspath(schema_path)), exist_ok=True)
+    with open(f"{schema_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"database": database, "version": schema_fingerprint(tables), "tables": tables}, f, indent=2)
+    os.replace(f"{schema_path}.tmp", schema_path)
+    return tables
+
+_refresh_lock = threading.Lock()
+
+def _checked_recently(schema_path: str, max_age: float):
+    return max_age <= 0 or time.time() - os.path.getmtime(schema_path) < max_age
+
+def refresh_structured_schema(max_age: float = STRUCTURED_SCHEMA_MAX_AGE, database: str = DB_NAME,
+                              schema_path: str = STRUCTURED_SCHEMA_PATH, index_path: str = TABLE_INDEX_PATH):
+    """
+    Keeps the structured schema and table index in step with the database.
+
+    They are built if missing. Once the saved schema is older than `max_age` seconds, the
+    database is introspected again: an unchanged schema only renews the file's timestamp,
+    a changed one is re-indexed and the loaded resources are dropped so that they are
+    reloaded. Readers of `structured_schema_version`, such as the SQL cache, see the new
+    fingerprint.
+
+    Returns:
+        bool: True if the schema was rebuilt.
+    """
+    from tools.numpy_index import NumpySchemaIndex
+
+    def is_built():
+        return os.path.exists(schema_path) and NumpySchemaIndex.exists(index_path)
+
+    if is_built() and _checked_recently(schema_path, max_age):
+        return False
+    with _refresh_lock:
+        built = is_built()
+        if built and _checked_recently(schema_path, max_age):
+            return False
+        try:
+            tables = introspect_schema(database)
+        except Exception as e:
+            logger.warning("Could not introspect the database schema: %s", e)
+            if built:
+                # Keep serving the saved schema; it is checked again after another max_age.
+                os.utime(schema_path)
+                return False
+            raise
+        if built and schema_fingerprint(tables) == structured_schema_version(schema_path):
+            os.utime(schema_path)
+            return False
+        logger.info("Building the structured schema in %s", schema_path)
+        build_structured_index(database, schema_path, index_path, tables=tables)
+    if schema_path == STRUCTURED_SCHEMA_PATH and index_path == TABLE_INDEX_PATH:
+        resources.reset("structured_schema")
+        resources.reset("table_index")
+    return True
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def _refresh_periodically(interval: float):
+    while True:
+        try:
+            refresh_structured_schema()
+        except Exception as e:
+            logger.warning("Could not build the structured schema: %s", e)
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+def start_schema_refresher(interval: float = STRUCTURED_SCHEMA_MAX_AGE):
+    """
+    Runs `refresh_structured_schema` in a background thread, once right away and then every
+    `interval` seconds (only once if `interval` is 0), so requests never wait for the
+    database to be introspected and re-indexed. Later calls do nothing.
+
+    Returns:
+        threading.Thread: The refresher thread.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = threading.Thread(
+                target=_refresh_periodically, args=(interval,), name="schema-refresher", daemon=True
+            )
+            _refresher.start()
+    return _refresher
+
+NOT_BUILT_MESSAGE = (
+    "The structured schema has not been built yet. Run `python -m utils.schema_indexer`, "
+    "or wait for the background schema refresher."
+)
+
+# The loaders only read the saved files; building them is left to `start_schema_refresher`
+# and utils/schema_indexer.py, so that requests never wait for it.
+def _load_structured_schema():
+    try:
+        with open(STRUCTURED_SCHEMA_PATH, "r", encoding="utf-8") as f:
+            tables = json.load(f)["tables"]
+    except FileNotFoundError:
+        raise FileNotFoundError(NOT_BUILT_MESSAGE) from None
+    return {"tables": tables, "graph": SchemaGraph(tables)}
+
+def _load_table_index():
+    from tools.numpy_index import NumpySchemaIndex
+    if not NumpySchemaIndex.exists(TABLE_INDEX_PATH):
+        raise FileNotFoundError(NOT_BUILT_MESSAGE)
+    return NumpySchemaIndex.load(TABLE_INDEX_PATH)
+
+resources.register("structured_schema", _load_structured_schema)
+resources.register("table_index", _load_table_index)
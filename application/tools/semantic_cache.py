@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from tools.resources import resources
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "900"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+SEMANTIC_CACHE_REUSE_ROWS = os.getenv("SEMANTIC_CACHE_REUSE_ROWS", "false").lower() == "true"
+
+TABLE_PATTERN = re.compile(
+    r"\b(?:from|join|into|update|table)\s+`?(\w+)`?(?:\s*\.\s*`?(\w+)`?)?",
+    re.IGNORECASE
+)
+
+def extract_tables(sql_query: str):
+    """
+    Extracts the table names referenced by an SQL query.
+
+    Args:
+        sql_query (str): The SQL query.
+
+    Returns:
+        set: Lower-cased table names (schema prefixes are dropped).
+    """
+    tables = set()
+    for match in TABLE_PATTERN.finditer(sql_query or ""):
+        tables.add((match.group(2) or match.group(1)).lower())
+    return tables
+
+NUMBER_WORDS = {
+    word: str(value) for value, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen "
+        "fifteen sixteen seventeen eighteen nineteen twenty".split()
+    )
+}
+
+LITERAL_PATTERN = re.compile(r"\"([^\"]*)\"|'([^']*)'|(\d+(?:\.\d+)?)|([A-Za-z][\w-]*)")
+
+def question_literals(question: str):
+    """
+    Extracts the parts of a question that change its answer but barely move its embedding:
+    numbers (digits or number words up to twenty), quoted strings and named entities,
+    taken to be capitalized words other than the first.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        frozenset: The literals, lower-cased.
+    """
+    literals = set()
+    for index, match in enumerate(LITERAL_PATTERN.finditer(question)):
+        quoted, number, word = match.group(1) or match.group(2), match.group(3), match.group(4)
+        if quoted is not None:
+            literals.add(quoted.strip().lower())
+        elif number is not None:
+            literals.add(number)
+        elif word.lower() in NUMBER_WORDS:
+            literals.add(NUMBER_WORDS[word.lower()])
+        elif index > 0 and word[0].isupper():
+            literals.add(word.lower())
+    return frozenset(literals)
+
+def _default_embed(text: str):
+    return resources.get("embedding_model").encode(text)
+
+class SemanticCache:
+    """
+    Caches answers of the read pipeline keyed on the embedding of the question.
+
+    A lookup returns the most similar cached question whose cosine similarity is at
+    least `threshold` and whose numbers, quoted strings and named entities are exactly
+    those of the new question (see `question_literals`), so that "top 10 films" is not
+    answered with "top 20 films". Entries expire after `ttl` seconds, the least recently used entry
+    is evicted once `max_entries` is reached, and entries are dropped whenever a table
+    they read from is modified.
+
+    Args:
+        embed (callable, optional): Maps a question to an embedding vector.
+        threshold (float, optional): Minimum cosine similarity for a hit.
+        ttl (float, optional): Lifetime of an entry in seconds.
+        max_entries (int, optional): Maximum number of cached entries.
+    """
+
+    def __init__(self, embed=None, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES):
+        self._embed = embed or _default_embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.literal_mismatches = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def embed(self, question: str):
+        """Returns the normalized float32 embedding of a question."""
+        vector = np.asarray(self._embed(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+
+    def lookup(self, question: str, embedding=None):
+        """
+        Finds the cached entry for the most similar previous question.
+
+        Args:
+            question (str): The user's question.
+            embedding (np.ndarray, optional): A precomputed embedding from `embed`.
+
+        Returns:
+            dict or None: The cached entry (question, sql, tables, rows, answer, similarity) or None.
+        """
+        if embedding is None:
+            embedding = self.embed(question)
+
+        with self._lock:
+            self._expire(time.monotonic())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            keys = list(self._entries)
+            matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+            scores = matrix @ embedding
+            literals = question_literals(question)
+            for best in np.argsort(-scores):
+                if scores[best] < self.threshold:
+                    break
+                if self._entries[keys[best]]["literals"] != literals:
+                    self.literal_mismatches += 1
+                    continue
+                self._entries.move_to_end(keys[best])
+                self.hits += 1
+                entry = dict(self._entries[keys[best]])
+                entry["similarity"] = float(scores[best])
+                return entry
+
+            self.misses += 1
+            return None
+
+    def store(self, question: str, sql_query: str, rows=None, answer=None, embedding=None):
+        """
+        Adds an answered question to the cache.
+
+        Args:
+            question (str): The user's question.
+            sql_query (str): The SQL query that answered it.
+            rows (list, optional): The query result, kept only if rows are reused.
+            answer (str, optional): The generated insights, kept together with the rows.
+            embedding (np.ndarray, optional): A precomputed embedding from `embed`.
+        """
+        if embedding is None:
+            embedding = self.embed(question)
+
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[self._next_key] = {
+                "question": question,
+                "embedding": embedding,
+                "literals": question_literals(question),
+                "sql": sql_query,
+                "tables": extract_tables(sql_query),
+                "rows": rows,
+                "answer": answer,
+                "created_at": time.monotonic(),
+            }
+            self._next_key += 1
+
+    def invalidate_tables(self, tables):
+        """
+        Drops every entry whose SQL reads from one of the given tables.
+
+        Args:
+            tables (iterable): Names of modified tables.
+
+        Returns:
+            int: The number of dropped entries.
+        """
+        tables = {table.lower() for table in tables}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["tables"] & tables]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def invalidate_question(self, question: str):
+        """Drops the entries cached for exactly this question."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry["question"] == question]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: hits, misses, hit_rate, literal_mismatches (near matches rejected for a
+                different number, quoted string or name), entries, evictions and invalidations.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "literal_mismatches": self.literal_mismatches,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from tools.schema_introspection import structured_schema_version, STRUCTURED_SCHEMA_PATH
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", os.path.join(os.path.dirname(__file__), "../cache/sql_cache.sqlite3"))
+SCHEMA_PATH = os.getenv("SCHEMA_PATH", os.path.join(os.path.dirname(__file__), "../utils/schema.txt"))
+
+def normalize_question(question: str):
+    """Lower-cases a question and collapses whitespace and trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!").strip().lower()
+
+def schema_version(schema_path: str = SCHEMA_PATH, structured_path: str = STRUCTURED_SCHEMA_PATH):
+    """
+    Hashes the schema the SQL was generated against: the schema description the vector
+    store was built from and the fingerprint of the schema introspected from the database.
+
+    Args:
+        schema_path (str, optional): Path to the schema description.
+        structured_path (str, optional): Path to the structured schema JSON.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(schema_path, "rb") as f:
+            digest.update(f.read())
+    except FileNotFoundError:
+        digest.update(b"missing")
+    digest.update(structured_schema_version(structured_path).encode("utf-8"))
+    return digest.hexdigest()
+
+class SQLCache:
+    """
+    Persists generated SQL queries keyed on (normalized question, retrieved schema chunk IDs).
+
+    The cache lives in a local SQLite file so it survives restarts. It records the hash of
+    the schema it was filled against (see `schema_version`) and empties itself whenever that
+    hash changes, i.e. when the schema description is edited and re-indexed or the database
+    schema changes.
+
+    Args:
+        path (str, optional): Location of the SQLite file.
+        schema_path (str, optional): Location of the schema description to version against.
+        structured_path (str, optional): Location of the structured schema to version against.
+    """
+
+    def __init__(self, path=SQL_CACHE_PATH, schema_path=SCHEMA_PATH, structured_path=STRUCTURED_SCHEMA_PATH):
+        self.path = path
+        self.schema_path = schema_path
+        self.structured_path = structured_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._schema_mtime = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache ("
+                "question TEXT, chunk_ids TEXT, sql_query TEXT, created_at REAL, hits INTEGER DEFAULT 0, "
+                "PRIMARY KEY (question, chunk_ids))"
+            )
+            self._conn.commit()
+        self._check_schema_version()
+        return self._conn
+
+    def _check_schema_version(self):
+        mtime = []
+        for path in (self.schema_path, self.structured_path):
+            try:
+                mtime.append(os.path.getmtime(path))
+            except OSError:
+                mtime.append(None)
+        if mtime == self._schema_mtime:
+            return
+        self._schema_mtime = mtime
+
+        version = schema_version(self.schema_path, self.structured_path)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None or row[0] != version:
+            self._conn.execute("DELETE FROM sql_cache")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (version,))
+            self._conn.commit()
+
+    @staticmethod
+    def _key(question, chunk_ids):
+        return normalize_question(question), ",".join(sorted(str(chunk_id) for chunk_id in chunk_ids))
+
+    def get(self, question: str, chunk_ids):
+        """
+        Looks up the SQL query generated for this question and schema context.
+
+        Args:
+            question (str): The question sent to the SQL generation prompt.
+            chunk_ids (list): IDs of the schema chunks retrieved for it.
+
+        Returns:
+            str or None: The cached SQL query, or None on a miss.
+        """
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT sql_query FROM sql_cache WHERE question = ? AND chunk_ids = ?",
+                self._key(question, chunk_ids)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE sql_cache SET hits = hits + 1 WHERE question = ? AND chunk_ids = ?",
+                self._key(question, chunk_ids)
+            )
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, question: str, chunk_ids, sql_query: str):
+        """Stores the SQL query generated for this question and schema context."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO sql_cache (question, chunk_ids, sql_query, created_at) VALUES (?, ?, ?, ?)",
+                (*self._key(question, chunk_ids), sql_query, time.time())
+            )
+            conn.commit()
+
+    def delete(self, question: str, chunk_ids):
+        """Removes the entry for this question and schema context, e.g. after it failed to execute."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM sql_cache WHERE question = ? AND chunk_ids = ?",
+                self._key(question, chunk_ids)
+            )
+            conn.commit()
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM sql_cache")
+            conn.commit()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: hits, misses and the number of stored entries.
+        """
+        with self._lock:
+            entries = self._connection().execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+sql_cache = SQLCache()
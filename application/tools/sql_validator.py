@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import time
+import difflib
+import threading
+from dotenv import load_dotenv
+from tools.schema_introspection import STRUCTURED_SCHEMA_PATH
+from tools.instrumentation import get_logger
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+except ImportError:  # Validation falls back to cleaning only.
+    sqlglot = None
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+SQL_VALIDATION_ENABLED = os.getenv("SQL_VALIDATION_ENABLED", "true").lower() == "true"
+SQL_AUTO_REPAIR = os.getenv("SQL_AUTO_REPAIR", "true").lower() == "true"
+# Seconds to wait before trying to read the structured schema again after it could not be read.
+SQL_SCHEMA_RETRY_AFTER = float(os.getenv("SQL_SCHEMA_RETRY_AFTER", "60"))
+
+logger = get_logger(__name__)
+
+FENCE_PATTERN = re.compile(r"```(?:sql|mysql)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+LABEL_PATTERN = re.compile(r"^\s*(?:\*\*)?(?:corrected\s+)?sql(?:\s+query)?:?(?:\*\*)?:?\s*", re.IGNORECASE)
+
+def clean_sql(text: str):
+    """
+    Strips what the LLM wraps around a query: markdown fences, a leading "SQL Query:" label,
+    escaping backslashes and trailing semicolons.
+
+    Args:
+        text (str): The LLM output.
+
+    Returns:
+        str: The bare query.
+    """
+    if text is None:
+        return text
+    match = FENCE_PATTERN.search(text)
+    if match:
+        text = match.group(1)
+    text = LABEL_PATTERN.sub("", text.replace("\\", "").strip())
+    return text.strip().rstrip(";").strip()
+
+_schema_lock = threading.Lock()
+_schema_cache = {"mtime": None, "columns": None, "retry_at": 0.0}
+
+def load_schema_columns(path: str = STRUCTURED_SCHEMA_PATH):
+    """
+    Returns the introspected tables and their columns, read from the saved structured schema,
+    or None if it has not been built or cannot be read, in which case only the syntax is
+    checked. The schema is never built here. It is read again when the file changes, and after
+    a failure not before SQL_SCHEMA_RETRY_AFTER seconds have passed.
+
+    Returns:
+        dict or None: {table name (lower case): (table name, {column name (lower case): column name})}
+    """
+    with _schema_lock:
+        now = time.monotonic()
+        if now < _schema_cache["retry_at"]:
+            return None
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime != _schema_cache["mtime"]:
+                with open(path, "r", encoding="utf-8") as f:
+                    tables = json.load(f)["tables"]
+                _schema_cache["columns"] = {
+                    name.lower(): (name, {column["name"].lower(): column["name"] for column in table["columns"]})
+                    for name, table in tables.items()
+                }
+                _schema_cache["mtime"] = mtime
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("SQL validation without schema for %.0fs: %s", SQL_SCHEMA_RETRY_AFTER, e)
+            _schema_cache["retry_at"] = now + SQL_SCHEMA_RETRY_AFTER
+            return None
+        return _schema_cache["columns"]
+
+def _closest(name: str, candidates):
+    matches = difflib.get_close_matches(name.lower(), list(candidates), n=1, cutoff=0.75)
+    return matches[0] if matches else None
+
+def _resolve_table(name: str, schema: dict):
+    """Finds the schema table a (possibly misspelled or pluralized) table name refers to."""
+    lowered = name.lower()
+    for candidate in (lowered, lowered.rstrip("s"), lowered[:-2] if lowered.endswith("es") else lowered):
+        if candidate in schema:
+            return candidate
+    return _closest(lowered, schema)
+
+def validate_sql(query: str, schema=None):
+    """
+    Checks a generated query locally before it is sent to MySQL.
+
+    The query is parsed with sqlglot (MySQL dialect), and every table and column it names is
+    looked up in the introspected schema. Wrong capitalization, plural table names and near
+    misses with a single close match are repaired when SQL_AUTO_REPAIR is enabled; anything
+    else is reported as an error.
+
+    Args:
+        query (str): The query, already cleaned with `clean_sql`.
+        schema (dict, optional): As returned by `load_schema_columns`. Loaded when omitted.
+
+    Returns:
+        dict: valid (bool), sql (the query to execute, repaired if needed), errors and repairs.
+    """
+    report = {"valid": True, "sql": query, "errors": [], "repairs": []}
+    if not SQL_VALIDATION_ENABLED or sqlglot is None:
+        return report
+
+    try:
+        statements = [statement for statement in sqlglot.parse(query, read="mysql") if statement is not None]
+    except ParseError as e:
+        details = "; ".join(
+            f"{error.get('description')} near '{error.get('highlight')}' (line {error.get('line')}, column {error.get('col')})"
+            for error in e.errors[:3]
+        ) or str(e)
+        report.update(valid=False, errors=[f"Syntax error: {details}"])
+        return report
+    if len(statements) != 1:
+        report.update(valid=False, errors=[f"Expected exactly one statement, found {len(statements)}."])
+        return report
+
+    tree = statements[0]
+    schema = load_schema_columns() if schema is None else schema
+    if not schema:
+        return report
+
+    errors, repairs = report["errors"], report["repairs"]
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    derived = cte_names | {subquery.alias.lower() for subquery in tree.find_all(exp.Subquery) if subquery.alias}
+    aliases, referenced = {}, []
+
+    for table in tree.find_all(exp.Table):
+        name = table.name
+        if not name or name.lower() in cte_names or (table.db and table.db.lower() == "information_schema"):
+            continue
+        resolved = _resolve_table(name, schema)
+        if resolved is None:
+            errors.append(f"Unknown table '{name}'.")
+            continue
+        actual = schema[resolved][0]
+        if actual != name:
+            if SQL_AUTO_REPAIR:
+                table.set("this", exp.to_identifier(actual))
+                repairs.append(f"table '{name}' -> '{actual}'")
+            else:
+                errors.append(f"Unknown table '{name}'. Did you mean '{actual}'?")
+        referenced.append(resolved)
+        aliases[(table.alias or name).lower()] = resolved
+        aliases[actual.lower()] = resolved
+
+    select_aliases = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    for column in tree.find_all(exp.Column):
+        name = column.name
+        if not name or isinstance(column.this, exp.Star):
+            continue
+        qualifier = column.table.lower()
+        if qualifier:
+            if qualifier not in aliases:
+                if qualifier not in derived:
+                    errors.append(f"Unknown table or alias '{column.table}' in '{column.sql(dialect='mysql')}'.")
+                continue
+            candidates = [aliases[qualifier]]
+        else:
+            if name.lower() in select_aliases:
+                continue
+            candidates = referenced
+        if not candidates:
+            continue
+
+        owners = [table for table in candidates if name.lower() in schema[table][1]]
+        if owners:
+            actual = schema[owners[0]][1][name.lower()]
+            if actual != name and SQL_AUTO_REPAIR:
+                column.set("this", exp.to_identifier(actual))
+                repairs.append(f"column '{name}' -> '{actual}'")
+            continue
+        if not qualifier and derived:
+            # The column may come from a derived table or CTE, whose columns are not checked.
+            continue
+
+        suggestions = {table: _closest(name, schema[table][1]) for table in candidates}
+        suggestions = {table: match for table, match in suggestions.items() if match}
+        where = ", ".join(schema[table][0] for table in candidates) or "the referenced tables"
+        if len(suggestions) == 1 and SQL_AUTO_REPAIR:
+            table, match = next(iter(suggestions.items()))
+            actual = schema[table][1][match]
+            column.set("this", exp.to_identifier(actual))
+            repairs.append(f"column '{name}' -> '{actual}'")
+        elif suggestions:
+            options = ", ".join(f"{schema[table][0]}.{schema[table][1][match]}" for table, match in suggestions.items())
+            errors.append(f"Unknown column '{name}' in {where}. Did you mean {options}?")
+        else:
+            errors.append(f"Unknown column '{name}' in {where}.")
+
+    if repairs and not errors:
+        report["sql"] = tree.sql(dialect="mysql")
+    report["valid"] = not errors
+    return report
@@ -0,0 +1,150 @@
+import os
+import asyncio
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "../configs/.env"))
+
+TRACE_MAX_STEPS = int(os.getenv("TRACE_MAX_STEPS", "200"))
+
+class Trace:
+    """
+    The intermediate results of one pipeline invocation.
+
+    Steps are appended as dicts with a "step" name and a "result", like the lists the
+    pipelines used before. They are kept in order for display and debugging, and indexed by
+    name so that the latest entry of a step is found in O(1). Only the last `max_steps`
+    entries are kept. The timed spans of the request (see `tools.instrumentation`) are kept
+    alongside, under the same bound.
+
+    Args:
+        max_steps (int, optional): Maximum number of entries kept.
+    """
+
+    def __init__(self, max_steps: int = TRACE_MAX_STEPS):
+        self._steps = deque(maxlen=max_steps)
+        self._latest = {}
+        self.spans = deque(maxlen=max_steps)
+
+    def append(self, entry: dict):
+        """Records a step. A later entry with the same name replaces it in `get`."""
+        if len(self._steps) == self._steps.maxlen:
+            oldest = self._steps[0]
+            if self._latest.get(oldest["step"]) is oldest:
+                del self._latest[oldest["step"]]
+        self._steps.append(entry)
+        self._latest[entry["step"]] = entry
+
+    def extend(self, entries):
+        """Records several steps. The spans of another trace are merged too."""
+        for entry in entries:
+            self.append(entry)
+        if isinstance(entries, Trace):
+            self.spans.extend(entries.spans)
+
+    def add_span(self, span: dict):
+        self.spans.append(span)
+
+    def clear(self):
+        self._steps.clear()
+        self._latest.clear()
+        self.spans.clear()
+
+    def get(self, step: str, default=None):
+        """Returns the latest entry recorded for a step."""
+        return self._latest.get(step, default)
+
+    def result(self, step: str, default=None):
+        """Returns the result of the latest entry recorded for a step."""
+        entry = self._latest.get(step)
+        return default if entry is None else entry["result"]
+
+    def has_step_prefix(self, prefix: str):
+        """Returns True if a step whose name starts with `prefix` was recorded."""
+        return any(name.startswith(prefix) for name in self._latest)
+
+    def __contains__(self, step):
+        return step in self._latest
+
+    def __iter__(self):
+        return iter(list(self._steps))
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __repr__(self):
+        return f"Trace({list(self._steps)!r})"
+
+_current_trace = ContextVar("trace", default=None)
+
+def active_trace():
+    """Returns the trace of the running pipeline invocation, or None outside one."""
+    return _current_trace.get()
+
+def current_trace():
+    """
+    Returns the trace of the running pipeline invocation.
+
+    Raises:
+        LookupError: If no trace is active.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        raise LookupError("No active trace; run the pipeline inside use_trace().")
+    return trace
+
+@contextmanager
+def use_trace(trace: Trace = None):
+    """
+    Makes a trace the active one in the current context, so every step of a pipeline
+    invoked inside the block records into it. A new trace is created if none is given.
+
+    Yields:
+        Trace: The active trace.
+    """
+    trace = Trace() if trace is None else trace
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+def traced(func):
+    """
+    Runs a pipeline entry point in a new trace, unless the caller has already started one
+    with `use_trace`. Works for plain and coroutine functions.
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if _current_trace.get() is not None:
+                return await func(*args, **kwargs)
+            with use_trace():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_trace.get() is not None:
+            return func(*args, **kwargs)
+        with use_trace():
+            return func(*args, **kwargs)
+    return wrapper
+
+def traced_stream(stream, trace: Trace):
+    """
+    Iterates a generator with `trace` active while each of its steps runs. Generators resume
+    in the context of whoever iterates them, so every step runs in one context of its own,
+    which also keeps context variables set inside the generator from leaking to the caller.
+    """
+    context = copy_context()
+    context.run(_current_trace.set, trace)
+    while True:
+        try:
+            value = context.run(next, stream)
+        except StopIteration:
+            return
+        yield value
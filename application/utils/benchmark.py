@@ -0,0 +1,328 @@
+"""
+Runs the example questions of test_data.txt through the SELECT pipeline and reports stage
+latencies, throughput and execution-match accuracy against their reference SQL.
+
+By default the LLM is replaced by a deterministic stub that answers every question with its
+reference query, so the numbers measure the pipeline, retrieval and the database rather than
+the model; the stub is not paced by the LLM scheduler. Pass `--llm live` to use the model
+configured by LLM_BACKEND instead, e.g. `LLM_BACKEND=replay` to replay completions recorded
+from real runs. Queries run against the database configured in `configs/.env`, which should
+hold the Sakila sample data.
+
+Run from the application directory:
+    python -m utils.benchmark --concurrency 4 --repeat 3 --save-baseline cache/benchmark.json
+    python -m utils.benchmark --concurrency 4 --repeat 3 --baseline cache/benchmark.json
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import argparse
+import statistics
+from decimal import Decimal
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatResult, ChatGeneration
+from tools.resources import resources
+from tools.llm_scheduler import llm_scheduler
+from tools.trace import use_trace
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(__file__), "test_data.txt")
+
+CATEGORY_PATTERN = re.compile(r"^\*\*(.+?)\*\*\s*$")
+QUESTION_PATTERN = re.compile(r"^(\d+)\.\s+(.+)$")
+SQL_BLOCK_PATTERN = re.compile(r"```sql\s*(.*?)```", re.DOTALL)
+
+def load_cases(path=TEST_DATA_PATH):
+    """
+    Reads the example questions of test_data.txt with their category and reference query.
+
+    Returns:
+        list: One dict per question with category, number, question and sql.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    cases, category = [], None
+    for block in re.split(r"\n(?=\*\*|\d+\.\s)", text):
+        first_line = block.strip().splitlines()[0] if block.strip() else ""
+        header = CATEGORY_PATTERN.match(first_line)
+        if header:
+            category = header.group(1)
+            continue
+        question = QUESTION_PATTERN.match(first_line)
+        sql = SQL_BLOCK_PATTERN.search(block)
+        if question and sql:
+            cases.append({
+                "category": category,
+                "number": int(question.group(1)),
+                "question": question.group(2).strip(),
+                "sql": sql.group(1).strip().rstrip(";").strip()
+            })
+    return cases
+
+class StubChatModel(BaseChatModel):
+    """
+    A deterministic chat model for the benchmark. SQL generation and correction prompts are
+    answered with the reference query of the example question they contain, question
+    validation with True and the insights prompt with a fixed text.
+    """
+
+    answers: dict
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "benchmark-stub"
+
+    def respond(self, prompt: str):
+        if "Results from Database:" in prompt:
+            return "Insights - benchmark stub answer."
+        # The SQL prompts embed the validation prompt, so they are recognized first.
+        if "SQL Query:" not in prompt:
+            return "True" if "Return only True or False" in prompt else ""
+        # Longest first, so a question that contains another one is not mistaken for it.
+        sql = next((self.answers[q] for q in sorted(self.answers, key=len, reverse=True) if q in prompt), "")
+        if "**Corrected SQL Query:**" in prompt:
+            return f"**Corrected SQL Query:**\n```sql\n{sql}\n```"
+        return sql
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        content = self.respond(messages[-1].content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def install_stub_llm(cases, latency: float = 0.0):
+    """Replaces both chat model resources with a `StubChatModel` answering `cases`, without rate limits."""
+    answers = {case["question"]: case["sql"] for case in cases}
+    for name in ("llm", "llm_tools"):
+        resources.register(name, lambda: StubChatModel(answers=answers, latency=latency))
+    llm_scheduler.set_limits(0, 0)
+
+def _normalize_value(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return repr(round(float(value), 6))
+    return str(value)
+
+def normalize_rows(rows):
+    """Turns result rows into a multiset that ignores the order of rows and of columns."""
+    return Counter(tuple(sorted(_normalize_value(value) for value in row)) for row in rows)
+
+def result_rows(result):
+    """Returns the data rows of an `execute_select_query` result, or None if it failed."""
+    if not isinstance(result, dict) or not isinstance(result.get("result"), list) or not result["result"]:
+        return None
+    return result["result"][1:]
+
+def reference_results(cases):
+    """Executes the reference query of every case, limited like the generated queries are."""
+    from tools.database_tools import execute_select_query
+    from tools.query_guard import inject_limit
+
+    references = {}
+    for case in cases:
+        result = execute_select_query(inject_limit(case["sql"]))
+        if not result.get("success", False):
+            print(f"reference query {case['number']} failed: {result.get('error')}", file=sys.stderr)
+        references[case["number"]] = result_rows(result)
+    return references
+
+def run_case(case):
+    """Answers one question in its own trace and returns the latency, spans and DB result."""
+    from pipeline_1 import chain
+
+    with use_trace() as trace:
+        start = time.perf_counter()
+        error = None
+        try:
+            chain.invoke({"question": case["question"]})
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - start
+    return {
+        "case": case,
+        "latency": latency,
+        "error": error,
+        "sql": trace.result("AI parsed_sql_query"),
+        "rows": result_rows(trace.get("Raw DB Query Result")),
+        "spans": list(trace.spans)
+    }
+
+def run_cases(cases, concurrency: int, repeat: int):
+    """Runs every case `repeat` times on `concurrency` threads. Returns the runs and the wall time."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(run_case, cases * repeat))
+    return runs, time.perf_counter() - start
+
+def percentile(values, q: float):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * q) - 1)]
+
+def latency_stats(seconds):
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        "p50": round(percentile(milliseconds, 0.5), 3),
+        "p95": round(percentile(milliseconds, 0.95), 3),
+        "mean": round(statistics.mean(milliseconds), 3),
+        "count": len(milliseconds)
+    }
+
+def build_report(runs, wall_time: float, references: dict, settings: dict):
+    """
+    Summarizes the runs: latency per request and per stage, throughput and accuracy.
+
+    A run matches when its rows equal those of the reference query, ignoring the order of
+    rows and columns.
+
+    Returns:
+        dict: settings, latency_ms (total and stages), throughput_rps, accuracy (overall and
+            by_category) and failures.
+    """
+    stages = defaultdict(list)
+    for run in runs:
+        for entry in run["spans"]:
+            if entry["parent_id"] is not None and entry["duration_ms"] is not None:
+                stages[entry["name"]].append(entry["duration_ms"] / 1000)
+
+    matches, by_category, failures = 0, defaultdict(lambda: [0, 0]), []
+    for run in runs:
+        case = run["case"]
+        expected = references.get(case["number"])
+        if run["error"]:
+            reason = run["error"]
+        elif run["rows"] is None:
+            reason = "no result rows"
+        elif expected is None:
+            reason = "reference query failed"
+        elif normalize_rows(run["rows"]) != normalize_rows(expected):
+            reason = f"rows differ ({len(run['rows'])} returned, {len(expected)} expected)"
+        else:
+            reason = None
+
+        by_category[case["category"]][1] += 1
+        if reason is None:
+            matches += 1
+            by_category[case["category"]][0] += 1
+        elif not any(f["number"] == case["number"] for f in failures):
+            failures.append({"number": case["number"], "question": case["question"], "sql": run["sql"], "reason": reason})
+
+    return {
+        "settings": settings,
+        "latency_ms": {
+            "total": latency_stats([run["latency"] for run in runs]),
+            "stages": {name: latency_stats(values) for name, values in sorted(stages.items())}
+        },
+        "throughput_rps": round(len(runs) / wall_time, 3),
+        "accuracy": {
+            "overall": round(matches / len(runs), 4),
+            "by_category": {category: round(hits / total, 4) for category, (hits, total) in by_category.items()}
+        },
+        "failures": failures
+    }
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float, min_delta_ms: float):
+    """
+    Lists the regressions of a report against a stored one.
+
+    A latency regresses when its p95 grows by more than `tolerance` (a fraction) and by more
+    than `min_delta_ms`, throughput when it drops by more than `tolerance`, and accuracy on
+    any drop.
+
+    Returns:
+        list: One description per regression; empty if there are none.
+    """
+    regressions = []
+    current, previous = report["latency_ms"], baseline["latency_ms"]
+    pairs = [("request", current["total"], previous["total"])] + [
+        (name, current["stages"][name], stats)
+        for name, stats in previous["stages"].items() if name in current["stages"]
+    ]
+    for name, now, before in pairs:
+        if now["p95"] > before["p95"] * (1 + tolerance) and now["p95"] - before["p95"] > min_delta_ms:
+            regressions.append(f"p95 latency of {name}: {before['p95']:.1f} ms -> {now['p95']:.1f} ms")
+
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput_rps']:.2f} -> {report['throughput_rps']:.2f} req/s")
+
+    accuracy, previous_accuracy = report["accuracy"], baseline["accuracy"]
+    if accuracy["overall"] < previous_accuracy["overall"]:
+        regressions.append(f"accuracy: {previous_accuracy['overall']:.1%} -> {accuracy['overall']:.1%}")
+    for category, before in previous_accuracy["by_category"].items():
+        now = accuracy["by_category"].get(category)
+        if now is not None and now < before:
+            regressions.append(f"accuracy of {category}: {before:.1%} -> {now:.1%}")
+    return regressions
+
+def print_report(report: dict):
+    settings = report["settings"]
+    print(f"{settings['cases']} questions x {settings['repeat']} passes, concurrency {settings['concurrency']}, "
+          f"{settings['llm']} LLM\n")
+    rows = [("request", report["latency_ms"]["total"])] + list(report["latency_ms"]["stages"].items())
+    for name, stats in rows:
+        print(f"{name:<22} p50 {stats['p50']:9.3f} ms   p95 {stats['p95']:9.3f} ms   "
+              f"mean {stats['mean']:9.3f} ms   n {stats['count']}")
+    print(f"\nthroughput             {report['throughput_rps']:.2f} req/s")
+    print(f"accuracy               {report['accuracy']['overall']:.1%}")
+    for category, value in report["accuracy"]["by_category"].items():
+        print(f"  {category:<36} {value:.1%}")
+    for failure in report["failures"]:
+        print(f"\nmismatch {failure['number']}: {failure['question']}\n  {failure['reason']}\n  SQL: {failure['sql']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=1, help="Questions answered at the same time.")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the example questions.")
+    parser.add_argument("--llm", choices=("stub", "live"), default="stub", help="Stub LLM, or the LLM_BACKEND model.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated latency of each stub LLM call, in seconds.")
+    parser.add_argument("--caches", action="store_true", help="Keep the semantic and SQL caches enabled.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the report to PATH as JSON.")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare with a report saved with --save-baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative latency and throughput change.")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore latency changes smaller than this.")
+    args = parser.parse_args()
+
+    if not args.caches:
+        # Read when the pipeline is imported; repeated passes would otherwise be served from cache.
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["SQL_CACHE_ENABLED"] = "false"
+
+    cases = load_cases()
+    if args.llm == "stub":
+        install_stub_llm(cases, args.llm_latency)
+    references = reference_results(cases)
+
+    runs, wall_time = run_cases(cases, args.concurrency, args.repeat)
+    settings = {"cases": len(cases), "repeat": args.repeat, "concurrency": args.concurrency, "llm": args.llm,
+                "llm_latency": args.llm_latency, "caches": args.caches}
+    report = build_report(runs, wall_time, references, settings)
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nbaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            print(f"\nwarning: baseline was recorded with {baseline['settings']}", file=sys.stderr)
+        regressions = compare_to_baseline(report, baseline, args.tolerance, args.min_delta_ms)
+        print("\nno regressions against the baseline" if not regressions else "\nregressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares schema retrieval latency of the ChromaDB and in-memory NumPy backends.
+
+Run from the application directory:
+    python -m utils.benchmark_retrieval --repeat 20
+"""
+import os
+import re
+import time
+import argparse
+import statistics
+from tools.resources import resources
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(__file__), "test_data.txt")
+
+def load_questions(path=TEST_DATA_PATH):
+    """Reads the numbered example questions from test_data.txt."""
+    with open(path, "r", encoding="utf-8") as f:
+        return re.findall(r"^\d+\.\s+(.+)$", f.read(), flags=re.MULTILINE)
+
+def time_calls(func, inputs, repeat):
+    """Calls `func` on every input `repeat` times and returns the latencies in milliseconds."""
+    latencies = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            func(item)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{name:<22} mean {statistics.mean(latencies):8.3f} ms   p50 {statistics.median(latencies):8.3f} ms   p95 {p95:8.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10, help="Passes over the example questions.")
+    parser.add_argument("--top-n", type=int, default=10, help="Results per query.")
+    args = parser.parse_args()
+
+    questions = load_questions()
+    embedding_model = resources.get("embedding_model")
+    collection = resources.get("schema_collection")
+    index = resources.get("numpy_index")
+    print(f"{len(questions)} questions x {args.repeat} passes, {len(index)} schema chunks, top {args.top_n}\n")
+
+    # Embeddings are computed once so that only the search itself is timed.
+    embeddings = embedding_model.encode(questions)
+
+    report("chroma query", time_calls(
+        lambda e: collection.query(query_embeddings=[e.tolist()], n_results=args.top_n), embeddings, args.repeat
+    ))
+    report("numpy query", time_calls(lambda e: index.query(e, args.top_n), embeddings, args.repeat))
+    report("numpy batch (all)", time_calls(lambda e: index.query_batch(e, args.top_n), [embeddings], args.repeat))
+
+    chroma_ids = collection.query(query_embeddings=embeddings.tolist(), n_results=args.top_n)["ids"]
+    numpy_ids = [[chunk_id for chunk_id, _, _ in hits] for hits in index.query_batch(embeddings, args.top_n)]
+    overlap = statistics.mean(len(set(a) & set(b)) / max(len(a), 1) for a, b in zip(chroma_ids, numpy_ids))
+    print(f"\nmean top-{args.top_n} overlap between backends: {overlap:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,54 @@ insert_sql_gen_prompt_template = PromptTemplate(
     input_variables=["schema_info", "question", "data"]
 )
 
+insert_column_mapping_prompt_template = PromptTemplate(
+    template="""
+    You are an expert database engineer. Based on the provided database schema information, choose the table the uploaded
+    CSV data should be inserted into and map each CSV column to a column of that table.
+    Map a CSV column to null if it has no matching column. DON'T GENERATE ANY NOTES
+
+    Schema Information:
+    {schema_info}
+
+    Question:
+    {question}
+
+    CSV Columns:
+    {csv_columns}
+
+    Sample Rows:
+    {sample_rows}
+
+    Return only a JSON object in this format:
+    {{"table": "<table name>", "columns": {{"<csv column>": "<table column or null>"}}}}
+    """,
+    input_variables=["schema_info", "question", "csv_columns", "sample_rows"]
+)
+
+delete_key_mapping_prompt_template = PromptTemplate(
+    template="""
+    You are an expert database engineer. Based on the provided database schema information, choose the table the rows
+    listed in the uploaded CSV data should be deleted from, and the CSV columns that identify those rows.
+    Map each identifying CSV column to the matching column of that table, preferably the primary key. DON'T GENERATE ANY NOTES
+
+    Schema Information:
+    {schema_info}
+
+    Question:
+    {question}
+
+    CSV Columns:
+    {csv_columns}
+
+    Sample Rows:
+    {sample_rows}
+
+    Return only a JSON object in this format:
+    {{"table": "<table name>", "keys": {{"<csv column>": "<table column>"}}}}
+    """,
+    input_variables=["schema_info", "question", "csv_columns", "sample_rows"]
+)
+
 delete_sql_gen_prompt_template = PromptTemplate(
     template="""
     You are an expert SQL Generator. Based on the provided database schema information, generate a syntactically correct SQL DELETE query.
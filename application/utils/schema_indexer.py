@@ -0,0 +1,27 @@
+"""
+Builds the structured schema index from the live MySQL information_schema.
+
+Writes one compact definition per table (columns, types, primary and foreign keys),
+the foreign-key adjacency used to add join-path tables at retrieval time, and the
+table embeddings. Enable it with SCHEMA_INDEX=structured.
+
+Run from the application directory:
+    python -m utils.schema_indexer
+"""
+from tools.schema_introspection import (
+    build_structured_index,
+    table_definition,
+    SchemaGraph,
+    STRUCTURED_SCHEMA_PATH,
+    TABLE_INDEX_PATH,
+)
+
+tables = build_structured_index()
+graph = SchemaGraph(tables)
+
+for name in sorted(tables):
+    print(table_definition(name, tables[name]))
+    if graph.neighbors(name):
+        print(f"    joins: {', '.join(sorted(graph.neighbors(name)))}")
+
+print(f"\nIndexed {len(tables)} tables into {STRUCTURED_SCHEMA_PATH} and {TABLE_INDEX_PATH}.")
@@ -1,6 +1,18 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
+"""
+Splits utils/schema.txt into sentences and incrementally syncs them into ChromaDB.
+
+Chunks are identified by a hash of their content, so only new or changed sentences are
+embedded, removed sentences are deleted, and unchanged ones are left alone.
+
+Run from the application directory:
+    python -m utils.schema_vector
+"""
+import hashlib
 import spacy
+from tools.resources import resources, CHROMA_COLLECTION
+from tools.sql_cache import SCHEMA_PATH
+
+UPSERT_BATCH_SIZE = 1000
 
 nlp = spacy.load("en_core_web_sm")
 
@@ -8,24 +20,57 @@ def split_text_by_sentence(text):
     doc = nlp(text)
     return [sent.text.strip() for sent in doc.sents if sent.text.strip()]
 
-with open("D:\\Internship\\text-to-SQL\\application\\utils\\schema.txt", "r", encoding="utf-8") as f:
-    text = f.read()
+def chunk_id(chunk: str):
+    """Returns a stable ID derived from the chunk's content."""
+    return hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16]
 
-chunks = split_text_by_sentence(text)
+def sync_chunks(collection, chunks, embedding_model, batch_size: int = UPSERT_BATCH_SIZE):
+    """
+    Brings the collection in line with the given chunks.
 
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    New chunks are embedded in one batched encode call and written with bulk upserts
+    before stale chunks are deleted, so the collection never lacks current content.
 
-embeddings = embedding_model.encode(chunks).tolist()
+    Args:
+        collection (chromadb.Collection): The collection to update.
+        chunks (list): The current schema chunks.
+        embedding_model (SentenceTransformer): The model used to embed new chunks.
+        batch_size (int, optional): Number of chunks per upsert call.
 
-chroma_client = chromadb.PersistentClient(path="D:\\Internship\\text-to-SQL\\application\\chroma")
-collection = chroma_client.get_or_create_collection(name="sql_data")
+    Returns:
+        dict: Counts of added, removed and unchanged chunks.
+    """
+    current = {}
+    for chunk in chunks:
+        current.setdefault(chunk_id(chunk), chunk)
 
-for i, chunk in enumerate(chunks):
-    collection.add(
-        ids=[str(i)],  
-        documents=[chunk],  
-        embeddings=[embeddings[i]]  
-    )
+    existing = set(collection.get(include=[])["ids"])
+    added = [cid for cid in current if cid not in existing]
+    removed = [cid for cid in existing if cid not in current]
+
+    if added:
+        embeddings = embedding_model.encode([current[cid] for cid in added]).tolist()
+        for start in range(0, len(added), batch_size):
+            collection.upsert(
+                ids=added[start:start + batch_size],
+                documents=[current[cid] for cid in added[start:start + batch_size]],
+                embeddings=embeddings[start:start + batch_size]
+            )
 
-print("Text has been successfully processed and stored in ChromaDB.")
-collection
\ No newline at end of file
+    for start in range(0, len(removed), batch_size):
+        collection.delete(ids=removed[start:start + batch_size])
+
+    return {"added": len(added), "removed": len(removed), "unchanged": len(current) - len(added)}
+
+if __name__ == "__main__":
+    with open(SCHEMA_PATH, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    chunks = split_text_by_sentence(text)
+    collection = resources.get("chroma_client").get_or_create_collection(name=CHROMA_COLLECTION)
+    report = sync_chunks(collection, chunks, resources.get("embedding_model"))
+
+    print(
+        f"Schema index synced: {report['added']} added, {report['removed']} removed, "
+        f"{report['unchanged']} unchanged ({collection.count()} chunks in '{CHROMA_COLLECTION}')."
+    )
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The application modules are imported as `tools.*`, relative to the application directory.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
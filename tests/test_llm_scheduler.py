@@ -0,0 +1,88 @@
+import threading
+from concurrent.futures import CancelledError
+import pytest
+from tools.llm_scheduler import TokenBucket, LLMScheduler, STAGE_PRIORITIES, cancel_on
+from tools.retry_policy import QueueTimeoutError, classify_error
+
+def test_token_bucket_starts_full_and_refills_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=10)
+    assert bucket.level == 10
+    start = bucket._updated
+    bucket.level = 0
+    bucket.refill(start + 3)
+    assert bucket.level == 6
+    bucket.refill(start + 100)
+    assert bucket.level == 10
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(rate=2, capacity=10)
+    bucket.level = 4
+    assert bucket.wait_time(4) == 0.0
+    assert bucket.wait_time(8) == 2.0
+    # Requests larger than the bucket wait for a full bucket rather than forever.
+    assert bucket.wait_time(50) == 3.0
+
+def test_higher_priority_stage_goes_first():
+    scheduler = LLMScheduler(max_rps=100, max_tpm=0)
+    insights = scheduler._enqueue(STAGE_PRIORITIES["insights"])
+    generation = scheduler._enqueue(STAGE_PRIORITIES.get("sql_generation", 0))
+    assert scheduler._try_take(insights, 0) is None
+    assert scheduler._try_take(generation, 0) == 0.0
+    assert scheduler._try_take(insights, 0) == 0.0
+    assert scheduler.depth() == 0
+
+def test_equal_priorities_keep_arrival_order():
+    scheduler = LLMScheduler(max_rps=100, max_tpm=0)
+    first = scheduler._enqueue(0)
+    second = scheduler._enqueue(0)
+    assert scheduler._try_take(second, 0) is None
+    assert scheduler._try_take(first, 0) == 0.0
+
+def test_head_of_queue_waits_for_tokens():
+    scheduler = LLMScheduler(max_rps=0, max_tpm=600)
+    ticket = scheduler._enqueue(0)
+    scheduler.tokens.level = 0
+    assert scheduler._try_take(ticket, 100) == pytest.approx(10.0, abs=0.1)
+    assert scheduler.depth() == 1
+
+def test_settle_returns_unused_tokens():
+    scheduler = LLMScheduler(max_rps=0, max_tpm=6000)
+    scheduler.acquire(1000)
+    level = scheduler.tokens.level
+    scheduler.settle(reserved=1000, used=400)
+    assert scheduler.tokens.level >= level + 600
+
+def test_queue_timeout_is_raised_and_not_retried():
+    scheduler = LLMScheduler(max_rps=1, max_tpm=0, timeout=0.05)
+    scheduler.acquire(0)
+    with pytest.raises(QueueTimeoutError) as error:
+        scheduler.acquire(0, stage="insights")
+    assert classify_error(error.value) == "queue_timeout"
+    assert scheduler.depth() == 0
+
+def test_cancelled_call_gives_up_while_queued():
+    scheduler = LLMScheduler(max_rps=1, max_tpm=0, timeout=5)
+    scheduler.acquire(0)
+    event = threading.Event()
+    outcome = []
+
+    def queued_call():
+        with cancel_on(event):
+            try:
+                scheduler.acquire(0, stage="sql_generation")
+                outcome.append("admitted")
+            except CancelledError:
+                outcome.append("cancelled")
+
+    thread = threading.Thread(target=queued_call)
+    thread.start()
+    scheduler.cancel(event)
+    thread.join(timeout=2)
+    assert outcome == ["cancelled"]
+    assert scheduler.depth() == 0
+
+def test_calls_outside_cancel_on_are_unaffected():
+    scheduler = LLMScheduler(max_rps=100, max_tpm=0)
+    event = threading.Event()
+    event.set()
+    assert scheduler.acquire(0) >= 0.0
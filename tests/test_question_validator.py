@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from tools.question_validator import QuestionValidator, parse_validation_output
+
+VOCABULARY = {"tables": {"film", "customer", "rental"}, "columns": {"first_name", "last_name", "rental_date"}}
+
+def constant_embed(texts):
+    return np.ones((len(texts), 4), dtype=np.float32)
+
+def orthogonal_embed(texts):
+    # Every question points away from every example.
+    return np.array([[1, 0, 0, 0] if text.startswith("list") else [0, 1, 0, 0] for text in texts], dtype=np.float32)
+
+@pytest.fixture
+def validator():
+    return QuestionValidator(vocabulary=VOCABULARY, examples=["list all films"], embed=constant_embed)
+
+@pytest.mark.parametrize("text, expected", [
+    ("True", True),
+    ("false", False),
+    ("True.", True),
+    ("**False** - the question is about the weather.", False),
+    ("The answer is True", True),
+    ("It is true that this is not false", False),
+    ("", False),
+])
+def test_parse_validation_output(text, expected):
+    assert parse_validation_output(text) is expected
+
+@pytest.mark.parametrize("question", ["Hi!", "hello there", "Thanks, bye", "Thank you very much.", "how are you?"])
+def test_small_talk_is_invalid(validator, question):
+    assert validator.classify(question)[0] is False
+
+@pytest.mark.parametrize("question", [
+    "Hi, list all customers with their rentals",
+    "Thanks! Now show the top 10 films",
+    "Hello, what is the first name of each customer?",
+])
+def test_greeting_before_a_question_is_not_small_talk(validator, question):
+    assert validator.classify(question)[0] is not False
+
+def test_question_addressed_to_the_assistant_is_escalated(validator):
+    assert validator.classify("How are you storing customer emails?")[0] is None
+
+def test_one_word_question_is_not_rejected_for_its_length(validator):
+    assert validator.classify("Customers?")[0] is not False
+
+def test_question_about_two_tables_is_valid(validator):
+    decision, reason = validator.classify("List every customer and their rental count")
+    assert decision is True
+    assert "customer" in reason and "rental" in reason
+
+def test_multi_word_column_makes_question_valid(validator):
+    assert validator.classify("Show the first name of each customer")[0] is True
+
+def test_unrelated_question_is_invalid():
+    validator = QuestionValidator(vocabulary=VOCABULARY, examples=["list all films"], embed=orthogonal_embed,
+                                  invalid_similarity=0.15)
+    decision, reason = validator.classify("What will the weather be tomorrow in Paris")
+    assert decision is False
+    assert reason.startswith("unrelated to the schema")
+
+def test_stats_count_decisions(validator):
+    validator.classify("Hi!")
+    validator.classify("List every customer and their rental count")
+    validator.classify("How are you storing customer emails?")
+    validator.record_agreement(True, True)
+    validator.record_agreement(False, True)
+    stats = validator.stats()
+    assert (stats["rules_valid"], stats["rules_invalid"], stats["escalated"]) == (1, 1, 1)
+    assert stats["fast_path_rate"] == pytest.approx(2 / 3)
+    assert stats["agreement_rate"] == 0.5
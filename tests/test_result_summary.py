@@ -0,0 +1,54 @@
+import datetime
+from tools.result_summary import summarize_result, estimate_tokens
+
+COLUMNS = ["film_id", "title", "rating", "last_update"]
+
+def film_rows(count):
+    ratings = ["G", "PG", "PG-13", "R"]
+    return [
+        (i, f"FILM {i}", ratings[i % len(ratings)], datetime.date(2006, 1, 1) + datetime.timedelta(days=i))
+        for i in range(1, count + 1)
+    ]
+
+def test_small_result_is_passed_through():
+    result = [tuple(COLUMNS)] + film_rows(3)
+    assert summarize_result(result, COLUMNS) == str(result)
+
+def test_message_is_passed_through():
+    assert summarize_result("Query executed successfully.") == "Query executed successfully."
+
+def test_long_message_is_truncated():
+    text = summarize_result("x" * 10000, max_tokens=100)
+    assert text.endswith(" ... [truncated]")
+    assert estimate_tokens(text) <= 100
+
+def test_large_result_is_summarized():
+    result = [tuple(COLUMNS)] + film_rows(200)
+    digest = summarize_result(result, COLUMNS, full_rows=50, sample_rows=2, max_tokens=1500)
+    assert digest.startswith("Columns: film_id, title, rating, last_update\nRow count: 200")
+    assert "First rows:\n  1 | FILM 1 | PG | 2006-01-02" in digest
+    assert "Last rows:" in digest and "FILM 200" in digest
+    assert "- film_id (numeric): min 1, max 200, mean 100.5" in digest
+    assert "- rating (categorical, 4 distinct)" in digest
+    assert "- last_update (date): from 2006-01-02 to 2006-07-20" in digest
+    assert "- title (text, all values distinct)" in digest
+
+def test_few_rows_over_budget_are_summarized():
+    result = [("id", "description")] + [(i, "y" * 400) for i in range(10)]
+    digest = summarize_result(result, ["id", "description"], full_rows=50, max_tokens=200)
+    assert digest.startswith("Columns: id, description")
+    assert estimate_tokens(digest) <= 200
+
+def test_summary_fits_the_token_budget():
+    result = [tuple(COLUMNS)] + film_rows(5000)
+    for max_tokens in (50, 200, 1500):
+        assert estimate_tokens(summarize_result(result, COLUMNS, max_tokens=max_tokens)) <= max_tokens
+
+def test_truncated_result_says_so():
+    result = [tuple(COLUMNS)] + film_rows(100)
+    digest = summarize_result(result, COLUMNS, truncated=True, full_rows=50)
+    assert "Row count: 100 (capped when fetched, the full result has more rows)" in digest
+
+def test_header_row_is_detected_without_columns():
+    result = [tuple(COLUMNS)] + film_rows(100)
+    assert summarize_result(result, full_rows=10).startswith("Columns: film_id, title, rating, last_update")
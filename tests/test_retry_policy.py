@@ -0,0 +1,104 @@
+import httpx
+import pytest
+from tools.retry_policy import RetryPolicy, QueueTimeoutError, classify_error, TRANSIENT_ERRORS
+
+def http_error(status, headers=None):
+    request = httpx.Request("POST", "https://api.example.com")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+@pytest.mark.parametrize("error, expected", [
+    ("1054 (42S22): Unknown column 'nme' in 'field list'", "unknown_column"),
+    ("1146 (42S02): Table 'sakila.films' doesn't exist", "unknown_table"),
+    ("1064 (42000): You have an error in your SQL syntax near 'FORM film'", "syntax"),
+    ("2013 (HY000): Lost connection to MySQL server during query", "connection"),
+    ("3024 (HY000): Query execution was interrupted, maximum statement execution time exceeded", "timeout"),
+    ("Query rejected before execution: it would scan 2000000 rows", "too_expensive"),
+    ("Too many requests", "rate_limit"),
+    ("something else went wrong", "other"),
+])
+def test_classify_error_messages(error, expected):
+    assert classify_error(error) == expected
+
+@pytest.mark.parametrize("error", [
+    "1054 (42S22): Unknown column 'x' in 'where clause' near 'WHERE id = 429'",
+    "1064 (42000): You have an error in your SQL syntax near 'LIMIT 429'",
+])
+def test_classify_error_ignores_429_in_sql_literals(error):
+    assert classify_error(error) not in TRANSIENT_ERRORS
+
+def test_classify_error_uses_http_status():
+    assert classify_error(http_error(429)) == "rate_limit"
+    assert classify_error(http_error(500)) == "other"
+
+def test_classify_error_uses_status_code_attribute():
+    error = RuntimeError("request failed")
+    error.status_code = 429
+    assert classify_error(error) == "rate_limit"
+
+def test_queue_timeout_is_not_retried():
+    error = QueueTimeoutError("LLM call (insights) waited more than 120s for the rate limiter.")
+    assert classify_error(error) == "queue_timeout"
+    assert "queue_timeout" not in TRANSIENT_ERRORS
+
+def test_retry_state_stops_after_max_attempts():
+    state = RetryPolicy(max_attempts=2, deadline=60, token_budget=0).start()
+    assert state.stop_reason() is None
+    state.begin_attempt()
+    state.begin_attempt()
+    assert state.stop_reason() == "reached 2 attempts"
+
+def test_retry_state_stops_at_token_budget():
+    state = RetryPolicy(max_attempts=5, deadline=60, token_budget=1000).start()
+    state.begin_attempt(800)
+    assert state.stop_reason(100) is None
+    assert state.stop_reason(300) == "would exceed the 1000 token budget"
+
+def test_retry_state_stops_at_deadline():
+    state = RetryPolicy(max_attempts=5, deadline=0, token_budget=0).start()
+    assert state.stop_reason() == "passed the 0s deadline"
+
+def test_retry_state_only_waits_for_transient_errors():
+    state = RetryPolicy(base_delay=1, max_delay=4, deadline=60, jitter=False).start()
+    assert state.delay("syntax") == 0.0
+    assert state.delay("connection") == 1.0
+    state.begin_attempt()
+    assert state.delay("connection") == 2.0
+
+def test_backoff_honors_retry_after_up_to_max_delay():
+    policy = RetryPolicy(max_delay=10, jitter=False)
+    assert policy.backoff(0, http_error(429, {"retry-after": "3"})) == 3.0
+    assert policy.backoff(0, http_error(429, {"retry-after": "30"})) == 10.0
+
+def test_compact_error_keeps_last_error_in_full():
+    state = RetryPolicy().start()
+    state.add_failure("unknown_column", "Unknown column 'nme'" + " x" * 200)
+    state.add_failure("connection", "Lost connection to MySQL server")
+    state.add_failure("syntax", "You have an error in your SQL syntax")
+    compact = state.compact_error()
+    assert compact.startswith("You have an error in your SQL syntax\nEarlier attempts also failed:")
+    assert "- unknown_column: Unknown column 'nme'" in compact
+    assert "connection" not in compact
+    assert len(compact.splitlines()[-1]) <= len("- unknown_column: ") + 160
+
+def test_call_retries_transient_errors_only():
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0, deadline=60, jitter=False)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("2006 (HY000): MySQL server has gone away")
+        return "done"
+
+    assert policy.call(flaky) == "done"
+    assert len(calls) == 3
+
+    def broken():
+        calls.append(1)
+        raise RuntimeError("1064 (42000): You have an error in your SQL syntax")
+
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        policy.call(broken)
+    assert len(calls) == 1
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from tools import semantic_cache as semantic_cache_module
+from tools.semantic_cache import SemanticCache, question_literals, extract_tables
+
+def same_embedding(question):
+    # Every question looks the same, so only the literals tell them apart.
+    return np.ones(4, dtype=np.float32)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(semantic_cache_module.time, "monotonic", fake.monotonic)
+    return fake
+
+@pytest.mark.parametrize("question, expected", [
+    ("Show the top 10 films", {"10"}),
+    ("Show the top ten films", {"10"}),
+    ("Which films star Penelope Guiness?", {"penelope", "guiness"}),
+    ("Films rated 'PG-13' longer than 90.5 minutes", {"pg-13", "90.5"}),
+    ('List customers in "Buenos Aires"', {"buenos aires"}),
+    ("List all films", set()),
+])
+def test_question_literals(question, expected):
+    assert question_literals(question) == frozenset(expected)
+
+def test_first_word_is_not_a_named_entity():
+    assert question_literals("Customers from Canada") == frozenset({"canada"})
+
+def test_extract_tables():
+    sql = "SELECT f.title FROM film f JOIN sakila.film_actor fa ON f.film_id = fa.film_id"
+    assert extract_tables(sql) == {"film", "film_actor"}
+
+def test_hit_requires_matching_literals(clock):
+    cache = SemanticCache(embed=same_embedding, threshold=0.9, ttl=60, max_entries=10)
+    cache.store("Show the top 10 films", "SELECT title FROM film LIMIT 10")
+    assert cache.lookup("Show the top 20 films") is None
+    assert cache.lookup("show the top ten films")["sql"] == "SELECT title FROM film LIMIT 10"
+    assert cache.stats()["literal_mismatches"] == 1
+
+def test_lookup_falls_through_to_matching_candidate(clock):
+    cache = SemanticCache(embed=same_embedding, threshold=0.9, ttl=60, max_entries=10)
+    cache.store("Show the top 10 films", "SELECT title FROM film LIMIT 10")
+    cache.store("Show the top 20 films", "SELECT title FROM film LIMIT 20")
+    assert cache.lookup("Show the top 10 films")["sql"] == "SELECT title FROM film LIMIT 10"
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticCache(embed=same_embedding, threshold=0.9, ttl=60, max_entries=10)
+    cache.store("List all films", "SELECT * FROM film")
+    clock.now += 59
+    assert cache.lookup("List all films") is not None
+    clock.now += 2
+    assert cache.lookup("List all films") is None
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = SemanticCache(embed=same_embedding, threshold=0.9, ttl=60, max_entries=2)
+    cache.store("Show film 1", "SELECT 1")
+    cache.store("Show film 2", "SELECT 2")
+    cache.lookup("Show film 1")
+    cache.store("Show film 3", "SELECT 3")
+    assert cache.lookup("Show film 1") is not None
+    assert cache.lookup("Show film 2") is None
+    assert cache.lookup("Show film 3") is not None
+
+def test_invalidate_tables_drops_entries_reading_them(clock):
+    cache = SemanticCache(embed=same_embedding, threshold=0.9, ttl=60, max_entries=10)
+    cache.store("List all films", "SELECT * FROM film")
+    cache.store("List all Customers", "SELECT * FROM customer")
+    assert cache.invalidate_tables(["FILM"]) == 1
+    assert cache.lookup("List all films") is None
+    assert cache.lookup("List all Customers") is not None